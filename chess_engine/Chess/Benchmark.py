@@ -0,0 +1,83 @@
+"""
+Fixed depth search benchmark: searches the same positions every run and reports node counts,
+so search changes (move ordering, pruning...) can be compared at equal depth
+python Benchmark.py --depth 4 [--no-ordering] [--no-pruning] [--bitboards] [--workers N] [--profile FILE]
+"""
+
+import argparse
+import logging
+import random
+import time
+import ChessEngine, SmartMoveFinder, Bitboards, Profiler, UCI
+
+# positions reached by playing these moves from the start
+BENCH_POSITIONS = [
+    [],
+    ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5', 'a7a6', 'b5a4', 'g8f6', 'e1g1', 'f8e7'],
+    ['d2d4', 'g8f6', 'c2c4', 'e7e6', 'b1c3', 'f8b4', 'e2e3', 'e8g8'],
+    ['e2e4', 'c7c5', 'g1f3', 'd7d6', 'd2d4', 'c5d4', 'f3d4', 'g8f6', 'b1c3', 'a7a6'],
+    ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'f8c5', 'c2c3', 'g8f6', 'd2d4', 'e5d4', 'c3d4', 'c5b4'],
+    ['d2d4', 'd7d5', 'c2c4', 'c7c6', 'g1f3', 'g8f6', 'b1c3', 'd5c4', 'a2a4', 'c8f5'],
+    ['e2e4', 'e7e6', 'd2d4', 'd7d5', 'b1c3', 'f8b4', 'e4e5', 'c7c5', 'a2a3', 'b4c3', 'b2c3'],
+    ['e2e4', 'd7d5', 'e4d5', 'd8d5', 'b1c3', 'd5a5', 'd2d4', 'g8f6', 'g1f3', 'c8f5', 'f3e5', 'c7c6'],
+]
+
+
+'''
+Play moves given in coordinate notation (e2e4) on gs, raises ValueError for illegal ones
+'''
+
+
+def playMoves(gs, notations):
+    for notation in notations:
+        move = UCI.findMove(gs, notation)
+        if move is None:
+            raise ValueError('illegal move ' + notation)
+        gs.makeMove(move)
+    return gs
+
+
+def runBenchmark(depth, bitboards=False, workers=1, moveOrdering=True, selective=True):
+    total = SmartMoveFinder.SearchStats()
+    startTime = time.time()
+    for i in range(len(BENCH_POSITIONS)):
+        gs = Bitboards.BitboardGameState() if bitboards else ChessEngine.GameState()
+        playMoves(gs, BENCH_POSITIONS[i])
+        random.seed(i)  # Search.run shuffles the root moves
+        search = SmartMoveFinder.Search(timeLimit=0, nodeLimit=0, maxDepth=depth, workers=workers,
+                                        moveOrdering=moveOrdering, selective=selective)
+        bestMove = search.run(gs)
+        total.add(search.stats)
+        print('position %d: best %s %s' % (i+1, bestMove, search.stats))
+    total.time = time.time() - startTime
+    print('total nodes %d qnodes %d time %.2fs nps %d cutoffs %.1f%% first %.1f%% tt hits %.1f%%' % (
+        total.nodes, total.qnodes, total.time, total.nps(), 100*total.betaCutoffRate(),
+        100*total.firstMoveCutoffRate(), 100*total.ttHitRate()))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fixed depth search benchmark')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--no-ordering', action='store_true', help='search moves in generation order')
+    parser.add_argument('--no-pruning', action='store_true', help='no null move pruning or late move reductions')
+    parser.add_argument('--bitboards', action='store_true', help='use the bitboard GameState backend')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='time the move generator and evaluation, write collapsed stacks to FILE')
+    parser.add_argument('--workers', type=int, default=1, help='processes for the parallel root search')
+    parser.add_argument('--verbose', action='store_true', help='log the stats of every iteration')
+    args = parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+    profiler = Profiler.Profiler() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    runBenchmark(args.depth, args.bitboards, args.workers, not args.no_ordering, not args.no_pruning)
+    if profiler is not None:
+        profiler.disable()
+        profiler.report()
+        profiler.writeCollapsed(args.profile)
+
+
+if __name__ == '__main__':
+    main()
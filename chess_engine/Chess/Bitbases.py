@@ -0,0 +1,481 @@
+"""
+Win/draw/loss bitbases for the endings of 3 and 4 pieces (kings included), solved by retrograde
+analysis on the move generator of ChessEngine. Every ending is one file of 2 bits per position,
+memory mapped when loaded, so a probe costs an index computation and one byte read.
+python Bitbases.py [--dir DIR] [--workers N]               the 3 piece endings
+python Bitbases.py KRvKP KQvKR [--dir DIR] [--workers N]   these and the endings they turn into
+A 3 piece ending takes seconds, a 4 piece one has 64 times the positions and takes a while
+"""
+
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+from ChessEngine import GameState, CastleRights, KING_OFFSETS, KNIGHT_OFFSETS, MOVE_KIND_MASK, MOVE_PROMOTION
+from Evaluation import pieceScore
+
+# results for the side to move, ILLEGAL marks indexes that aren't a position that can occur
+DRAW, WIN, LOSS, ILLEGAL = 0, 1, 2, 3
+# while solving: no result yet, and no result yet but a capture or promotion draws
+UNRESOLVED, UNRESOLVED_DRAW = 4, 5
+MAX_PIECES = 4
+BITBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bitbases')
+FILE_SUFFIX = '.bb'
+HEADER = struct.Struct('>4sI')  # magic, number of positions
+MAGIC = b'WDL1'
+PIECE_ORDER = 'QRBNP'  # pieces after the king in an ending name
+DEFAULT_ENDINGS = ('KQvK', 'KRvK', 'KBvK', 'KNvK', 'KPvK')
+CHUNK_SIZE = 8192  # positions a generator worker classifies per task
+
+KING_TARGETS = tuple(tuple((r+dr)*8 + c+dc for dr, dc in KING_OFFSETS if 0 <= r+dr < 8 and 0 <= c+dc < 8)
+                     for r in range(8) for c in range(8))
+KNIGHT_TARGETS = tuple(tuple((r+dr)*8 + c+dc for dr, dc in KNIGHT_OFFSETS if 0 <= r+dr < 8 and 0 <= c+dc < 8)
+                       for r in range(8) for c in range(8))
+
+
+def _rays(r, c, offsets):
+    rays = []
+    for dr, dc in offsets:
+        ray = []
+        row, col = r+dr, c+dc
+        while 0 <= row < 8 and 0 <= col < 8:
+            ray.append(row*8 + col)
+            row, col = row+dr, col+dc
+        rays.append(tuple(ray))
+    return tuple(rays)
+
+
+# squares along every direction a slider moves in, nearest first
+SLIDER_RAYS = {'R': tuple(_rays(r, c, KING_OFFSETS[:4]) for r in range(8) for c in range(8)),
+               'B': tuple(_rays(r, c, KING_OFFSETS[4:]) for r in range(8) for c in range(8)),
+               'Q': tuple(_rays(r, c, KING_OFFSETS) for r in range(8) for c in range(8))}
+
+# the generator's game state, bitbases and ending in a generator process (set by initGenerator)
+generatorGameState = None
+generatorBitbases = None
+generatorEnding = None
+
+
+'''
+Name of the ending where white has the pieces white and black the pieces black (letters of
+PIECE_ORDER, with or without the king) with the stronger side first, like KRvKP, and whether
+black's pieces came first, then the position is looked up with the colors swapped
+'''
+
+
+def endingName(white, black):
+    white = 'K' + ''.join(sorted(white.replace('K', ''), key=PIECE_ORDER.index))
+    black = 'K' + ''.join(sorted(black.replace('K', ''), key=PIECE_ORDER.index))
+    if sideStrength(black) > sideStrength(white):
+        return black + 'v' + white, True
+    return white + 'v' + black, False
+
+
+def sideStrength(pieces):
+    return sum(pieceScore['p' if piece == 'P' else piece] for piece in pieces), len(pieces), pieces
+
+
+'''
+Index of the position with the pieces on squares (in the order of Ending.pieces) and the side
+to move. Positions with the white king on files e-h are mirrored to files a-d first
+'''
+
+
+def positionIndex(squares, whiteToMove):
+    if squares[0] & 7 > 3:
+        squares = [sq ^ 7 for sq in squares]
+    index = (squares[0] >> 3)*4 + (squares[0] & 7)
+    for i in range(1, len(squares)):
+        index = index*64 + squares[i]
+    return index*2 + (0 if whiteToMove else 1)
+
+
+'''
+Squares of the count pieces and the side to move of an index, the inverse of positionIndex
+'''
+
+
+def positionSquares(index, count):
+    whiteToMove = index & 1 == 0
+    index >>= 1
+    squares = [0] * count
+    for i in range(count-1, 0, -1):
+        squares[i] = index & 63
+        index >>= 6
+    squares[0] = (index >> 2)*8 + (index & 3)
+    return squares, whiteToMove
+
+
+class Ending():
+    '''
+    Layout of the table of one ending: its pieces in index order (white king, black king,
+    white's other pieces, black's other pieces) and its number of positions
+    '''
+
+    def __init__(self, name):
+        sides = name.split('v')
+        if len(sides) != 2 or not all(side[:1] == 'K' and set(side[1:]) <= set(PIECE_ORDER) for side in sides) or \
+                endingName(*sides) != (name, False):
+            raise ValueError('not an ending name like KRvKP: %r' % name)
+        if not 3 <= len(name) - 1 <= MAX_PIECES:
+            raise ValueError('bitbases are made for 3 to %d pieces: %r' % (MAX_PIECES, name))
+        if 'P' in sides[0] and 'P' in sides[1]:
+            # a double step could be answered en passant, which the positions don't record
+            raise ValueError('endings with pawns on both sides are not supported: %r' % name)
+        self.name = name
+        self.pieces = ['wK', 'bK'] + ['w' + ('p' if piece == 'P' else piece) for piece in sides[0][1:]] + \
+                      ['b' + ('p' if piece == 'P' else piece) for piece in sides[1][1:]]
+        self.size = 2 * 32 * 64**(len(self.pieces)-1)
+
+    '''
+    The endings a capture or a promotion in this one leads to, without the bare kings
+    '''
+
+    def subEndings(self):
+        white, black = self.name.split('v')
+        endings = set()
+        for i in range(1, len(white)):
+            endings.add(endingName(white[:i] + white[i+1:], black)[0])
+            if white[i] == 'P':
+                for piece in 'QRBN':
+                    endings.add(endingName(white[:i] + piece + white[i+1:], black)[0])
+        for i in range(1, len(black)):
+            endings.add(endingName(white, black[:i] + black[i+1:])[0])
+            if black[i] == 'P':
+                for piece in 'QRBN':
+                    endings.add(endingName(white, black[:i] + piece + black[i+1:])[0])
+        endings.discard('KvK')
+        return sorted(endings, key=len)
+
+
+class Bitbases():
+    '''
+    The bitbases of a directory, every <ending>.bb file in it memory mapped, or none to start
+    with (the generator adds the tables it makes with addTable). A table is its file contents:
+    the header, then 4 positions per byte, the position of index i in bits 2*(i%4) of byte i//4
+    '''
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.tables = {}  # ending name: file contents (mmap or bytes)
+        self.maxPieces = 2
+        if directory is not None:
+            for fileName in sorted(os.listdir(directory)):
+                if fileName.endswith(FILE_SUFFIX):
+                    self.load(os.path.join(directory, fileName))
+
+    def load(self, path):
+        name = os.path.basename(path)[:-len(FILE_SUFFIX)]
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.addTable(name, data)
+        except ValueError:
+            data.close()
+            raise
+
+    def addTable(self, name, data):
+        ending = Ending(name)
+        if len(data) < HEADER.size:
+            raise ValueError('%s: not a bitbase' % name)
+        magic, size = HEADER.unpack_from(data)
+        if magic != MAGIC or size != ending.size or len(data) != HEADER.size + (size+3)//4:
+            raise ValueError('%s: not a bitbase of this ending' % name)
+        self.tables[name] = data
+        self.maxPieces = max(self.maxPieces, len(ending.pieces))
+
+    def close(self):
+        for data in self.tables.values():
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self.tables = {}
+        self.maxPieces = 2
+
+    '''
+    WIN, DRAW or LOSS for the side to move in gs, None when there's no table for it or the position
+    has castling rights, which the tables leave out. An en passant square can be ignored: there are
+    no tables with pawns on both sides
+    '''
+
+    def probe(self, gs):
+        rights = gs.currentCastlingRight
+        if rights.wks or rights.wqs or rights.bks or rights.bqs:
+            return None
+        white, black = [], []  # (piece letter, sq) of the pieces besides the kings
+        sq = 0
+        for row in gs.board:
+            for piece in row:
+                if piece != '--' and piece[1] != 'K':
+                    (white if piece[0] == 'w' else black).append((PIECE_ORDER.index(piece[1].upper()), sq))
+                sq += 1
+        if not white and not black:
+            return DRAW
+        white.sort()
+        black.sort()
+        name, swapped = endingName(''.join(PIECE_ORDER[piece] for piece, sq in white),
+                                   ''.join(PIECE_ORDER[piece] for piece, sq in black))
+        data = self.tables.get(name)
+        if data is None:
+            return None
+        whiteKing = gs.whiteKingLocation[0]*8 + gs.whiteKingLocation[1]
+        blackKing = gs.blackKingLocation[0]*8 + gs.blackKingLocation[1]
+        if swapped:  # black's pieces play white's part, seen from the other side of the board
+            squares = [blackKing ^ 56, whiteKing ^ 56] + [sq ^ 56 for piece, sq in black] + \
+                      [sq ^ 56 for piece, sq in white]
+            index = positionIndex(squares, not gs.whiteToMove)
+        else:
+            squares = [whiteKing, blackKing] + [sq for piece, sq in white] + [sq for piece, sq in black]
+            index = positionIndex(squares, gs.whiteToMove)
+        result = (data[HEADER.size + (index >> 2)] >> ((index & 3)*2)) & 3
+        return None if result == ILLEGAL else result
+
+
+'''
+Squares a piece standing on sq of the side that just moved could have come from without
+capturing: the ones it moves to on an empty path, except for pawns, which step back
+'''
+
+
+def moveOrigins(piece, sq, occupied):
+    kind = piece[1]
+    if kind == 'K':
+        return [origin for origin in KING_TARGETS[sq] if origin not in occupied]
+    if kind == 'N':
+        return [origin for origin in KNIGHT_TARGETS[sq] if origin not in occupied]
+    if kind == 'p':
+        row = sq >> 3
+        step, startRow = (8, 6) if piece[0] == 'w' else (-8, 1)
+        origins = []
+        if 1 <= row + step//8 <= 6 and sq+step not in occupied:
+            origins.append(sq+step)
+            if row + 2*(step//8) == startRow and sq + 2*step not in occupied:
+                origins.append(sq + 2*step)
+        return origins
+    origins = []
+    for ray in SLIDER_RAYS[kind][sq]:
+        for origin in ray:
+            if origin in occupied:
+                break
+            origins.append(origin)
+    return origins
+
+
+'''
+Set up a generator process (or the calling one) for the ending name, tables has the contents
+of the tables of the endings it leads to by name
+'''
+
+
+def initGenerator(name, tables):
+    global generatorGameState, generatorBitbases, generatorEnding
+    generatorEnding = Ending(name)
+    generatorBitbases = Bitbases()
+    for tableName, data in tables.items():
+        generatorBitbases.addTable(tableName, data)
+    gs = GameState()
+    gs.board = [['--'] * 8 for r in range(8)]
+    gs.currentCastlingRight = CastleRights(False, False, False, False)
+    gs.castleRightsLog = [gs.currentCastlingRight]
+    gs.enpassantPossible = ()
+    gs.enpassantPossibleLog = [()]
+    generatorGameState = gs
+
+
+'''
+Runs in a generator process: the first result of the positions start to stop of the ending
+set up by initGenerator, from the legal moves of each. Returns (start, results, counts) with
+counts the moves that stay inside the ending of the positions still UNRESOLVED(_DRAW)
+'''
+
+
+def classifyPositions(task):
+    start, stop = task
+    ending, gs, bitbases = generatorEnding, generatorGameState, generatorBitbases
+    pieces = ending.pieces
+    pawns = [i for i in range(len(pieces)) if pieces[i][1] == 'p']
+    board = gs.board
+    results = bytearray(stop - start)
+    counts = bytearray(stop - start)
+    moves = []
+    for index in range(start, stop):
+        squares, whiteToMove = positionSquares(index, len(pieces))
+        if len(set(squares)) < len(squares) or any(squares[i] < 8 or squares[i] >= 56 for i in pawns):
+            results[index-start] = ILLEGAL
+            continue
+        for i in range(len(pieces)):
+            board[squares[i] >> 3][squares[i] & 7] = pieces[i]
+        gs.whiteKingLocation = (squares[0] >> 3, squares[0] & 7)
+        gs.blackKingLocation = (squares[1] >> 3, squares[1] & 7)
+        gs.whiteToMove = not whiteToMove
+        if gs.inCheck():  # the side that isn't to move could take the king
+            result = ILLEGAL
+        else:
+            gs.whiteToMove = whiteToMove
+            gs.getValidMoveCodes(moves)
+            if len(moves) == 0:
+                result = LOSS if gs.checkmate else DRAW
+            else:
+                result, count = UNRESOLVED, 0
+                for move in moves:
+                    endSq = (move >> 6) & 63
+                    if board[endSq >> 3][endSq & 7] == '--' and move & MOVE_KIND_MASK != MOVE_PROMOTION:
+                        count += 1
+                        continue
+                    gs.makeMove(move)  # leaves the ending, the smaller one's table has the answer
+                    reply = bitbases.probe(gs)
+                    gs.undoMove()
+                    if reply is None:
+                        raise ValueError('%s needs the bitbase of the position after %s' % (ending.name, move))
+                    if reply == LOSS:
+                        result = WIN
+                        break
+                    if reply == DRAW:
+                        result = UNRESOLVED_DRAW
+                if result != WIN:
+                    if count == 0:
+                        result = DRAW if result == UNRESOLVED_DRAW else LOSS
+                    else:
+                        counts[index-start] = count
+        results[index-start] = result
+        for sq in squares:
+            board[sq >> 3][sq & 7] = '--'
+    return start, bytes(results), bytes(counts)
+
+
+'''
+Solve the ending name by retrograde analysis and return its table (file contents). The endings
+its captures and promotions lead to have to be in bitbases already. Every position first gets
+what its own moves decide: mated, stalemated, or a capture or promotion wins. The rest count their
+moves that stay in the ending. Then results spread backwards from the decided positions: moving
+into a lost position wins, a position whose moves all reach won positions is lost. What is left
+can't be forced either way, a draw
+'''
+
+
+def generateEnding(name, bitbases, workers=1):
+    ending = Ending(name)
+    tables = {sub: bytes(bitbases.tables[sub]) for sub in ending.subEndings()}
+    results = bytearray(ending.size)
+    counts = bytearray(ending.size)
+    tasks = [(start, min(start + CHUNK_SIZE, ending.size)) for start in range(0, ending.size, CHUNK_SIZE)]
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=initGenerator, initargs=(name, tables)) as pool:
+            chunks = pool.imap_unordered(classifyPositions, tasks)
+            for start, chunkResults, chunkCounts in chunks:
+                results[start:start+len(chunkResults)] = chunkResults
+                counts[start:start+len(chunkCounts)] = chunkCounts
+    else:
+        initGenerator(name, tables)
+        for task in tasks:
+            start, chunkResults, chunkCounts = classifyPositions(task)
+            results[start:start+len(chunkResults)] = chunkResults
+            counts[start:start+len(chunkCounts)] = chunkCounts
+
+    pieces = ending.pieces
+    solved = array('L', (index for index in range(ending.size) if results[index] == WIN or results[index] == LOSS))
+    while solved:
+        index = solved.pop()
+        result = results[index]
+        squares, whiteToMove = positionSquares(index, len(pieces))
+        occupied = set(squares)
+        mover = 'b' if whiteToMove else 'w'  # made the move that led here
+        for i in range(len(pieces)):
+            if pieces[i][0] != mover:
+                continue
+            previousSquares = list(squares)
+            for origin in moveOrigins(pieces[i], squares[i], occupied):
+                previousSquares[i] = origin
+                previous = positionIndex(previousSquares, not whiteToMove)
+                if results[previous] < UNRESOLVED:  # decided already, or not a position
+                    continue
+                if result == LOSS:
+                    results[previous] = WIN
+                    solved.append(previous)
+                else:
+                    counts[previous] -= 1
+                    if counts[previous] == 0:
+                        if results[previous] == UNRESOLVED_DRAW:
+                            results[previous] = DRAW
+                        else:
+                            results[previous] = LOSS
+                            solved.append(previous)
+
+    results = results.translate(bytes([DRAW, WIN, LOSS, ILLEGAL, DRAW, DRAW]) + bytes(250))
+    results.extend(bytes(-len(results) % 4))
+    packed = bytes(a | b << 2 | c << 4 | d << 6
+                   for a, b, c, d in zip(results[0::4], results[1::4], results[2::4], results[3::4]))
+    return HEADER.pack(MAGIC, ending.size) + packed
+
+
+'''
+Make the tables of the endings names (and of every smaller ending they lead to that isn't
+there yet) and save them in directory
+'''
+
+
+def generate(names, directory=BITBASE_DIR, workers=1):
+    os.makedirs(directory, exist_ok=True)
+    bitbases = Bitbases(directory)
+    pending = list(names)
+    while pending:
+        name = pending[-1]
+        if name in bitbases.tables:
+            pending.pop()
+            continue
+        missing = [sub for sub in Ending(name).subEndings() if sub not in bitbases.tables]
+        if missing:
+            pending.extend(missing)
+            continue
+        startTime = time.time()
+        data = generateEnding(name, bitbases, workers)
+        path = os.path.join(directory, name + FILE_SUFFIX)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        bitbases.load(path)
+        print('%-8s %9d positions %s %.1fs' % (name, Ending(name).size, summary(data), time.time() - startTime))
+        pending.pop()
+    bitbases.close()
+
+
+'''
+Wins, draws and losses (for the side to move) of a table, illegal indexes left out
+'''
+
+
+def summary(data):
+    size = HEADER.unpack_from(data)[1]
+    counts = [0] * 256
+    for byte in memoryview(data)[HEADER.size:]:
+        counts[byte] += 1
+    totals = [0] * 4
+    for byte in range(256):
+        for shift in range(0, 8, 2):
+            totals[(byte >> shift) & 3] += counts[byte]
+    totals[DRAW] -= -size % 4  # the last byte is filled up with draws
+    return 'win %d draw %d loss %d' % (totals[WIN], totals[DRAW], totals[LOSS])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build win/draw/loss bitbases by retrograde analysis')
+    parser.add_argument('endings', nargs='*', default=DEFAULT_ENDINGS,
+                        help='endings to build like KRvKP, the stronger side first (default the 3 piece ones)')
+    parser.add_argument('--dir', default=BITBASE_DIR, help='directory of the bitbase files')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='processes classifying positions')
+    args = parser.parse_args()
+    try:
+        for name in args.endings:
+            Ending(name)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    generate(args.endings, args.dir, max(args.workers, 1))
+
+
+if __name__ == '__main__':
+    main()
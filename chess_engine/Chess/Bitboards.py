@@ -0,0 +1,406 @@
+"""
+Bitboard backed game state: keeps one 64 bit integer per piece type plus color occupancy
+and generates moves from precomputed attack tables instead of walking the 8x8 list
+"""
+
+from ChessEngine import GameState, MOVE_KIND_MASK, MOVE_ENPASSANT, MOVE_CASTLE
+
+# square index is row*8 + col, so bit 0 is a8 and bit 63 is h1 (same orientation as gs.board)
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+
+
+def squareBit(r, c):
+    return 1 << (r*8 + c)
+
+
+def bitSquares(bb):
+    # yields the square index of every set bit, lowest first
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def lowestSquare(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+def highestSquare(bb):
+    return bb.bit_length() - 1
+
+
+def popCount(bb):
+    return bin(bb).count('1')
+
+
+'''
+Precomputed attack tables
+'''
+
+
+def _stepAttacks(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if 0 <= r+dr < 8 and 0 <= c+dc < 8:
+                bb |= squareBit(r+dr, c+dc)
+        table.append(bb)
+    return tuple(table)
+
+
+def _ray(sq, dr, dc):
+    r, c = divmod(sq, 8)
+    bb = 0
+    r, c = r+dr, c+dc
+    while 0 <= r < 8 and 0 <= c < 8:
+        bb |= squareBit(r, c)
+        r, c = r+dr, c+dc
+    return bb
+
+
+KNIGHT_ATTACKS = _stepAttacks(((-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                               (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _stepAttacks(((-1, -1), (-1, 0), (-1, 1), (0, -1),
+                             (0, 1), (1, -1), (1, 0), (1, 1)))
+# squares a pawn of the given color standing on sq attacks
+PAWN_ATTACKS = {'w': _stepAttacks(((-1, -1), (-1, 1))),
+                'b': _stepAttacks(((1, -1), (1, 1)))}
+
+# directions as (dr, dc); a direction is "positive" when it walks towards higher square indexes,
+# which decides whether the nearest blocker is the lowest or highest set bit of the blocked ray
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+RAYS = {d: tuple(_ray(sq, d[0], d[1]) for sq in range(64))
+        for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+POSITIVE_DIRECTION = {d: d[0]*8 + d[1] > 0 for d in RAYS}
+
+
+def _between(a, b):
+    for d in RAYS:
+        if (RAYS[d][a] >> b) & 1:
+            return RAYS[d][a] & ~RAYS[d][b] & ~(1 << b)
+    return 0
+
+
+# squares strictly between two squares on a shared line (0 when not aligned)
+BETWEEN = tuple(tuple(_between(a, b) for b in range(64)) for a in range(64))
+ALL_SQUARES = (1 << 64) - 1
+
+
+def rayAttacks(sq, occupied, direction):
+    ray = RAYS[direction][sq]
+    blockers = ray & occupied
+    if blockers:
+        if POSITIVE_DIRECTION[direction]:
+            ray ^= RAYS[direction][lowestSquare(blockers)]
+        else:
+            ray ^= RAYS[direction][highestSquare(blockers)]
+    return ray
+
+
+def rookAttacks(sq, occupied):
+    return (rayAttacks(sq, occupied, (-1, 0)) | rayAttacks(sq, occupied, (0, -1)) |
+            rayAttacks(sq, occupied, (1, 0)) | rayAttacks(sq, occupied, (0, 1)))
+
+
+def bishopAttacks(sq, occupied):
+    return (rayAttacks(sq, occupied, (-1, -1)) | rayAttacks(sq, occupied, (-1, 1)) |
+            rayAttacks(sq, occupied, (1, -1)) | rayAttacks(sq, occupied, (1, 1)))
+
+
+# full lines on an empty board, used to find pieces that could pin against the king
+ROOK_RAYS = tuple(rookAttacks(sq, 0) for sq in range(64))
+BISHOP_RAYS = tuple(bishopAttacks(sq, 0) for sq in range(64))
+
+
+class BitboardGameState(GameState):
+    def __init__(self):
+        super().__init__()
+        self.loadBitboards()
+
+    '''
+    Rebuild every bit set from the 8x8 board (used on setup or after editing gs.board by hand)
+    '''
+
+    def loadBitboards(self):
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupancy = {'w': 0, 'b': 0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    self.bitboards[piece] |= squareBit(r, c)
+                    self.occupancy[piece[0]] |= squareBit(r, c)
+
+    def loadFen(self, fen):
+        super().loadFen(fen)
+        self.loadBitboards()
+
+    def putPiece(self, piece, sq):
+        bit = 1 << sq
+        self.bitboards[piece] |= bit
+        self.occupancy[piece[0]] |= bit
+
+    def removePiece(self, piece, sq):
+        bit = 1 << sq
+        self.bitboards[piece] &= ~bit
+        self.occupancy[piece[0]] &= ~bit
+
+    '''
+    Same as GameState.makeMove, but also toggles the affected bits
+    '''
+
+    def makeMove(self, move):
+        super().makeMove(move)
+        move = self.moveCodeLog[-1]
+        pieceMoved = self.pieceMovedLog[-1]
+        pieceCaptured = self.pieceCapturedLog[-1]
+        startSq = move & 63
+        endSq = (move >> 6) & 63
+        kind = move & MOVE_KIND_MASK
+        self.removePiece(pieceMoved, startSq)
+        if kind == MOVE_ENPASSANT:
+            self.removePiece(pieceCaptured, (startSq & 56) | (endSq & 7))
+        elif pieceCaptured != '--':
+            self.removePiece(pieceCaptured, endSq)
+        self.putPiece(self.board[endSq >> 3][endSq & 7], endSq)
+        if kind == MOVE_CASTLE:
+            rook = pieceMoved[0] + 'R'
+            if endSq - startSq == 2:  # kingside
+                self.removePiece(rook, endSq+1)
+                self.putPiece(rook, endSq-1)
+            else:  # queenside
+                self.removePiece(rook, endSq-2)
+                self.putPiece(rook, endSq+1)
+
+    '''
+    Same as GameState.undoMove, but also toggles the affected bits back
+    '''
+
+    def undoMove(self):
+        if len(self.moveCodeLog) == 0:
+            return
+        move = self.moveCodeLog[-1]
+        pieceMoved = self.pieceMovedLog[-1]
+        pieceCaptured = self.pieceCapturedLog[-1]
+        startSq = move & 63
+        endSq = (move >> 6) & 63
+        kind = move & MOVE_KIND_MASK
+        self.removePiece(self.board[endSq >> 3][endSq & 7], endSq)
+        self.putPiece(pieceMoved, startSq)
+        if kind == MOVE_ENPASSANT:
+            self.putPiece(pieceCaptured, (startSq & 56) | (endSq & 7))
+        elif pieceCaptured != '--':
+            self.putPiece(pieceCaptured, endSq)
+        if kind == MOVE_CASTLE:
+            rook = pieceMoved[0] + 'R'
+            if endSq - startSq == 2:  # kingside
+                self.removePiece(rook, endSq-1)
+                self.putPiece(rook, endSq+1)
+            else:  # queenside
+                self.removePiece(rook, endSq+1)
+                self.putPiece(rook, endSq-2)
+        super().undoMove()
+
+    def hasNonPawnMaterial(self):
+        color = 'w' if self.whiteToMove else 'b'
+        bitboards = self.bitboards
+        return (bitboards[color + 'N'] | bitboards[color + 'B'] | bitboards[color + 'R'] | bitboards[color + 'Q']) != 0
+
+    '''
+    All legal moves as codes (only captures and queen promotions if capturesOnly), generated
+    directly from the checkers and pinned pieces of the side to move
+    '''
+
+    def generateValidMoves(self, moves=None):
+        if moves is None:
+            moves = []
+        else:
+            moves.clear()
+        capturesOnly = self.capturesOnly
+        if self.whiteToMove:
+            color, enemy, step, startRow, promotionRank = 'w', 'b', -8, 6, 0xFF
+        else:
+            color, enemy, step, startRow, promotionRank = 'b', 'w', 8, 1, 0xFF << 56
+        bitboards = self.bitboards
+        own = self.occupancy[color]
+        occupied = own | self.occupancy[enemy]
+        kingSq = lowestSquare(bitboards[color+'K'])
+        kingRow, kingCol = divmod(kingSq, 8)
+        checkers = self.attackersTo(kingSq, occupied, enemy)
+
+        if not checkers & (checkers-1):  # not a double check, other pieces can move
+            if checkers:  # capture the checker or block the line to it
+                checkMask = checkers | BETWEEN[kingSq][lowestSquare(checkers)]
+            else:
+                checkMask = ALL_SQUARES
+            pinRays = self.getPinRays(kingSq, color, enemy, occupied)
+            targetMask = ~own & checkMask
+            if capturesOnly:
+                targetMask &= self.occupancy[enemy]
+
+            for sq in bitSquares(bitboards[color+'N']):
+                if sq not in pinRays:  # a pinned knight can never move
+                    self.addMoves(sq, KNIGHT_ATTACKS[sq] & targetMask, moves)
+            for piece in ('B', 'R', 'Q'):
+                for sq in bitSquares(bitboards[color+piece]):
+                    if piece == 'B':
+                        targets = bishopAttacks(sq, occupied)
+                    elif piece == 'R':
+                        targets = rookAttacks(sq, occupied)
+                    else:
+                        targets = rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+                    targets &= pinRays.get(sq, targetMask) & targetMask
+                    self.addMoves(sq, targets, moves)
+
+            epSq = -1
+            if self.enpassantPossible != ():
+                epSq = self.enpassantPossible[0]*8 + self.enpassantPossible[1]
+            for sq in bitSquares(bitboards[color+'p']):
+                r = sq >> 3
+                targets = 0
+                promotes = (1 << (sq+step)) & promotionRank
+                if not (occupied >> (sq+step)) & 1 and (not capturesOnly or promotes):
+                    targets |= 1 << (sq+step)  # one sq advance
+                    if r == startRow and not (occupied >> (sq+2*step)) & 1 and not capturesOnly:
+                        targets |= 1 << (sq+2*step)  # 2 sq advance
+                attacks = PAWN_ATTACKS[color][sq]
+                targets |= attacks & self.occupancy[enemy]
+                targets &= checkMask & pinRays.get(sq, ALL_SQUARES)
+                if promotes:
+                    for endSq in bitSquares(targets):
+                        self.addPawnMoves(sq, endSq, moves)
+                else:
+                    self.addMoves(sq, targets, moves)
+                if epSq >= 0 and (attacks >> epSq) & 1:
+                    # lift both pawns and test the king directly, this covers pins along the rank
+                    capturedSq = (sq & 56) | (epSq & 7)
+                    after = (occupied ^ (1 << sq) ^ (1 << capturedSq)) | (1 << epSq)
+                    if not self.attackersTo(kingSq, after, enemy) & ~(1 << capturedSq):
+                        moves.append(sq | epSq << 6 | MOVE_ENPASSANT)
+
+            if not checkers and not capturesOnly:
+                self.getCastleMoves(kingRow, kingCol, moves)
+
+        withoutKing = occupied ^ (1 << kingSq)
+        kingTargets = KING_ATTACKS[kingSq] & (self.occupancy[enemy] if capturesOnly else ~own)
+        for sq in bitSquares(kingTargets):
+            if not self.attackersTo(sq, withoutKing, enemy):
+                moves.append(kingSq | sq << 6)
+        return moves
+
+    '''
+    Bit set of the pieces of the given color that attack sq, with sliders blocked by occupied
+    '''
+
+    def attackersTo(self, sq, occupied, color):
+        bitboards = self.bitboards
+        queens = bitboards[color+'Q']
+        return ((KNIGHT_ATTACKS[sq] & bitboards[color+'N']) |
+                (KING_ATTACKS[sq] & bitboards[color+'K']) |
+                # a pawn attacks sq from the squares an opposite colored pawn on sq would attack
+                (PAWN_ATTACKS['b' if color == 'w' else 'w'][sq] & bitboards[color+'p']) |
+                (rookAttacks(sq, occupied) & (bitboards[color+'R'] | queens)) |
+                (bishopAttacks(sq, occupied) & (bitboards[color+'B'] | queens)))
+
+    '''
+    {square of pinned ally piece: bit set of squares it may still move to}
+    '''
+
+    def getPinRays(self, kingSq, color, enemy, occupied):
+        pinRays = {}
+        bitboards = self.bitboards
+        queens = bitboards[enemy+'Q']
+        snipers = (ROOK_RAYS[kingSq] & (bitboards[enemy+'R'] | queens)) | \
+            (BISHOP_RAYS[kingSq] & (bitboards[enemy+'B'] | queens))
+        for sniperSq in bitSquares(snipers):
+            between = BETWEEN[kingSq][sniperSq] & occupied
+            # exactly one piece in between and it is ours
+            if between and not between & (between-1) and between & self.occupancy[color]:
+                pinRays[lowestSquare(between)] = BETWEEN[kingSq][sniperSq] | (1 << sniperSq)
+        return pinRays
+
+    def getAttackers(self, r, c, stopAtFirst=False):
+        enemy = 'b' if self.whiteToMove else 'w'
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        attackers = [divmod(sq, 8) for sq in bitSquares(self.attackersTo(r*8 + c, occupied, enemy))]
+        return attackers[:1] if stopAtFirst else attackers
+
+    def squareUnderAttack(self, r, c):
+        enemy = 'b' if self.whiteToMove else 'w'
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        return self.attackersTo(r*8 + c, occupied, enemy) != 0
+
+    def kingAttackedOn(self, r, c):
+        color, enemy = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        occupied = (self.occupancy['w'] | self.occupancy['b']) & ~self.bitboards[color+'K']
+        return self.attackersTo(r*8 + c, occupied, enemy) != 0
+
+    '''
+    All moves without considering checks, piece by piece from the bit sets
+    '''
+
+    def getAllPossibleMoves(self, moves=None):
+        if moves is None:
+            moves = []
+        color = 'w' if self.whiteToMove else 'b'
+        for piece in ('p', 'N', 'B', 'R', 'Q', 'K'):
+            for sq in bitSquares(self.bitboards[color+piece]):
+                r, c = divmod(sq, 8)
+                self.moveFunctions[piece](r, c, moves)
+        return moves
+
+    '''
+    Add a move code from sq to every square in targets
+    '''
+
+    def addMoves(self, sq, targets, moves):
+        while targets:
+            low = targets & -targets
+            moves.append(sq | (low.bit_length() - 1) << 6)
+            targets ^= low
+
+    def getPawnMoves(self, r, c, moves):
+        sq = r*8 + c
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        if self.whiteToMove:
+            color, enemy, step, startRow = 'w', 'b', -8, 6
+        else:
+            color, enemy, step, startRow = 'b', 'w', 8, 1
+        if not (occupied >> (sq+step)) & 1:  # one sq advance
+            self.addPawnMoves(sq, sq+step, moves)
+            if r == startRow and not (occupied >> (sq+2*step)) & 1:  # 2 sq advance
+                moves.append(sq | (sq+2*step) << 6)
+        attacks = PAWN_ATTACKS[color][sq]
+        for endSq in bitSquares(attacks & self.occupancy[enemy]):
+            self.addPawnMoves(sq, endSq, moves)
+        if self.enpassantPossible != ():
+            epSq = self.enpassantPossible[0]*8 + self.enpassantPossible[1]
+            if (attacks >> epSq) & 1:
+                moves.append(sq | epSq << 6 | MOVE_ENPASSANT)
+
+    def getRookMoves(self, r, c, moves):
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        own = self.occupancy['w' if self.whiteToMove else 'b']
+        self.addMoves(r*8 + c, rookAttacks(r*8 + c, occupied) & ~own, moves)
+
+    def getKnightMoves(self, r, c, moves):
+        own = self.occupancy['w' if self.whiteToMove else 'b']
+        self.addMoves(r*8 + c, KNIGHT_ATTACKS[r*8 + c] & ~own, moves)
+
+    def getBishopMoves(self, r, c, moves):
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        own = self.occupancy['w' if self.whiteToMove else 'b']
+        self.addMoves(r*8 + c, bishopAttacks(r*8 + c, occupied) & ~own, moves)
+
+    def getQueenMoves(self, r, c, moves):
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        own = self.occupancy['w' if self.whiteToMove else 'b']
+        sq = r*8 + c
+        self.addMoves(sq, (rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)) & ~own, moves)
+
+    def getKingMoves(self, r, c, moves):
+        own = self.occupancy['w' if self.whiteToMove else 'b']
+        self.addMoves(r*8 + c, KING_ATTACKS[r*8 + c] & ~own, moves)
@@ -2,8 +2,64 @@
 Save all info of current game state and determine valid move and move logs
 """
 
+import random
+from Evaluation import SQUARE_SCORES
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                  (1, -2), (1, 2), (2, -1), (2, 1))
+# orthogonal directions first, then diagonals
+KING_OFFSETS = ((-1, 0), (0, -1), (1, 0), (0, 1),
+                (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+'''
+Moves are plain ints: start sq in bits 0-5, end sq in bits 6-11 (sq = row*8 + col), the promotion
+piece in bits 12-13 and the kind of move in bits 14-15. The generators and the search only handle
+these codes, a Move object is built from one when the UI or notation needs it (Move.fromCode)
+'''
+PROMOTION_PIECES = ('N', 'B', 'R', 'Q')  # indexed by bits 12-13
+MOVE_PROMOTION = 1 << 14
+MOVE_ENPASSANT = 2 << 14
+MOVE_CASTLE = 3 << 14
+MOVE_KIND_MASK = 3 << 14
+MOVE_ID_MASK = (1 << 14) - 1  # squares and promotion piece, what tells two moves apart
+# promotion bits of the four promotions, queen first
+PROMOTIONS = tuple(MOVE_PROMOTION | i << 12 for i in (3, 2, 1, 0))
+
+'''
+Zobrist keys: one random 64 bit number per piece on each square, per castling right,
+per en passant file and one for black to move. The seed is fixed so every process
+(search workers, books, saved tables) computes the same key for the same position
+'''
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = {piece: [[_zobristRandom.getrandbits(64) for c in range(8)] for r in range(8)]
+                  for piece in ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')}
+ZOBRIST_CASTLING = {right: _zobristRandom.getrandbits(64) for right in ('wks', 'bks', 'wqs', 'bqs')}
+ZOBRIST_ENPASSANT = [_zobristRandom.getrandbits(64) for c in range(8)]
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+# FEN piece letters, white upper case
+FEN_PIECES = {'P': 'wp', 'N': 'wN', 'B': 'wB', 'R': 'wR', 'Q': 'wQ', 'K': 'wK',
+              'p': 'bp', 'n': 'bN', 'b': 'bB', 'r': 'bR', 'q': 'bQ', 'k': 'bK'}
+
+
+def zobristCastleKey(castleRights):
+    key = 0
+    if castleRights.wks:
+        key ^= ZOBRIST_CASTLING['wks']
+    if castleRights.bks:
+        key ^= ZOBRIST_CASTLING['bks']
+    if castleRights.wqs:
+        key ^= ZOBRIST_CASTLING['wqs']
+    if castleRights.bqs:
+        key ^= ZOBRIST_CASTLING['bqs']
+    return key
+
 
 class GameState():
+    # when True every makeMove/undoMove checks the incremental zobrist key against a full recomputation
+    debugHashing = False
+
     def __init__(self):
         # board is 8*8 2d list
         # first char rep color b or w: black or white
@@ -22,191 +78,509 @@ class GameState():
             ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']
         ]
         self.whiteToMove = True
-        self.moveLog = []
+        # move codes played so far, with the piece that moved and the piece it took (for undo and moveLog)
+        self.moveCodeLog = []
+        self.pieceMovedLog = []
+        self.pieceCapturedLog = []
         self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
                               'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
         self.whiteKingLocation = (7, 4)
         self.blackKingLocation = (0, 4)
         self.checkmate = False
         self.stalemate = False
+        self.pins = {}  # filled by checkForPinsAndChecks while generating valid moves
+        self.checks = []
+        self.capturesOnly = False  # set by getValidCaptureCodes, generators then skip quiet moves
         self.enpassantPossible = ()  # ccordinates of sq where en-passant is possible
         self.enpassantPossibleLog = [self.enpassantPossible]
+        # CastleRights are never changed in place, so the log can share them with currentCastlingRight
         self.currentCastlingRight = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(
-            self.currentCastlingRight.wks, self.currentCastlingRight.bks, self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        self.castleRightsLog = [self.currentCastlingRight]
+        self.zobristLog = [self.computeZobristKey()]
+        self.boardScoreLog = [self.computeBoardScore()]
+        self.pieceCountLog = [self.countPieces()]  # pieces on the board, kings included
+        # halfmoves since the last capture or pawn move, and where the move numbers started (FEN counters)
+        self.halfmoveClockLog = [0]
+        self.firstMoveNumber = 1
+        self.firstWhiteToMove = True
 
         # self.protects = [][]
         # self.threatens = [][]
         # self.squaresCanMoveTo [][]
 
     '''
-    Takes a move as para and executes it (This willn't work for casteling, pawn promotion and en-passant)
+    Takes a move (code or Move) as para and executes it, castling, pawn promotion and en-passant included
     '''
 
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = '--'
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        # log the move so we can undo it later or display history of game
-        self.moveLog.append(move)
+        if type(move) is not int:  # Move object from the UI
+            move = move.code
+        board = self.board
+        startSq = move & 63
+        endSq = (move >> 6) & 63
+        startRow, startCol = startSq >> 3, startSq & 7
+        endRow, endCol = endSq >> 3, endSq & 7
+        kind = move & MOVE_KIND_MASK
+        pieceMoved = board[startRow][startCol]
+        pieceCaptured = board[endRow][endCol]
+        board[startRow][startCol] = '--'
+        board[endRow][endCol] = pieceMoved
         self.whiteToMove = not self.whiteToMove  # swap players
         # update kings location if moved
-        if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endCol)
-
-        # pawn promotion
-        if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0]+'Q'
+        if pieceMoved == 'wK':
+            self.whiteKingLocation = (endRow, endCol)
+        elif pieceMoved == 'bK':
+            self.blackKingLocation = (endRow, endCol)
+
+        # the zobrist key and the material + piece square score are updated by what changed
+        pieces = ZOBRIST_PIECES
+        squareScores = SQUARE_SCORES
+        key = self.zobristLog[-1] ^ ZOBRIST_BLACK_TO_MOVE ^ pieces[pieceMoved][startRow][startCol]
+        score = self.boardScoreLog[-1] - squareScores[pieceMoved][startRow][startCol]
+        if pieceCaptured != '--':
+            key ^= pieces[pieceCaptured][endRow][endCol]
+            score -= squareScores[pieceCaptured][endRow][endCol]
+
+        if kind == MOVE_PROMOTION:
+            board[endRow][endCol] = pieceMoved[0] + PROMOTION_PIECES[(move >> 12) & 3]
+        elif kind == MOVE_ENPASSANT:
+            pieceCaptured = board[startRow][endCol]
+            board[startRow][endCol] = '--'  # capturing the pawn
+            key ^= pieces[pieceCaptured][startRow][endCol]
+            score -= squareScores[pieceCaptured][startRow][endCol]
+        elif kind == MOVE_CASTLE:
+            if endCol - startCol == 2:  # kingside castle, rook hops from h to f
+                rookStart, rookEnd = endCol+1, endCol-1
+            else:  # queenside castle, rook hops from a to d
+                rookStart, rookEnd = endCol-2, endCol+1
+            rook = board[endRow][rookStart]
+            board[endRow][rookEnd] = rook  # moves the rook
+            board[endRow][rookStart] = '--'  # erase old rook
+            key ^= pieces[rook][endRow][rookStart] ^ pieces[rook][endRow][rookEnd]
+            score += squareScores[rook][endRow][rookEnd] - squareScores[rook][endRow][rookStart]
+        # piece standing on the end sq now, the promoted piece for promotions
+        pieceLanded = board[endRow][endCol]
+        key ^= pieces[pieceLanded][endRow][endCol]
+        score += squareScores[pieceLanded][endRow][endCol]
 
-        # en passant move
-        if move.isEnpassantMove:
-            self.board[move.startRow][move.endCol] = '--'  # capturing the pawn
+        # log the move so we can undo it later or display history of game
+        self.moveCodeLog.append(move)
+        self.pieceMovedLog.append(pieceMoved)
+        self.pieceCapturedLog.append(pieceCaptured)
+        if pieceMoved[1] == 'p' or pieceCaptured != '--':
+            self.halfmoveClockLog.append(0)
+            self.pieceCountLog.append(self.pieceCountLog[-1] - (pieceCaptured != '--'))
+        else:
+            self.pieceCountLog.append(self.pieceCountLog[-1])
+            self.halfmoveClockLog.append(self.halfmoveClockLog[-1] + 1)
 
         # update enpassantPossible variable
         # only on 2 sq pawn advances
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-            self.enpassantPossible = (
-                (move.startRow+move.endRow)//2, move.startCol)
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        if pieceMoved[1] == 'p' and abs(startRow - endRow) == 2:
+            self.enpassantPossible = ((startRow+endRow)//2, startCol)
+            key ^= ZOBRIST_ENPASSANT[startCol]
         else:
             self.enpassantPossible = ()
-
-        # castle move
-        if move.isCastleMove:
-            if move.endCol - move.startCol == 2:  # kingside castle
-                # moves the rook
-                self.board[move.endRow][move.endCol -
-                                        1] = self.board[move.endRow][move.endCol+1]
-                self.board[move.endRow][move.endCol+1] = '--'  # erase old rook
-            else:  # queenside castle
-                # moves the rook
-                self.board[move.endRow][move.endCol +
-                                        1] = self.board[move.endRow][move.endCol-2]
-                self.board[move.endRow][move.endCol-2] = '--'  # erase old rook
-                
-        #
         self.enpassantPossibleLog.append(self.enpassantPossible)
 
         # update castling rights
-        self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                    self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
+        previousRights = self.currentCastlingRight
+        self.updateCastleRights(pieceMoved, pieceCaptured, startRow, startCol, endRow, endCol)
+        self.castleRightsLog.append(self.currentCastlingRight)
+        if self.currentCastlingRight is not previousRights:
+            key ^= zobristCastleKey(previousRights) ^ zobristCastleKey(self.currentCastlingRight)
+
+        self.zobristLog.append(key)
+        self.boardScoreLog.append(score)
+        if self.debugHashing:
+            self.checkZobristKey()
 
     '''
     Undo the last move
     '''
 
     def undoMove(self):
-        if len(self.moveLog) != 0:  # make sure there is move to undo
-            move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
-            self.whiteToMove = not self.whiteToMove
-            # update kings location if moved
-            if move.pieceMoved == 'wK':
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == 'bK':
-                self.blackKingLocation = (move.startRow, move.startCol)
-
-        # undo en passant move
-        if move.isEnpassantMove:
+        if len(self.moveCodeLog) == 0:  # make sure there is move to undo
+            return
+        move = self.moveCodeLog.pop()
+        pieceMoved = self.pieceMovedLog.pop()
+        pieceCaptured = self.pieceCapturedLog.pop()
+        board = self.board
+        startSq = move & 63
+        endSq = (move >> 6) & 63
+        startRow, startCol = startSq >> 3, startSq & 7
+        endRow, endCol = endSq >> 3, endSq & 7
+        kind = move & MOVE_KIND_MASK
+        board[startRow][startCol] = pieceMoved
+        self.whiteToMove = not self.whiteToMove
+        # update kings location if moved
+        if pieceMoved == 'wK':
+            self.whiteKingLocation = (startRow, startCol)
+        elif pieceMoved == 'bK':
+            self.blackKingLocation = (startRow, startCol)
+
+        if kind == MOVE_ENPASSANT:
             # leave landing sq blank
-            self.board[move.endRow][move.endCol] = '--'
-            # print('ok')
-            self.board[move.startRow][move.endCol] = move.pieceCaptured
-        
+            board[endRow][endCol] = '--'
+            board[startRow][endCol] = pieceCaptured
+        else:
+            board[endRow][endCol] = pieceCaptured
+            if kind == MOVE_CASTLE:
+                if endCol - startCol == 2:  # kingside
+                    board[endRow][endCol+1] = board[endRow][endCol-1]
+                    board[endRow][endCol-1] = '--'
+                else:  # queenside
+                    board[endRow][endCol-2] = board[endRow][endCol+1]
+                    board[endRow][endCol+1] = '--'
+
         self.enpassantPossibleLog.pop()
         self.enpassantPossible = self.enpassantPossibleLog[-1]
 
         # undoing castle rights
         self.castleRightsLog.pop()  # get rid of new castling rights from move we are undoing
-        # set curr castle rights to last one in list
         self.currentCastlingRight = self.castleRightsLog[-1]
 
-        # undo castle move
-        if move.isCastleMove:
-            if move.endCol - move.startCol == 2:  # kingside
-                self.board[move.endRow][move.endCol +
-                                        1] = self.board[move.endRow][move.endCol-1]
-                self.board[move.endRow][move.endCol-1] = '--'
-            else:  # queenside
-                self.board[move.endRow][move.endCol -
-                                        2] = self.board[move.endRow][move.endCol+1]
-                self.board[move.endRow][move.endCol+1] = '--'
+        self.zobristLog.pop()
+        self.boardScoreLog.pop()
+        self.halfmoveClockLog.pop()
+        self.pieceCountLog.pop()
+        if self.debugHashing:
+            self.checkZobristKey()
 
         # checkmate and stalemate
         self.checkmate = False
         self.stalemate = False
 
     '''
-    Update castling rights given the move
-    '''
-
-    def updateCastleRights(self, move):
-        if move.pieceMoved == 'wK':
-            self.currentCastlingRight.wks = False
-            self.currentCastlingRight.wqs = False
-        elif move.pieceMoved == 'bK':
-            self.currentCastlingRight.bks = False
-            self.currentCastlingRight.bqs = False
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0:  # left rook
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7:  # right rook
-                    self.currentCastlingRight.wks = False
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0:  # left rook
-                    self.currentCastlingRight.bqs = False
-                elif move.startCol == 7:  # right rook
-                    self.currentCastlingRight.bks = False
+    Pass the turn without moving, for null move pruning in the search: only the side to move,
+    the en passant square and the zobrist key change. Not logged as a move, undoNullMove takes it back
+    '''
+
+    def makeNullMove(self):
+        key = self.zobristLog[-1] ^ ZOBRIST_BLACK_TO_MOVE
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        self.whiteToMove = not self.whiteToMove
+        self.enpassantPossible = ()
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        self.castleRightsLog.append(self.currentCastlingRight)
+        self.zobristLog.append(key)
+        self.boardScoreLog.append(self.boardScoreLog[-1])
+        self.halfmoveClockLog.append(self.halfmoveClockLog[-1] + 1)
+        self.pieceCountLog.append(self.pieceCountLog[-1])
+        if self.debugHashing:
+            self.checkZobristKey()
+
+    def undoNullMove(self):
+        self.whiteToMove = not self.whiteToMove
+        self.enpassantPossibleLog.pop()
+        self.enpassantPossible = self.enpassantPossibleLog[-1]
+        self.castleRightsLog.pop()
+        self.currentCastlingRight = self.castleRightsLog[-1]
+        self.zobristLog.pop()
+        self.boardScoreLog.pop()
+        self.halfmoveClockLog.pop()
+        self.pieceCountLog.pop()
+        self.checkmate = False
+        self.stalemate = False
+
+    '''
+    Whether the side to move has a piece besides pawns and the king, without one passing is
+    often the best move (zugzwang) and null move pruning can't be trusted
+    '''
+
+    def hasNonPawnMaterial(self):
+        color = 'w' if self.whiteToMove else 'b'
+        for row in self.board:
+            for piece in row:
+                if piece[0] == color and piece[1] != 'p' and piece[1] != 'K':
+                    return True
+        return False
+
+    '''
+    New game state (of this class, so the bitboard backend works too) set up from a FEN string
+    '''
+
+    @classmethod
+    def fromFen(cls, fen):
+        gs = cls()
+        gs.loadFen(fen)
+        return gs
+
+    '''
+    Replace the position by the one of a FEN string: board, king locations, side to move, castling
+    rights, en passant square and move counters (the last two fields may be left out). The move log
+    starts empty. Raises ValueError for a malformed FEN or an en passant square no pawn just skipped,
+    castling rights without the king and rook on their squares are dropped
+    '''
+
+    def loadFen(self, fen):
+        fields = fen.split()
+        if not 4 <= len(fields) <= 6:
+            raise ValueError('FEN needs 4 to 6 fields: %r' % fen)
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError('FEN board needs 8 ranks: %r' % fields[0])
+        board = []
+        kings = {'w': [], 'b': []}
+        for r in range(8):
+            row = []
+            for char in ranks[r]:
+                if char in '12345678':
+                    row.extend(['--'] * int(char))
+                elif char in FEN_PIECES:
+                    piece = FEN_PIECES[char]
+                    if piece[1] == 'K':
+                        kings[piece[0]].append((r, len(row)))
+                    row.append(piece)
+                else:
+                    raise ValueError('unknown piece %r in FEN' % char)
+            if len(row) != 8:
+                raise ValueError('rank %d of the FEN has %d squares' % (8-r, len(row)))
+            board.append(row)
+        if len(kings['w']) != 1 or len(kings['b']) != 1:
+            raise ValueError('FEN needs one king of each color')
+        if fields[1] not in ('w', 'b'):
+            raise ValueError('side to move must be w or b: %r' % fields[1])
+        castling = fields[2]
+        if castling != '-' and not set(castling) <= set('KQkq'):
+            raise ValueError('bad castling field %r' % castling)
+        square = fields[3]
+        if square == '-':
+            enpassant = ()
+        elif len(square) == 2 and square[0] in 'abcdefgh' and square[1] in '36':
+            enpassant = (8 - int(square[1]), 'abcdefgh'.index(square[0]))
+            # the square a pawn of the side that just moved skipped: behind it on the 3rd/6th rank,
+            # with nothing on it or on the square it came from
+            step, pawn = (1, 'bp') if fields[1] == 'w' else (-1, 'wp')
+            r, c = enpassant
+            if square[1] != ('6' if fields[1] == 'w' else '3'):
+                raise ValueError('en passant square %r is on the wrong rank for %s to move' % (square, fields[1]))
+            if board[r+step][c] != pawn or board[r][c] != '--' or board[r-step][c] != '--':
+                raise ValueError('no pawn can have just skipped the en passant square %r' % square)
+        else:
+            raise ValueError('bad en passant square %r' % square)
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            moveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError('move counters must be numbers: %r' % fen)
+
+        self.board = board
+        self.whiteKingLocation = kings['w'][0]
+        self.blackKingLocation = kings['b'][0]
+        self.whiteToMove = fields[1] == 'w'
+        self.currentCastlingRight = CastleRights(
+            'K' in castling and board[7][4] == 'wK' and board[7][7] == 'wR',
+            'k' in castling and board[0][4] == 'bK' and board[0][7] == 'bR',
+            'Q' in castling and board[7][4] == 'wK' and board[7][0] == 'wR',
+            'q' in castling and board[0][4] == 'bK' and board[0][0] == 'bR')
+        self.castleRightsLog = [self.currentCastlingRight]
+        self.enpassantPossible = enpassant
+        self.enpassantPossibleLog = [enpassant]
+        self.moveCodeLog = []
+        self.pieceMovedLog = []
+        self.pieceCapturedLog = []
+        self.halfmoveClockLog = [halfmoveClock]
+        self.firstMoveNumber = max(moveNumber, 1)
+        self.firstWhiteToMove = self.whiteToMove
+        self.checkmate = False
+        self.stalemate = False
+        self.resetZobristKey()
+        self.resetBoardScore()
+        self.pieceCountLog = [self.countPieces()]
+
+    '''
+    FEN string of the current position
+    '''
+
+    def toFen(self):
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        rights = self.currentCastlingRight
+        castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + \
+            ('k' if rights.bks else '') + ('q' if rights.bqs else '')
+        if self.enpassantPossible == ():
+            enpassant = '-'
+        else:
+            r, c = self.enpassantPossible
+            enpassant = 'abcdefgh'[c] + str(8 - r)
+        return '%s %s %s %s %d %d' % ('/'.join(ranks), 'w' if self.whiteToMove else 'b', castling or '-',
+                                      enpassant, self.halfmoveClock, self.fullmoveNumber)
+
+    '''
+    Halfmoves since the last capture or pawn move (the fifty move rule counter)
+    '''
+
+    @property
+    def halfmoveClock(self):
+        return self.halfmoveClockLog[-1]
+
+    '''
+    Number of the current move, starts at 1 and goes up after every black move
+    '''
+
+    @property
+    def fullmoveNumber(self):
+        return self.firstMoveNumber + (len(self.moveCodeLog) + (0 if self.firstWhiteToMove else 1)) // 2
+
+    '''
+    The moves played so far as Move objects, built from the logged codes (for the UI and notation)
+    '''
+
+    @property
+    def moveLog(self):
+        return [Move.fromCode(self.moveCodeLog[i], None, self.pieceMovedLog[i], self.pieceCapturedLog[i])
+                for i in range(len(self.moveCodeLog))]
+
+    '''
+    64 bit zobrist key of the current position, kept up to date by makeMove/undoMove
+    '''
+
+    @property
+    def zobristKey(self):
+        return self.zobristLog[-1]
+
+    '''
+    Compute the zobrist key of the current position from scratch
+    '''
+
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    key ^= ZOBRIST_PIECES[piece][r][c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= zobristCastleKey(self.currentCastlingRight)
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return key
+
+    '''
+    Start a new key log for a position that was set up by hand (board, side, rights, en passant)
+    '''
+
+    def resetZobristKey(self):
+        self.zobristLog = [self.computeZobristKey()]
+
+    '''
+    Material + piece square score (white minus black, in pawns), kept up to date by makeMove/undoMove
+    '''
+
+    @property
+    def boardScore(self):
+        return self.boardScoreLog[-1] / 10
+
+    '''
+    Sum the board score from scratch, in tenths of a pawn as stored in boardScoreLog
+    '''
+
+    def computeBoardScore(self):
+        score = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    score += SQUARE_SCORES[piece][r][c]
+        return score
+
+    def resetBoardScore(self):
+        self.boardScoreLog = [self.computeBoardScore()]
+
+    '''
+    Number of pieces on the board (kings included), kept up to date by makeMove/undoMove
+    '''
+
+    @property
+    def pieceCount(self):
+        return self.pieceCountLog[-1]
+
+    def countPieces(self):
+        return sum(piece != '--' for row in self.board for piece in row)
+
+    def checkZobristKey(self):
+        expected = self.computeZobristKey()
+        if self.zobristKey != expected:
+            raise AssertionError('zobrist key %016x does not match recomputed %016x after %s' % (
+                self.zobristKey, expected, self.moveLog[-1].getChessNotation() if self.moveCodeLog else 'setup'))
+
+    '''
+    Update castling rights given the move, a new CastleRights replaces the current one when a right is lost
+    '''
+
+    def updateCastleRights(self, pieceMoved, pieceCaptured, startRow, startCol, endRow, endCol):
+        rights = self.currentCastlingRight
+        wks, bks, wqs, bqs = rights.wks, rights.bks, rights.wqs, rights.bqs
+        if pieceMoved == 'wK':
+            wks = False
+            wqs = False
+        elif pieceMoved == 'bK':
+            bks = False
+            bqs = False
+        elif pieceMoved == 'wR':
+            if startRow == 7:
+                if startCol == 0:  # left rook
+                    wqs = False
+                elif startCol == 7:  # right rook
+                    wks = False
+        elif pieceMoved == 'bR':
+            if startRow == 0:
+                if startCol == 0:  # left rook
+                    bqs = False
+                elif startCol == 7:  # right rook
+                    bks = False
 
         # if rook is captured
-        if move.pieceCaptured == 'wR':
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.wks = False
-        elif move.pieceCaptured == 'bR':
-            if move.endRow == 0:
-                if move.endCol == 0:
-                    self.currentCastlingRight.bqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.bks = False
+        if pieceCaptured == 'wR':
+            if endRow == 7:
+                if endCol == 0:
+                    wqs = False
+                elif endCol == 7:
+                    wks = False
+        elif pieceCaptured == 'bR':
+            if endRow == 0:
+                if endCol == 0:
+                    bqs = False
+                elif endCol == 7:
+                    bks = False
+
+        if wks != rights.wks or bks != rights.bks or wqs != rights.wqs or bqs != rights.bqs:
+            self.currentCastlingRight = CastleRights(wks, bks, wqs, bqs)
 
     '''
-    All moves considering checks
+    All moves considering checks, as Move objects (for the UI)
     '''
 
     def getValidMoves(self):
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = CastleRights(
-            self.currentCastlingRight.wks, self.currentCastlingRight.bks, self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)  # copy current castling rigtes
-        # Naive Algo:
-        # 1. gen all possible moves
-        moves = self.getAllPossibleMoves()
-        if self.whiteToMove:
-            self.getCastleMoves(
-                self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
-        else:
-            self.getCastleMoves(
-                self.blackKingLocation[0], self.blackKingLocation[1], moves)
+        board = self.board
+        return [Move.fromCode(move, board) for move in self.getValidMoveCodes()]
 
-        # 2. for each move make them
-        # when removing from list go backward through the list
-        for i in range(len(moves)-1, -1, -1):
-            self.makeMove(moves[i])
-            # 3. gen all opponents moves
-            # 4. for each opponents move see if they attack your king
-            self.whiteToMove = not self.whiteToMove  # switch thruns back
-            if self.inCheck():
-                # 5. if they do attack king, it's not a valid move
-                moves.remove(moves[i])
-            self.whiteToMove = not self.whiteToMove  # switch thruns back
-            self.undoMove()
+    '''
+    All moves considering checks, as move codes written into moves (a list that is reused) if given
+    Checks and pins are found once by looking outward from the king, so only king moves
+    and en passant captures still need an explicit safety test
+    '''
 
+    def getValidMoveCodes(self, moves=None):
+        moves = self.generateValidMoves(moves)
         if len(moves) == 0:  # it's either a checkmate or stalemate
             if self.inCheck():
                 self.checkmate = True
@@ -215,11 +589,151 @@ class GameState():
         else:
             self.checkmate = False
             self.stalemate = False
+        return moves
+
+    def getValidCaptures(self):
+        board = self.board
+        return [Move.fromCode(move, board) for move in self.getValidCaptureCodes()]
+
+    '''
+    Only the valid captures (en passant and queen promotions included), for the quiescence search
+    Leaves checkmate and stalemate alone since quiet moves are never looked at
+    '''
+
+    def getValidCaptureCodes(self, moves=None):
+        self.capturesOnly = True
+        moves = self.generateValidMoves(moves)
+        self.capturesOnly = False
+        return moves
+
+    def generateValidMoves(self, moves=None):
+        if moves is None:
+            moves = []
+        else:
+            moves.clear()
+        self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        kingSq = kingRow*8 + kingCol
 
-        self.enpassantPossible = tempEnpassantPossible
-        self.currentCastlingRight = tempCastleRights
+        if len(self.checks) > 1:  # double check, king has to move
+            self.getKingMoves(kingRow, kingCol, moves)
+        else:
+            self.getAllPossibleMoves(moves)
+            if len(self.checks) == 1:  # block the check, capture the checker or move the king
+                checkRow, checkCol, dr, dc = self.checks[0]
+                checkSq = checkRow*8 + checkCol
+                validSquares = {checkSq}
+                if self.board[checkRow][checkCol][1] != 'N':  # sliding checks can be blocked
+                    for i in range(1, 8):
+                        square = (kingRow + dr*i)*8 + kingCol + dc*i
+                        if square == checkSq:
+                            break
+                        validSquares.add(square)
+                for i in range(len(moves)-1, -1, -1):
+                    move = moves[i]
+                    if move & 63 == kingSq:
+                        continue
+                    if move & MOVE_KIND_MASK == MOVE_ENPASSANT and (move & 56) | ((move >> 6) & 7) == checkSq:
+                        continue  # en passant removes the checking pawn
+                    if (move >> 6) & 63 not in validSquares:
+                        moves.pop(i)
+            elif not self.capturesOnly:
+                self.getCastleMoves(kingRow, kingCol, moves)
+
+        # king steps need a safe destination, en passant can expose the king along the rank
+        for i in range(len(moves)-1, -1, -1):
+            move = moves[i]
+            if move & 63 == kingSq:
+                if move & MOVE_KIND_MASK != MOVE_CASTLE:
+                    endSq = (move >> 6) & 63
+                    if self.kingAttackedOn(endSq >> 3, endSq & 7):
+                        moves.pop(i)
+            elif move & MOVE_KIND_MASK == MOVE_ENPASSANT:
+                self.makeMove(move)
+                self.whiteToMove = not self.whiteToMove
+                exposed = self.inCheck()
+                self.whiteToMove = not self.whiteToMove
+                self.undoMove()
+                if exposed:
+                    moves.pop(i)
+
+        self.pins, self.checks = {}, []  # only valid for the position they were computed in
+        return moves
+
+    '''
+    Look outward from the king of the side to move and return
+    pins: {(row, col) of pinned ally piece: direction from the king}
+    checks: [(row, col, dr, dc)] of every checking piece, direction from the king
+    '''
 
-        return moves  # for now dont worry abt checks
+    def checkForPinsAndChecks(self):
+        pins = {}
+        checks = []
+        if self.whiteToMove:
+            enemyColor, allyColor = 'b', 'w'
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            enemyColor, allyColor = 'w', 'b'
+            kingRow, kingCol = self.blackKingLocation
+        directions = KING_OFFSETS  # first four are orthogonal (rooks), last four diagonal (bishops)
+        # an enemy pawn checks from the diagonal in front of the king
+        pawnDirections = ((-1, -1), (-1, 1)) if self.whiteToMove else ((1, -1), (1, 1))
+        for j in range(len(directions)):
+            d = directions[j]
+            possiblePin = ()
+            for i in range(1, 8):
+                endRow = kingRow + d[0]*i
+                endCol = kingCol + d[1]*i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):  # off board
+                    break
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == allyColor:
+                    if possiblePin == ():  # first ally piece could be pinned
+                        possiblePin = (endRow, endCol)
+                    else:  # second ally piece, no pin or check in this direction
+                        break
+                elif endPiece[0] == enemyColor:
+                    pieceType = endPiece[1]
+                    if (j <= 3 and pieceType == 'R') or (j >= 4 and pieceType == 'B') or pieceType == 'Q' or \
+                            (i == 1 and pieceType == 'p' and d in pawnDirections):
+                        if possiblePin == ():
+                            checks.append((endRow, endCol, d[0], d[1]))
+                        else:
+                            pins[possiblePin] = d
+                    break  # enemy piece blocks anything behind it
+        for m in KNIGHT_OFFSETS:
+            endRow = kingRow + m[0]
+            endCol = kingCol + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8:
+                if self.board[endRow][endCol] == enemyColor + 'N':
+                    checks.append((endRow, endCol, m[0], m[1]))
+        return pins, checks
+
+    '''
+    dtmn if the king of the side to move would be attacked after stepping to r,c
+    '''
+
+    def kingAttackedOn(self, r, c):
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        king = self.board[kingRow][kingCol]
+        self.board[kingRow][kingCol] = '--'  # lift the king so sliders see through its old square
+        attacked = self.squareUnderAttack(r, c)
+        self.board[kingRow][kingCol] = king
+        return attacked
+
+    '''
+    A pinned piece may only move along the line between its king and the pinning piece
+    '''
+
+    def pinAllows(self, r, c, dr, dc):
+        pinDirection = self.pins.get((r, c))
+        return pinDirection is None or pinDirection == (dr, dc) or pinDirection == (-dr, -dc)
 
     '''
     dtmn if current player is in check
@@ -236,20 +750,59 @@ class GameState():
     '''
 
     def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove  # switch to the opponent's turn
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove  # switch thruns back
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:  # the square is under attack
-                return True
-        return False
+        return len(self.getAttackers(r, c, stopAtFirst=True)) > 0
+
+    '''
+    Find enemy pieces attacking sq r,c by probing outward from it (knight jumps, pawn
+    diagonals, king ring and the first piece along every ray), no moves are generated
+    returns [(row, col)] of the attackers, only the first one found if stopAtFirst
+    '''
+
+    def getAttackers(self, r, c, stopAtFirst=False):
+        attackers = []
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        board = self.board
+        knight = enemyColor + 'N'
+        for dr, dc in KNIGHT_OFFSETS:
+            endRow, endCol = r + dr, c + dc
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and board[endRow][endCol] == knight:
+                attackers.append((endRow, endCol))
+                if stopAtFirst:
+                    return attackers
+        # enemy pawns attack towards us, so they sit one row behind sq from our point of view
+        pawnRow = r - 1 if enemyColor == 'b' else r + 1
+        if 0 <= pawnRow < 8:
+            pawn = enemyColor + 'p'
+            for endCol in (c - 1, c + 1):
+                if 0 <= endCol < 8 and board[pawnRow][endCol] == pawn:
+                    attackers.append((pawnRow, endCol))
+                    if stopAtFirst:
+                        return attackers
+        # first four are orthogonal (rooks), last four diagonal (bishops)
+        for j in range(len(KING_OFFSETS)):
+            dr, dc = KING_OFFSETS[j]
+            sliders = 'RQ' if j <= 3 else 'BQ'
+            for i in range(1, 8):
+                endRow, endCol = r + dr*i, c + dc*i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):  # off board
+                    break
+                endPiece = board[endRow][endCol]
+                if endPiece == '--':
+                    continue
+                if endPiece[0] == enemyColor and (endPiece[1] in sliders or (i == 1 and endPiece[1] == 'K')):
+                    attackers.append((endRow, endCol))
+                    if stopAtFirst:
+                        return attackers
+                break  # first piece blocks the ray
+        return attackers
 
     '''
-    All moves without considering checks
+    All moves without considering checks, added to moves as codes
     '''
 
-    def getAllPossibleMoves(self):
-        moves = []
+    def getAllPossibleMoves(self, moves=None):
+        if moves is None:
+            moves = []
         for r in range(len(self.board)):  # no of rows
             for c in range(len(self.board[r])):  # no of cols in gn row
                 turn = self.board[r][c][0]
@@ -259,56 +812,70 @@ class GameState():
                     self.moveFunctions[piece](r, c, moves)
         return moves
 
+    '''
+    Add a pawn move, as all four promotions when it reaches the last rank (only the queen one
+    when generating captures only)
+    '''
+
+    def addPawnMoves(self, startSq, endSq, moves):
+        move = startSq | endSq << 6
+        if endSq < 8 or endSq >= 56:
+            if self.capturesOnly:
+                moves.append(move | PROMOTIONS[0])
+            else:
+                for promotion in PROMOTIONS:
+                    moves.append(move | promotion)
+        else:
+            moves.append(move)
+
     '''
     Get all the pawns moves at row, col and add to the list
     '''
 
     def getPawnMoves(self, r, c, moves):
+        sq = r*8 + c
         if self.whiteToMove:  # white to move
-            if self.board[r-1][c] == '--':  # one sq on advance
-                moves.append(Move((r, c), (r-1, c), self.board))
+            if self.board[r-1][c] == '--' and self.pinAllows(r, c, -1, 0) and \
+                    (not self.capturesOnly or r-1 == 0):  # one sq on advance
+                self.addPawnMoves(sq, sq-8, moves)
                 # 2 sq advance
-                if r == 6 and self.board[r-2][c] == '--':
-                    moves.append(Move((r, c), (r-2, c), self.board))
+                if r == 6 and self.board[r-2][c] == '--' and not self.capturesOnly:
+                    moves.append(sq | (sq-16) << 6)
 
-            if c-1 >= 0:  # capture to the left
+            if c-1 >= 0 and self.pinAllows(r, c, -1, -1):  # capture to the left
                 if self.board[r-1][c-1][0] == 'b':
                     # enemy piece to capture
-                    moves.append(Move((r, c), (r-1, c-1), self.board))
+                    self.addPawnMoves(sq, sq-9, moves)
                 elif (r-1, c-1) == self.enpassantPossible:
-                    moves.append(
-                        Move((r, c), (r-1, c-1), self.board, isEnpassantMove=True))
+                    moves.append(sq | (sq-9) << 6 | MOVE_ENPASSANT)
 
-            if c+1 <= 7:  # capture to the rigtht
+            if c+1 <= 7 and self.pinAllows(r, c, -1, 1):  # capture to the rigtht
                 if self.board[r-1][c+1][0] == 'b':
                     # enmy piece to capture
-                    moves.append(Move((r, c), (r-1, c+1), self.board))
+                    self.addPawnMoves(sq, sq-7, moves)
                 elif (r-1, c+1) == self.enpassantPossible:
-                    moves.append(
-                        Move((r, c), (r-1, c+1), self.board, isEnpassantMove=True))
+                    moves.append(sq | (sq-7) << 6 | MOVE_ENPASSANT)
 
         else:  # black pawn moves
-            if self.board[r+1][c] == '--':  # one sq on advance
-                moves.append(Move((r, c), (r+1, c), self.board))
+            if self.board[r+1][c] == '--' and self.pinAllows(r, c, 1, 0) and \
+                    (not self.capturesOnly or r+1 == 7):  # one sq on advance
+                self.addPawnMoves(sq, sq+8, moves)
                 # 2 sq advance
-                if r == 1 and self.board[r+2][c] == '--':
-                    moves.append(Move((r, c), (r+2, c), self.board))
+                if r == 1 and self.board[r+2][c] == '--' and not self.capturesOnly:
+                    moves.append(sq | (sq+16) << 6)
 
-            if c-1 >= 0:  # capture to the left
+            if c-1 >= 0 and self.pinAllows(r, c, 1, -1):  # capture to the left
                 if self.board[r+1][c-1][0] == 'w':
                     # enmy piece to capture
-                    moves.append(Move((r, c), (r+1, c-1), self.board))
+                    self.addPawnMoves(sq, sq+7, moves)
                 elif (r+1, c-1) == self.enpassantPossible:
-                    moves.append(
-                        Move((r, c), (r+1, c-1), self.board, isEnpassantMove=True))
-            if c+1 <= 7:  # capture to the rigth
+                    moves.append(sq | (sq+7) << 6 | MOVE_ENPASSANT)
+            if c+1 <= 7 and self.pinAllows(r, c, 1, 1):  # capture to the rigth
                 if self.board[r+1][c+1][0] == 'w':
                     # enmy piece to capture
-                    moves.append(Move((r, c), (r+1, c+1), self.board))
+                    self.addPawnMoves(sq, sq+9, moves)
                 elif (r+1, c+1) == self.enpassantPossible:
-                    moves.append(
-                        Move((r, c), (r+1, c+1), self.board, isEnpassantMove=True))
-        # add pawn promotions later
+                    moves.append(sq | (sq+9) << 6 | MOVE_ENPASSANT)
 
     '''
     Get all the rook moves at row, col and add to the list
@@ -318,18 +885,20 @@ class GameState():
         # up, left, down, right
         directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
         enemyColor = 'b' if self.whiteToMove else 'w'
+        sq = r*8 + c
         for d in directions:
+            if not self.pinAllows(r, c, d[0], d[1]):
+                continue  # pinned piece can't leave the pin line
             for i in range(1, 8):
                 endRow = r + d[0]*i
                 endCol = c + d[1]*i
                 if 0 <= endRow < 8 and 0 <= endCol < 8:  # on board
                     endPiece = self.board[endRow][endCol]
                     if endPiece == '--':  # empty space valid
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
+                        if not self.capturesOnly:
+                            moves.append(sq | (endRow*8 + endCol) << 6)
                     elif endPiece[0] == enemyColor:  # enemy piece valid
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
+                        moves.append(sq | (endRow*8 + endCol) << 6)
                         break
                     else:  # friendly/ally piece
                         break
@@ -343,15 +912,18 @@ class GameState():
     def getKnightMoves(self, r, c, moves):
         knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2),
                        (1, -2), (1, 2), (2, -1), (2, 1))
+        if (r, c) in self.pins:
+            return  # a pinned knight can never move
         allyColor = 'w' if self.whiteToMove else 'b'
+        sq = r*8 + c
         for m in knightMoves:
             endRow = r+m[0]
             endCol = c+m[1]
             if 0 <= endRow < 8 and 0 <= endCol < 8:
                 endPiece = self.board[endRow][endCol]
                 # not an ally piece (ie, empty or enemy piece)
-                if endPiece[0] != allyColor:
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+                if endPiece[0] != allyColor and (endPiece != '--' or not self.capturesOnly):
+                    moves.append(sq | (endRow*8 + endCol) << 6)
 
     '''
     Get all the bishop moves at row, col and add to the list
@@ -360,18 +932,20 @@ class GameState():
     def getBishopMoves(self, r, c, moves):
         directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))  # diagonals moves
         enemyColor = 'b' if self.whiteToMove else 'w'
+        sq = r*8 + c
         for d in directions:
+            if not self.pinAllows(r, c, d[0], d[1]):
+                continue  # pinned piece can't leave the pin line
             for i in range(1, 8):
                 endRow = r + d[0]*i
                 endCol = c + d[1]*i
                 if 0 <= endRow < 8 and 0 <= endCol < 8:  # on board
                     endPiece = self.board[endRow][endCol]
                     if endPiece == '--':  # empty space valid
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
+                        if not self.capturesOnly:
+                            moves.append(sq | (endRow*8 + endCol) << 6)
                     elif endPiece[0] == enemyColor:  # enemy piece valid
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
+                        moves.append(sq | (endRow*8 + endCol) << 6)
                         break
                     else:  # friendly/ally piece
                         break
@@ -394,23 +968,23 @@ class GameState():
         kingMoves = ((-1, -1), (-1, 0), (-1, 1), (0, -1),
                      (0, 1), (1, -1), (1, 0), (1, 1))
         allyColor = 'w' if self.whiteToMove else 'b'
+        sq = r*8 + c
         for i in range(8):
             endRow = r+kingMoves[i][0]
             endCol = c+kingMoves[i][1]
             if 0 <= endRow < 8 and 0 <= endCol < 8:
                 endPiece = self.board[endRow][endCol]
                 # not an ally piece (ie, empty or enemy piece)
-                if endPiece[0] != allyColor:
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+                if endPiece[0] != allyColor and (endPiece != '--' or not self.capturesOnly):
+                    moves.append(sq | (endRow*8 + endCol) << 6)
         # self.getCastleMoves(r, c, moves, allyColor)
 
     '''
-    Generate all valid moves for king at (r,c) and add tham to list of moves
+    Generate all valid castle moves for king at (r,c) and add tham to list of moves
     '''
 
     def getCastleMoves(self, r, c, moves):
-        if self.squareUnderAttack(r, c):
-            return  # cant castle whie in check
+        # only called when not in check (cant castle while in check)
         if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks):
             self.getKingsideCastleMoves(r, c, moves)
         if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs):
@@ -418,15 +992,15 @@ class GameState():
 
     def getKingsideCastleMoves(self, r, c, moves):
         if self.board[r][c+1] == '--' and self.board[r][c+2] == '--':
-            if not self.squareUnderAttack(r, c+1) and not self.squareUnderAttack(r, c+2):
-                moves.append(
-                    Move((r, c), (r, c+2), self.board, isCastleMove=True))
+            if not self.kingAttackedOn(r, c+1) and not self.kingAttackedOn(r, c+2):
+                sq = r*8 + c
+                moves.append(sq | (sq+2) << 6 | MOVE_CASTLE)
 
     def getQueensideCastleMoves(self, r, c, moves):
         if self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--':
-            if not self.squareUnderAttack(r, c-1) and not self.squareUnderAttack(r, c-2):
-                moves.append(
-                    Move((r, c), (r, c-2), self.board, isCastleMove=True))
+            if not self.kingAttackedOn(r, c-1) and not self.kingAttackedOn(r, c-2):
+                sq = r*8 + c
+                moves.append(sq | (sq-2) << 6 | MOVE_CASTLE)
 
 
 class CastleRights():
@@ -438,6 +1012,14 @@ class CastleRights():
 
 
 class Move():
+    '''
+    Readable view of a move code for the UI and notation, built with Move(...) from clicked
+    squares or with Move.fromCode; __slots__ keeps it small and without a __dict__
+    '''
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured',
+                 'isPawnPromotion', 'promotionPiece', 'castle', 'isEnpassantMove', 'isCapture',
+                 'isCastleMove', 'moveID', 'code')
+
     # Map keys to values
     # key : value
     ranksToRows = {'1': 7, '2': 6, '3': 5,
@@ -447,30 +1029,63 @@ class Move():
                    'd': 3, 'e': 4, 'f': 5, 'g': 6, 'h': 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
+    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False, promotionPiece='Q'):
+        self.setFields(startSq[0], startSq[1], endSq[0], endSq[1],
+                       board[startSq[0]][startSq[1]], board[endSq[0]][endSq[1]],
+                       isEnpassantMove, isCastleMove, promotionPiece)
+
+    '''
+    View of a move code, the pieces are read from board unless given (moves already played)
+    '''
+
+    @classmethod
+    def fromCode(cls, code, board, pieceMoved=None, pieceCaptured=None):
+        startSq = code & 63
+        endSq = (code >> 6) & 63
+        startRow, startCol = startSq >> 3, startSq & 7
+        endRow, endCol = endSq >> 3, endSq & 7
+        if pieceMoved is None:
+            pieceMoved = board[startRow][startCol]
+            pieceCaptured = board[endRow][endCol]
+        kind = code & MOVE_KIND_MASK
+        move = cls.__new__(cls)
+        move.setFields(startRow, startCol, endRow, endCol, pieceMoved, pieceCaptured,
+                       kind == MOVE_ENPASSANT, kind == MOVE_CASTLE, PROMOTION_PIECES[(code >> 12) & 3])
+        return move
+
+    def setFields(self, startRow, startCol, endRow, endCol, pieceMoved, pieceCaptured,
+                  isEnpassantMove, isCastleMove, promotionPiece):
+        self.startRow = startRow
+        self.startCol = startCol
+        self.endRow = endRow
+        self.endCol = endCol
+        self.pieceMoved = pieceMoved
+        self.pieceCaptured = pieceCaptured
         # pawn promotion
         self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (
             self.pieceMoved == 'bp' and self.endRow == 7)
+        self.promotionPiece = promotionPiece if self.isPawnPromotion else None
         self.castle = isCastleMove
         # en passant move
         self.isEnpassantMove = isEnpassantMove
         if self.isEnpassantMove:
             self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
-            
-        self.isCapture = self.pieceCaptured!='--'
+
+        self.isCapture = self.pieceCaptured != '--'
 
         # castle move
         self.isCastleMove = isCastleMove
 
-        self.moveID = self.startRow*1000+self.startCol*100+self.endRow*10+self.endCol
+        self.code = (startRow*8 + startCol) | (endRow*8 + endCol) << 6
+        if self.isPawnPromotion:
+            self.code |= MOVE_PROMOTION | PROMOTION_PIECES.index(promotionPiece) << 12
+        elif isEnpassantMove:
+            self.code |= MOVE_ENPASSANT
+        elif isCastleMove:
+            self.code |= MOVE_CASTLE
+        self.moveID = self.code & MOVE_ID_MASK
 
-    ''' 
+    '''
     Overriding the equals method
     '''
 
@@ -479,33 +1094,40 @@ class Move():
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol)+self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol)+self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
 
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
-    
+
     #overriding str() function
     def __str__(self):
         #castle move
         if self.castle:
             return 'O-O' if self.endCol==6 else 'O-O-O'
-        
+
         endSquare = self.getRankFile(self.endRow, self.endCol)
         # pawn moves
         if self.pieceMoved[1]=='p':
             if self.isCapture:
-                return self.colsToFiles[self.startCol]+'x'+endSquare
-            else:
-                return endSquare
-
+                endSquare = self.colsToFiles[self.startCol]+'x'+endSquare
             #pawn promotions
+            if self.isPawnPromotion:
+                endSquare += '='+self.promotionPiece
+            return endSquare
+
         #two same pieces moving to same square
         # add + for check and # for checkmate
-        
+
         #piece moves
         moveString = self.pieceMoved[1]
         if self.isCapture:
             moveString+='x'
         return moveString+ endSquare
-            
+
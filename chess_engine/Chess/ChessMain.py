@@ -2,9 +2,10 @@
 Main driver file
 """
 
+import logging
+import queue
 import pygame as p
-import ChessEngine, SmartMoveFinder
-from multiprocessing import Process, Queue
+import ChessEngine, SmartMoveFinder, Bitboards, SearchWorker
 
 # p.init()
 BOARD_WIDTH = BOARD_HEIGHT = 512    # 400 is also a good option
@@ -15,6 +16,10 @@ DIMENSION = 8           # It is 8x8 chessboard
 SQ_SIZE = BOARD_HEIGHT//DIMENSION
 MAX_FPS = 15            # for animation later on
 IMAGES = {}
+BITBOARD_BACKEND = False    # generate moves from bit sets (Bitboards.py) instead of the 8x8 list
+PONDER = True   # let the AI think on the predicted reply while the human is thinking
+BOOK_FILE = None    # Polyglot .bin opening book the AI plays from while it has moves, None for no book
+BITBASE_DIR = None  # directory of the endgame bitbases made by Bitbases.py, None to play without
 
 ''' 
 Init a global dict of imgs and called exactly once in main
@@ -30,18 +35,30 @@ def loadImages():
             'Chess/images/'+piece+'.png'), (SQ_SIZE, SQ_SIZE))
 
 
+'''
+Create a fresh game with the selected board backend
+'''
+
+
+def newGameState():
+    if BITBOARD_BACKEND:
+        return Bitboards.BitboardGameState()
+    return ChessEngine.GameState()
+
+
 '''
 Main driver and handle user input and updating graphics
 '''
 
 
 def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')  # search stats on the console
     p.init()
     screen = p.display.set_mode((BOARD_WIDTH+MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color('white'))
     moveLogFont = p.font.SysFont('Arial', 18, False, False)
-    gs = ChessEngine.GameState()
+    gs = newGameState()
     validMoves = gs.getValidMoves()
     animate = False  # flag variable for when we should animate a move
     moveMade = False  # flag var when a move is made
@@ -54,7 +71,8 @@ def main():
     playerOne = True   #if human is playing white, it will be true. If AI playing, then false
     playerTwo = True  #same as above for black #set it true for 2 player game
     AIThinking = False
-    moveFinderProcess =None
+    # engine process, lives for the whole session and opens the book and bitbases itself
+    searchWorker = SearchWorker.SearchWorker(gs, bookFile=BOOK_FILE, bitbaseDir=BITBASE_DIR)
     
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
@@ -93,13 +111,17 @@ def main():
             # key handler
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # undo by press' z
+                    searchWorker.stopSearch()  # the position it was thinking or pondering about is gone
+                    AIThinking = False
                     gs.undoMove()
                     moveMade = True
                     animate = False
                     gameOver = False
 
                 if e.key == p.K_r:  # reset the board when 'r' is pressed
-                    gs = ChessEngine.GameState()
+                    AIThinking = False
+                    gs = newGameState()
+                    searchWorker.newGame(gs)
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
                     playerClicks = []
@@ -112,14 +134,13 @@ def main():
             if not AIThinking:
                 AIThinking=True
                 print('thinking...')
-                returnQueue = Queue()   #used to pass data between threads
-                moveFinderProcess = Process(target=SmartMoveFinder.findBestMove, args=(gs, validMoves, returnQueue))
-                moveFinderProcess.start()   #calls findBestMove(gs, validMoves, returnQueue)
-                # AIMove = SmartMoveFinder.findBestMove(gs, validMoves)
-                
-            if moveFinderProcess.is_alive():
-                # print('done thinking!')
-                AIMove = returnQueue.get()
+                searchWorker.startSearch(gs)  # sends only the moves played since its last search
+
+            try:
+                AIMove = searchWorker.getResult(block=False)  # poll, the UI keeps drawing while it thinks
+            except queue.Empty:
+                pass
+            else:
                 if AIMove is None:
                     AIMove = SmartMoveFinder.findRandomMove(validMoves)
                 print('done thinking!')
@@ -127,6 +148,8 @@ def main():
                 moveMade=True
                 animate=True
                 AIThinking=False
+                if PONDER and ((gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)):
+                    searchWorker.startPonder(gs)
 
         if moveMade:
             if animate:
@@ -146,6 +169,8 @@ def main():
         clock.tick(MAX_FPS)
         p.display.flip()
 
+    searchWorker.close()
+
 
 '''
 respo for draw' graphics in curr gs
@@ -0,0 +1,461 @@
+"""
+Headless engine against engine matches: every opening is played twice with the colors swapped,
+the games run in a process pool and are written to JSONL and PGN as they finish. Prints the Elo
+difference of engine1 with its 95% error bar, and stops early once an SPRT decides
+python Match.py --games 1000 --workers 8 --nodes 5000 --engine2 "name=no-lmr LMR_MIN_MOVES=99"
+python Match.py --time 0.1 --engine1 "selective=0" --sprt 0 10 --jsonl games.jsonl --pgn games.pgn
+An engine is a list of key=value settings: name, time (seconds per move), nodes, depth, hash (MB),
+ordering and selective (0 or 1), book (Polyglot file), bitbases (directory), and the constants of
+SmartMoveFinder the search reads while it runs (SEARCH_CONSTANTS), set while that engine searches
+"""
+
+import argparse
+import ast
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+import ChessEngine, Bitboards, SmartMoveFinder, UCI
+from ChessEngine import Move, MOVE_KIND_MASK, MOVE_CASTLE
+from TranspositionTable import TranspositionTable
+from OpeningBook import OpeningBook
+from Bitbases import Bitbases
+
+DEFAULT_NODES = 10000  # per move when no time, node or depth limit is given
+MAX_PLIES = 400  # games still going after this many plies are drawn
+# opening lines (coordinate moves from the start position) used without --openings
+DEFAULT_OPENINGS = (
+    'e2e4 e7e5 g1f3 b8c6 f1b5 a7a6',  # Ruy Lopez
+    'e2e4 e7e5 g1f3 b8c6 f1c4 f8c5',  # Italian
+    'e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6',  # Sicilian
+    'e2e4 e7e6 d2d4 d7d5',  # French
+    'e2e4 c7c6 d2d4 d7d5',  # Caro-Kann
+    'e2e4 d7d5 e4d5 d8d5',  # Scandinavian
+    'd2d4 d7d5 c2c4 e7e6 b1c3 g8f6',  # Queen's Gambit Declined
+    'd2d4 d7d5 c2c4 d5c4',  # Queen's Gambit Accepted
+    'd2d4 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 d7d6',  # King's Indian
+    'd2d4 g8f6 c2c4 e7e6 b1c3 f8b4',  # Nimzo-Indian
+    'c2c4 e7e5 b1c3 g8f6',  # English
+    'g1f3 d7d5 g2g3 g8f6 f1g2 c7c6',  # Reti
+)
+SETTINGS = ('name', 'time', 'nodes', 'depth', 'hash', 'ordering', 'selective', 'book', 'bitbases')
+# SmartMoveFinder constants an engine may set: the ones read while searching, the limits and
+# table size are taken from the settings above and would be ignored
+SEARCH_CONSTANTS = ('MOVE_ORDERING', 'SELECTIVE_SEARCH', 'HASH_MOVE_SCORE', 'CAPTURE_SCORE', 'KILLER_SCORES',
+                    'HISTORY_LIMIT', 'DELTA_MARGIN', 'NULL_MOVE_REDUCTION', 'NULL_MOVE_MIN_DEPTH',
+                    'LMR_MIN_DEPTH', 'LMR_MIN_MOVES', 'LMR_REDUCTION', 'NULL_WINDOW', 'ASPIRATION_WINDOW',
+                    'ASPIRATION_MIN_DEPTH', 'BITBASE_WIN')
+
+# what a match worker plays with (set by initMatchWorker)
+workerEngines = None
+workerBitboards = False
+workerMaxPlies = MAX_PLIES
+
+
+'''
+Engine settings from "key=value key=value" over the defaults, ValueError for an unknown key
+'''
+
+
+def parseEngine(text, defaults):
+    engine = dict(defaults)
+    engine['constants'] = {}
+    for item in text.split():
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError('engine settings are key=value: %r' % item)
+        if key.isupper():
+            if key not in SEARCH_CONSTANTS:
+                raise ValueError('%s is not a search constant, one of %s' % (key, ', '.join(SEARCH_CONSTANTS)))
+            engine['constants'][key] = ast.literal_eval(value)
+        elif key not in SETTINGS:
+            raise ValueError('unknown engine setting %r' % key)
+        elif key in ('name', 'book', 'bitbases'):
+            engine[key] = value
+        elif key in ('ordering', 'selective'):
+            engine[key] = value not in ('0', 'false', 'False', 'no')
+        else:
+            engine[key] = float(value) if key == 'time' else int(value)
+    return engine
+
+
+'''
+Openings as (label, FEN): every line of path is a FEN (EPD works, only the first four fields
+are needed) or coordinate moves from the start position, # starts a comment
+'''
+
+
+def loadOpenings(path=None):
+    if path is None:
+        lines = DEFAULT_OPENINGS
+    else:
+        with open(path) as f:
+            lines = [line.split('#')[0].strip() for line in f]
+    openings = []
+    for line in lines:
+        if not line:
+            continue
+        if '/' in line:
+            fields = line.split()
+            fen = ' '.join(fields[:6] if len(fields) >= 6 and fields[4].isdigit() else fields[:4])
+            ChessEngine.GameState.fromFen(fen)  # raises ValueError for a bad one
+            openings.append((fen, fen))
+            continue
+        gs = ChessEngine.GameState()
+        for notation in line.split():
+            move = UCI.findMove(gs, notation)
+            if move is None:
+                raise ValueError('illegal move %s in opening %r' % (notation, line))
+            gs.makeMove(move)
+        openings.append((line, gs.toFen()))
+    return openings
+
+
+'''
+Standard algebraic notation of a legal move code in gs (Nbd2, exd5, e8=Q+, O-O#...)
+'''
+
+
+def sanNotation(gs, move):
+    board = gs.board
+    view = Move.fromCode(move, board)
+    if move & MOVE_KIND_MASK == MOVE_CASTLE:
+        san = str(view)
+    elif view.pieceMoved[1] == 'p':
+        san = str(view)
+    else:
+        piece = view.pieceMoved
+        startSq, endSq = move & 63, (move >> 6) & 63
+        # other pieces of the same kind that can go to the same square
+        rivals = [other & 63 for other in gs.getValidMoveCodes()
+                  if (other >> 6) & 63 == endSq and other & 63 != startSq and
+                  board[(other & 63) >> 3][other & 7] == piece]
+        san = piece[1]
+        if rivals:
+            if all((sq & 7) != (startSq & 7) for sq in rivals):
+                san += Move.colsToFiles[startSq & 7]
+            elif all((sq >> 3) != (startSq >> 3) for sq in rivals):
+                san += Move.rowsToRanks[startSq >> 3]
+            else:
+                san += view.getRankFile(startSq >> 3, startSq & 7)
+        san += ('x' if view.isCapture else '') + view.getRankFile(endSq >> 3, endSq & 7)
+    gs.makeMove(move)
+    if gs.inCheck():
+        san += '#' if len(gs.getValidMoveCodes()) == 0 else '+'
+    gs.undoMove()
+    return san
+
+
+'''
+(result, reason) once the game in gs is over, None while it goes on. validMoves are the moves of
+the side to move
+'''
+
+
+def gameResult(gs, validMoves, maxPlies):
+    if len(validMoves) == 0:
+        if gs.inCheck():
+            return ('0-1' if gs.whiteToMove else '1-0'), 'checkmate'
+        return '1/2-1/2', 'stalemate'
+    clock = gs.halfmoveClock
+    if clock >= 100:
+        return '1/2-1/2', 'fifty moves'
+    # the position can only have been seen since the last capture or pawn move
+    if gs.zobristLog[-clock-1:].count(gs.zobristKey) >= 3:
+        return '1/2-1/2', 'threefold repetition'
+    if gs.pieceCount <= 3:
+        pieces = [piece[1] for row in gs.board for piece in row if piece != '--' and piece[1] != 'K']
+        if pieces == [] or pieces == ['N'] or pieces == ['B']:
+            return '1/2-1/2', 'insufficient material'
+    if len(gs.moveCodeLog) >= maxPlies:
+        return '1/2-1/2', 'move limit'
+    return None
+
+
+def initMatchWorker(engines, bitboards, maxPlies):
+    global workerEngines, workerBitboards, workerMaxPlies
+    workerEngines = []
+    for engine in engines:
+        engine = dict(engine)
+        engine['table'] = TranspositionTable(engine['hash'])
+        engine['book'] = OpeningBook(engine['book']) if engine['book'] else None
+        engine['bitbases'] = Bitbases(engine['bitbases']) if engine['bitbases'] else None
+        workerEngines.append(engine)
+    workerBitboards = bitboards
+    workerMaxPlies = maxPlies
+
+
+'''
+Runs in a match worker: one game, task is (game number, opening label, FEN, whether engine1 has
+white, random seed for the books). Every engine has its own transposition table, cleared before
+the game, and its constants set only while it searches. Returns the game record
+'''
+
+
+def playGame(task):
+    number, opening, fen, engine1White, seed = task
+    random.seed(seed)
+    engines = workerEngines if engine1White else workerEngines[::-1]  # white, black
+    gameClass = Bitboards.BitboardGameState if workerBitboards else ChessEngine.GameState
+    gs = gameClass.fromFen(fen)
+    for engine in engines:
+        engine['table'].clear()
+    moves, sans = [], []
+    nodes = [0, 0]
+    startTime = time.time()
+    validMoves = gs.getValidMoveCodes()
+    result = gameResult(gs, validMoves, workerMaxPlies)
+    while result is None:
+        side = 0 if gs.whiteToMove else 1
+        engine = engines[side]
+        saved = {name: getattr(SmartMoveFinder, name) for name in engine['constants']}
+        for name, value in engine['constants'].items():
+            setattr(SmartMoveFinder, name, value)
+        try:
+            search = SmartMoveFinder.Search(engine['time'], engine['nodes'], engine['depth'], 1,
+                                            table=engine['table'], moveOrdering=engine['ordering'],
+                                            selective=engine['selective'], book=engine['book'],
+                                            bitbases=engine['bitbases'], statsCallback=lambda stats: None)
+            move = search.run(gs, validMoves).code
+        finally:
+            for name, value in saved.items():
+                setattr(SmartMoveFinder, name, value)
+        nodes[side] += search.stats.nodes
+        moves.append(Move.fromCode(move, gs.board).getChessNotation())
+        sans.append(sanNotation(gs, move))
+        gs.makeMove(move)
+        validMoves = gs.getValidMoveCodes()
+        result = gameResult(gs, validMoves, workerMaxPlies)
+    return {'game': number, 'opening': opening, 'fen': fen,
+            'white': engines[0]['name'], 'black': engines[1]['name'], 'engine1White': engine1White,
+            'result': result[0], 'reason': result[1], 'plies': len(moves), 'moves': moves, 'san': sans,
+            'nodes': {'white': nodes[0], 'black': nodes[1]}, 'time': round(time.time() - startTime, 2)}
+
+
+'''
+PGN of a game record, the opening position goes in a FEN tag unless it's the start position
+'''
+
+
+def pgnText(record, event, date):
+    tags = [('Event', event), ('Site', '?'), ('Date', date), ('Round', str(record['game'])),
+            ('White', record['white']), ('Black', record['black']), ('Result', record['result'])]
+    fen = record['fen']
+    if fen != ChessEngine.START_FEN:
+        tags += [('SetUp', '1'), ('FEN', fen)]
+    tags.append(('Termination', record['reason']))
+    fields = fen.split()
+    whiteToMove = fields[1] == 'w'
+    moveNumber = int(fields[5]) if len(fields) > 5 else 1
+    tokens = []
+    for i, san in enumerate(record['san']):
+        if whiteToMove:
+            tokens.append('%d.' % moveNumber)
+        elif i == 0:
+            tokens.append('%d...' % moveNumber)
+        tokens.append(san)
+        if not whiteToMove:
+            moveNumber += 1
+        whiteToMove = not whiteToMove
+    tokens.append(record['result'])
+    lines, line = [], ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    lines.append(line)
+    return ''.join('[%s "%s"]\n' % (name, value.replace('"', "'")) for name, value in tags) + '\n' + \
+        '\n'.join(lines) + '\n\n'
+
+
+'''
+Expected score of a player rated elo above its opponent (logistic model)
+'''
+
+
+def eloScore(elo):
+    return 1 / (1 + 10**(-elo/400))
+
+
+def scoreElo(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1/score - 1)
+
+
+class MatchStats():
+    '''
+    Wins, draws and losses of engine1, the Elo difference with its 95% error bar and the log
+    likelihood ratio of the SPRT between elo0 (H0) and elo1 (H1), from the per game scores
+    '''
+
+    def __init__(self, elo0=None, elo1=None, alpha=0.05, beta=0.05):
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))  # LLR at which H0 is accepted
+        self.upper = math.log((1 - beta) / alpha)  # and H1
+
+    def add(self, record):
+        if record['result'] == '1/2-1/2':
+            self.draws += 1
+        elif (record['result'] == '1-0') == record['engine1White']:
+            self.wins += 1
+        else:
+            self.losses += 1
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        return (self.wins + self.draws/2) / self.games() if self.games() else 0.5
+
+    '''
+    Variance of the score of one game
+    '''
+
+    def variance(self):
+        games, score = self.games(), self.score()
+        if games == 0:
+            return 0.0
+        return (self.wins*(1 - score)**2 + self.draws*(0.5 - score)**2 + self.losses*score**2) / games
+
+    def elo(self):
+        return scoreElo(self.score())
+
+    '''
+    Half the width of the 95% confidence interval of elo()
+    '''
+
+    def eloError(self):
+        if self.variance() == 0:  # no games yet, or only one kind of result
+            return float('inf')
+        margin = 1.96 * math.sqrt(self.variance() / self.games())
+        return (scoreElo(self.score() + margin) - scoreElo(self.score() - margin)) / 2
+
+    '''
+    Log likelihood ratio of elo1 against elo0 (normal approximation of the score), 0 without an SPRT
+    '''
+
+    def llr(self):
+        variance = self.variance()
+        if self.elo0 is None or variance == 0:
+            return 0.0
+        score0, score1 = eloScore(self.elo0), eloScore(self.elo1)
+        return self.games() * (score1 - score0) * (2*self.score() - score0 - score1) / (2*variance)
+
+    '''
+    'H1' or 'H0' once the SPRT accepted one, None while it needs more games
+    '''
+
+    def sprtResult(self):
+        if self.elo0 is None:
+            return None
+        llr = self.llr()
+        if llr >= self.upper:
+            return 'H1'
+        if llr <= self.lower:
+            return 'H0'
+        return None
+
+    def __str__(self):
+        text = 'games %d +%d -%d =%d score %.1f%% elo %+.1f +- %.1f' % (
+            self.games(), self.wins, self.losses, self.draws, 100*self.score(), self.elo(), self.eloError())
+        if self.elo0 is not None:
+            text += ' llr %.2f (%.2f, %.2f) [%g, %g]' % (self.llr(), self.lower, self.upper, self.elo0, self.elo1)
+        return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Engine against engine match')
+    parser.add_argument('--engine1', default='', help='settings of the engine the result is for, key=value ...')
+    parser.add_argument('--engine2', default='', help='settings of its opponent')
+    parser.add_argument('--games', type=int, default=100, help='games to play (rounded up to pairs)')
+    parser.add_argument('--openings', metavar='FILE', help='FENs or coordinate move lines, one per line')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='games played at once')
+    parser.add_argument('--time', type=float, help='seconds per move')
+    parser.add_argument('--nodes', type=int, help='nodes per move (default %d without other limits)' % DEFAULT_NODES)
+    parser.add_argument('--depth', type=int, help='maximum depth per move')
+    parser.add_argument('--hash', type=int, default=SmartMoveFinder.HASH_SIZE_MB, help='MB per engine')
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES, help='longer games are drawn')
+    parser.add_argument('--bitboards', action='store_true', help='use the bitboard GameState backend')
+    parser.add_argument('--sprt', nargs=2, type=float, metavar=('ELO0', 'ELO1'),
+                        help='stop once engine1 is shown to be ELO0 or ELO1 stronger')
+    parser.add_argument('--alpha', type=float, default=0.05, help='SPRT false positive rate')
+    parser.add_argument('--beta', type=float, default=0.05, help='SPRT false negative rate')
+    parser.add_argument('--jsonl', metavar='FILE', help='append one JSON record per game')
+    parser.add_argument('--pgn', metavar='FILE', help='append the games as PGN')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the opening order and the books')
+    args = parser.parse_args()
+
+    if args.time is None and args.nodes is None and args.depth is None:
+        args.nodes = DEFAULT_NODES
+    defaults = {'time': args.time or 0, 'nodes': args.nodes or 0, 'depth': args.depth or SmartMoveFinder.MAX_DEPTH,
+                'hash': args.hash, 'ordering': None, 'selective': None, 'book': None, 'bitbases': None}
+    try:
+        engines = [parseEngine(args.engine1, dict(defaults, name='engine1')),
+                   parseEngine(args.engine2, dict(defaults, name='engine2'))]
+        openings = loadOpenings(args.openings)
+    except (ValueError, SyntaxError, OSError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    if not openings:
+        print('no openings', file=sys.stderr)
+        sys.exit(2)
+    rng = random.Random(args.seed)
+    rng.shuffle(openings)
+    tasks = []
+    for pair in range((args.games + 1) // 2):
+        opening, fen = openings[pair % len(openings)]
+        seed = rng.getrandbits(32)
+        tasks.append((2*pair + 1, opening, fen, True, seed))
+        tasks.append((2*pair + 2, opening, fen, False, seed))
+
+    stats = MatchStats(*(args.sprt or (None, None)), alpha=args.alpha, beta=args.beta)
+    event = '%s vs %s' % (engines[0]['name'], engines[1]['name'])
+    date = time.strftime('%Y.%m.%d')
+    jsonlFile = open(args.jsonl, 'a') if args.jsonl else None
+    pgnFile = open(args.pgn, 'a') if args.pgn else None
+    initargs = (engines, args.bitboards, args.max_plies)
+    startTime = time.time()
+    pool = None
+    try:
+        if args.workers > 1:
+            pool = multiprocessing.Pool(args.workers, initializer=initMatchWorker, initargs=initargs)
+            records = pool.imap_unordered(playGame, tasks)
+        else:
+            initMatchWorker(*initargs)
+            records = map(playGame, tasks)
+        for record in records:
+            stats.add(record)
+            if jsonlFile is not None:
+                jsonlFile.write(json.dumps(record) + '\n')
+                jsonlFile.flush()
+            if pgnFile is not None:
+                pgnFile.write(pgnText(record, event, date))
+                pgnFile.flush()
+            print('game %d %s-%s %s %s | %s' % (record['game'], record['white'], record['black'],
+                                                record['result'], record['reason'], stats))
+            sys.stdout.flush()
+            if stats.sprtResult() is not None:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+        for f in (jsonlFile, pgnFile):
+            if f is not None:
+                f.close()
+    decision = stats.sprtResult()
+    print('%s in %.0fs' % (stats, time.time() - startTime))
+    if decision is not None:
+        print('SPRT: %s accepted, engine1 is %s' % (decision, 'stronger by elo1' if decision == 'H1'
+                                                     else 'not stronger by elo1'))
+
+
+if __name__ == '__main__':
+    main()
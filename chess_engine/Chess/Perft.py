@@ -0,0 +1,135 @@
+"""
+Perft: counts the leaf nodes of the legal move tree to a fixed depth, the standard check for a
+move generator (the counts of the reference positions are known) and its throughput benchmark
+python Perft.py --suite [--depth 4] [--bitboards] [--profile FILE]
+python Perft.py --depth 3 [--fen FEN] [--divide] [--bitboards] [--profile FILE]
+"""
+
+import argparse
+import sys
+import time
+import ChessEngine, Bitboards, Profiler
+
+# reference positions with their node counts at depth 1, 2, 3... (chessprogramming.org perft results)
+PERFT_POSITIONS = [
+    ('start', ChessEngine.START_FEN,
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603, 193690690]),
+    ('position 3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ('position 4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333, 15833292]),
+    ('position 5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487, 89941194]),
+    ('position 6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594, 164075551]),
+]
+
+
+def newGameState(fen, bitboards=False):
+    if bitboards:
+        return Bitboards.BitboardGameState.fromFen(fen)
+    return ChessEngine.GameState.fromFen(fen)
+
+
+'''
+Number of leaf nodes depth plies below the current position, buffers holds a reusable move
+list per ply. The last ply is counted without making the moves
+'''
+
+
+def perft(gs, depth, buffers=None):
+    if buffers is None:
+        buffers = [[] for i in range(depth+1)]
+    if depth == 0:
+        return 1
+    moves = gs.generateValidMoves(buffers[depth])
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth-1, buffers)
+        gs.undoMove()
+    return nodes
+
+
+'''
+Perft split by root move, to narrow a wrong count down to the move whose subtree is off
+'''
+
+
+def divide(gs, depth):
+    buffers = [[] for i in range(depth+1)]
+    total = 0
+    for move in list(gs.generateValidMoves()):
+        notation = ChessEngine.Move.fromCode(move, gs.board).getChessNotation()
+        gs.makeMove(move)
+        nodes = perft(gs, depth-1, buffers)
+        gs.undoMove()
+        total += nodes
+        print('%s: %d' % (notation, nodes))
+    return total
+
+
+'''
+Run every reference position to depth (or as deep as its counts go), returns False on a wrong count
+'''
+
+
+def runSuite(depth, bitboards=False):
+    ok = True
+    totalNodes = 0
+    startTime = time.time()
+    for name, fen, counts in PERFT_POSITIONS:
+        positionDepth = min(depth, len(counts))
+        gs = newGameState(fen, bitboards)
+        positionStart = time.time()
+        nodes = perft(gs, positionDepth)
+        elapsed = time.time() - positionStart
+        totalNodes += nodes
+        expected = counts[positionDepth-1]
+        status = 'ok' if nodes == expected else 'FAILED, expected %d' % expected
+        ok = ok and nodes == expected
+        print('%-10s depth %d nodes %d time %.2fs nps %d %s' % (
+            name, positionDepth, nodes, elapsed, nodes/elapsed if elapsed else 0, status))
+    elapsed = time.time() - startTime
+    print('total nodes %d time %.2fs nps %d' % (totalNodes, elapsed, totalNodes/elapsed if elapsed else 0))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move generator node counts')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fen', default=ChessEngine.START_FEN, help='position to count from (ignored with --suite)')
+    parser.add_argument('--divide', action='store_true', help='print the count below every root move')
+    parser.add_argument('--suite', action='store_true', help='check the reference positions')
+    parser.add_argument('--bitboards', action='store_true', help='use the bitboard GameState backend')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='time the move generator and evaluation, write collapsed stacks to FILE')
+    args = parser.parse_args()
+    profiler = Profiler.Profiler() if args.profile else None
+    if profiler is not None:
+        profiler.enable()  # before the game states are built, see Profiler
+    if args.suite:
+        ok = runSuite(args.depth, args.bitboards)
+    else:
+        ok = True
+        gs = newGameState(args.fen, args.bitboards)
+        startTime = time.time()
+        if args.divide:
+            nodes = divide(gs, args.depth)
+        else:
+            nodes = perft(gs, args.depth)
+        elapsed = time.time() - startTime
+        print('nodes %d time %.2fs nps %d' % (nodes, elapsed, nodes/elapsed if elapsed else 0))
+    if profiler is not None:
+        profiler.disable()
+        profiler.report()
+        profiler.writeCollapsed(args.profile)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Opt-in profiling of the move generator and evaluation hot spots. enable() puts timing wrappers
+around the hot functions and disable() puts the originals back, so nothing is paid while it's off.
+Records call counts, cumulative time and the self time of every call stack, which writeCollapsed
+saves in the collapsed stack format flamegraph.pl and speedscope read
+python Benchmark.py --depth 3 --profile bench.folded
+python Perft.py --depth 3 --profile perft.folded
+"""
+
+import functools
+import sys
+import time
+import ChessEngine, Bitboards, SmartMoveFinder
+
+# methods timed on every GameState class that defines them
+HOT_METHODS = ('getValidMoves', 'getValidMoveCodes', 'getValidCaptureCodes', 'generateValidMoves',
+               'checkForPinsAndChecks', 'getAllPossibleMoves', 'getPawnMoves', 'getRookMoves', 'getKnightMoves',
+               'getBishopMoves', 'getQueenMoves', 'getKingMoves', 'getCastleMoves', 'squareUnderAttack',
+               'kingAttackedOn', 'getAttackers')
+GAME_STATE_CLASSES = (ChessEngine.GameState, Bitboards.BitboardGameState)
+# evaluation functions timed in SmartMoveFinder
+HOT_FUNCTIONS = ('scoreBoard', 'scorePosition')
+
+
+class Profiler():
+    '''
+    Times the hot functions of the calling process while enabled (the processes of a parallel
+    search aren't seen). GameStates built before enable() keep their untimed per piece
+    generators in moveFunctions, so enable first and build the positions afterwards.
+    The wrappers cost a few microseconds per call, which shows most on the cheapest functions
+    '''
+
+    def __init__(self):
+        self.originals = []  # (owner, name, function) replaced by enable
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.totalTime = {}  # time inside the function, calls from other timed functions included
+        self.stackTime = {}  # (outermost name, ..., name): time in name itself on that stack
+        self.stack = []
+        self.childTime = []  # time spent in timed callees, per open call on the stack
+        self.elapsed = 0.0
+        self.enabledAt = None
+
+    def enable(self):
+        if self.originals:
+            return
+        for owner in GAME_STATE_CLASSES:
+            for name in HOT_METHODS:
+                if name in owner.__dict__:
+                    self.wrap(owner, name, owner.__name__ + '.' + name)
+        for name in HOT_FUNCTIONS:
+            self.wrap(SmartMoveFinder, name, name)
+        self.enabledAt = time.perf_counter()
+
+    def disable(self):
+        for owner, name, function in reversed(self.originals):
+            setattr(owner, name, function)
+        self.originals = []
+        if self.enabledAt is not None:
+            self.elapsed += time.perf_counter() - self.enabledAt
+            self.enabledAt = None
+
+    '''
+    Replace owner.name (a method of a class or a function of a module) by a timed version
+    '''
+
+    def wrap(self, owner, name, label):
+        function = owner.__dict__[name]
+        self.originals.append((owner, name, function))
+        calls, totalTime, stackTime = self.calls, self.totalTime, self.stackTime
+        stack, childTime = self.stack, self.childTime
+        calls.setdefault(label, 0)
+        totalTime.setdefault(label, 0.0)
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            stack.append(label)
+            childTime.append(0.0)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                key = tuple(stack)
+                stack.pop()
+                stackTime[key] = stackTime.get(key, 0.0) + elapsed - childTime.pop()
+                if childTime:
+                    childTime[-1] += elapsed
+                calls[label] += 1
+                if label not in stack:  # a recursive call is already inside the outer one's time
+                    totalTime[label] += elapsed
+
+        setattr(owner, name, timed)
+
+    '''
+    Print call counts, cumulative and per call time of every timed function, busiest first
+    '''
+
+    def report(self, file=sys.stdout):
+        elapsed = self.elapsed
+        if self.enabledAt is not None:
+            elapsed += time.perf_counter() - self.enabledAt
+        print('%-40s %10s %10s %7s %10s' % ('function', 'calls', 'total s', '%', 'us/call'), file=file)
+        for label in sorted(self.calls, key=lambda label: self.totalTime[label], reverse=True):
+            calls = self.calls[label]
+            if calls == 0:
+                continue
+            total = self.totalTime[label]
+            print('%-40s %10d %10.3f %7.1f %10.2f' % (label, calls, total, 100*total/elapsed if elapsed else 0,
+                                                     1e6*total/calls), file=file)
+        print('profiled time %.3fs' % elapsed, file=file)
+
+    '''
+    Write one "outer;inner;function microseconds" line per call stack, time outside the timed
+    functions goes on an "other" line
+    '''
+
+    def writeCollapsed(self, path):
+        elapsed = self.elapsed
+        if self.enabledAt is not None:
+            elapsed += time.perf_counter() - self.enabledAt
+        timed = 0.0
+        with open(path, 'w') as f:
+            for key, seconds in sorted(self.stackTime.items()):
+                timed += seconds
+                f.write('%s %d\n' % (';'.join(key), round(1e6*seconds)))
+            if elapsed > timed:
+                f.write('other %d\n' % round(1e6*(elapsed - timed)))
@@ -0,0 +1,218 @@
+"""
+Long lived engine process: keeps its own copy of the game and its search tables between moves,
+so an AI move only costs sending the moves played since the last search
+"""
+
+import queue
+import time
+from multiprocessing import Process, Queue, Value
+import SmartMoveFinder
+
+
+class SearchStop():
+    '''
+    Stop event of one Search: set once the UI stopped this search or a later one,
+    so a stop can't be lost or hit the next search when it arrives between two searches.
+    A ponder search also has a shared deadline and node limit, set by the UI on a ponder hit
+    (0 while pondering or without a limit). The nodes count from the hit, for that the worker
+    hands over its search
+    '''
+
+    def __init__(self, stoppedSearch, searchId, deadline=None, nodeLimit=None):
+        self.stoppedSearch = stoppedSearch
+        self.searchId = searchId
+        self.deadline = deadline
+        self.nodeLimit = nodeLimit
+        self.search = None
+        self.hitNodes = None  # nodes of the search when the node limit was first seen
+
+    # the pool workers of a parallel search get a copy without the search, they have their own node share
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['search'] = None
+        return state
+
+    def is_set(self):
+        if self.stoppedSearch.value >= self.searchId:
+            return True
+        if self.deadline is not None and 0 < self.deadline.value <= time.time():
+            return True
+        if self.nodeLimit is not None and self.nodeLimit.value and self.search is not None:
+            if self.hitNodes is None:
+                self.hitNodes = self.search.nodes
+            return self.search.nodes - self.hitNodes >= self.nodeLimit.value
+        return False
+
+
+'''
+Loop of the worker process, works through (command, args...) tuples from commands:
+('position', gs) replaces the game, ('sync', undoCount, moves) takes back undoCount moves and
+plays the move codes, ('search', searchId, timeLimit, nodeLimit, maxDepth, workers) puts
+(searchId, best Move or None, predicted reply code or None) on results,
+('ponder', searchId, reply, maxDepth, workers) searches the position after the predicted reply
+without a time limit (until stopped or given a deadline) and answers the same way,
+('quit',) ends the process
+stoppedSearch is the shared id of the last search the UI stopped, ponderDeadline and
+ponderNodeLimit the limits of the ponder search once the reply was played.
+The process opens the Polyglot book at bookFile and the bitbases in bitbaseDir itself (None for none)
+'''
+
+
+def runWorker(gs, commands, results, stoppedSearch, ponderDeadline, ponderNodeLimit, bookFile=None,
+              bitbaseDir=None):
+    if bookFile:
+        SmartMoveFinder.setBook(bookFile)
+    if bitbaseDir:
+        SmartMoveFinder.setBitbases(bitbaseDir)
+    while True:
+        command = commands.get()
+        name = command[0]
+        if name == 'quit':
+            break
+        elif name == 'position':
+            gs = command[1]
+        elif name == 'sync':
+            for i in range(command[1]):
+                gs.undoMove()
+            for move in command[2]:
+                gs.makeMove(move)
+        elif name == 'search' or name == 'ponder':
+            if name == 'search':
+                searchId, timeLimit, nodeLimit, maxDepth, workers = command[1:]
+                stop = SearchStop(stoppedSearch, searchId)
+            else:
+                searchId, reply, maxDepth, workers = command[1:]
+                timeLimit, nodeLimit = 0, 0
+                stop = SearchStop(stoppedSearch, searchId, ponderDeadline, ponderNodeLimit)
+                gs.makeMove(reply)  # only for this search, the UI decides whether it gets played
+            search = SmartMoveFinder.Search(timeLimit, nodeLimit, maxDepth, workers,
+                                            table=SmartMoveFinder.sessionTable(workers), stopEvent=stop)
+            stop.search = search
+            bestMove = search.run(gs)
+            nextReply = search.predictReply(gs, bestMove) if bestMove is not None else None
+            if name == 'ponder':
+                gs.undoMove()
+            results.put((searchId, bestMove, nextReply))
+
+
+class SearchWorker():
+    '''
+    UI side handle of the worker process. It remembers which moves the worker has played,
+    so undos and new moves are sent as a difference instead of pickling the GameState again.
+    Every search gets an id, results of searches that were stopped or replaced are dropped.
+    While the opponent thinks it can ponder: search the reply the last search predicted, and
+    keep that search running as the real one if the opponent plays it.
+    The searches play from the Polyglot book at bookFile and probe the bitbases in bitbaseDir,
+    both opened in the worker process
+    '''
+
+    def __init__(self, gs, bookFile=None, bitbaseDir=None):
+        self.commands = Queue()
+        self.results = Queue()
+        self.stoppedSearch = Value('i', 0)
+        self.ponderDeadline = Value('d', 0.0)
+        self.ponderNodeLimit = Value('q', 0)
+        self.searchId = 0
+        self.ponderId = None  # id of the running ponder search
+        self.predictedReply = None  # (our move code, reply code) from the last result
+        self.process = Process(target=runWorker, args=(gs, self.commands, self.results,
+                                                       self.stoppedSearch, self.ponderDeadline,
+                                                       self.ponderNodeLimit, bookFile, bitbaseDir))
+        self.process.start()
+        self.syncedMoves = list(gs.moveCodeLog)
+
+    '''
+    Start over from a new game state (reset or a position that isn't a continuation)
+    '''
+
+    def newGame(self, gs):
+        self.stopSearch()
+        self.predictedReply = None
+        self.commands.put(('position', gs))
+        self.syncedMoves = list(gs.moveCodeLog)
+
+    '''
+    Bring the worker's game to gs: undo back to the last move both agree on, then play the rest
+    '''
+
+    def sync(self, gs):
+        played = gs.moveCodeLog
+        common = 0
+        while common < len(self.syncedMoves) and common < len(played) and \
+                self.syncedMoves[common] == played[common]:
+            common += 1
+        undoCount = len(self.syncedMoves) - common
+        if undoCount or common < len(played):
+            self.commands.put(('sync', undoCount, played[common:]))
+            self.syncedMoves = list(played)
+
+    '''
+    Search the position of gs in the worker, the result is picked up with getResult.
+    Limits left out (None) are the SmartMoveFinder settings at the time of the call, a time or
+    node limit of 0 means none. On a ponder hit the ponder search just gets its time and node
+    limits, counted from the hit, on a miss it is stopped
+    '''
+
+    def startSearch(self, gs, timeLimit=None, nodeLimit=None, maxDepth=None, workers=None):
+        timeLimit = SmartMoveFinder.TIME_LIMIT if timeLimit is None else timeLimit
+        nodeLimit = SmartMoveFinder.NODE_LIMIT if nodeLimit is None else nodeLimit
+        maxDepth = SmartMoveFinder.MAX_DEPTH if maxDepth is None else maxDepth
+        workers = SmartMoveFinder.SEARCH_WORKERS if workers is None else workers
+        if self.isPondering():
+            if gs.moveCodeLog == self.syncedMoves + [self.predictedReply[1]]:  # ponder hit
+                self.ponderNodeLimit.value = nodeLimit
+                self.ponderDeadline.value = time.time() + timeLimit if timeLimit else 0.0
+                self.ponderId = None
+                return
+            self.stopSearch()  # ponder miss, that search is of no use
+        self.sync(gs)
+        self.searchId += 1
+        self.commands.put(('search', self.searchId, timeLimit, nodeLimit, maxDepth, workers))
+
+    '''
+    Ponder on the opponent's time: gs is the position after the move of the last search, the
+    worker searches on with the reply it predicted played. Does nothing without a prediction
+    '''
+
+    def startPonder(self, gs, maxDepth=None, workers=None):
+        if self.predictedReply is None or not gs.moveCodeLog or gs.moveCodeLog[-1] != self.predictedReply[0]:
+            return
+        maxDepth = SmartMoveFinder.MAX_DEPTH if maxDepth is None else maxDepth
+        workers = SmartMoveFinder.SEARCH_WORKERS if workers is None else workers
+        self.sync(gs)
+        self.searchId += 1
+        self.ponderId = self.searchId
+        self.ponderDeadline.value = 0.0
+        self.ponderNodeLimit.value = 0
+        self.commands.put(('ponder', self.searchId, self.predictedReply[1], maxDepth, workers))
+
+    def isPondering(self):
+        return self.ponderId is not None and self.ponderId == self.searchId and \
+            self.stoppedSearch.value < self.ponderId
+
+    '''
+    Stop the running search or ponder search (if any), its result will never be returned by getResult
+    '''
+
+    def stopSearch(self):
+        self.stoppedSearch.value = self.searchId
+        self.ponderId = None
+
+    '''
+    Best Move of the last search (None without legal moves), raises queue.Empty when
+    block is False and the search hasn't finished
+    '''
+
+    def getResult(self, block=True):
+        if self.isPondering():  # the ponder result is only wanted after a ponder hit
+            raise queue.Empty
+        while True:
+            searchId, move, reply = self.results.get(block)
+            if searchId == self.searchId and self.stoppedSearch.value < searchId:
+                self.predictedReply = (move.code, reply) if move is not None and reply is not None else None
+                return move
+
+    def close(self):
+        self.stopSearch()
+        self.commands.put(('quit',))
+        self.process.join()
@@ -1,72 +1,127 @@
+import logging
+import multiprocessing
 import random
+import time
+from TranspositionTable import TranspositionTable, SharedTranspositionTable, EXACT, LOWERBOUND, UPPERBOUND
+from OpeningBook import OpeningBook
+from Bitbases import Bitbases, WIN, LOSS
+from Evaluation import pieceScore
+from ChessEngine import Move, MOVE_KIND_MASK, MOVE_ENPASSANT, MOVE_PROMOTION, PROMOTION_PIECES
 
-pieceScore = {'K': 0, 'Q': 10, 'R': 5, 'B': 3, 'N': 3, 'p': 1}
-
-bishopScores = [[4, 3, 2, 1, 1, 2, 3, 4],
-                [3, 4, 3, 2, 2, 3, 4, 3],
-                [2, 3, 4, 3, 3, 4, 3, 2],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [2, 3, 4, 3, 3, 4, 3, 2],
-                [3, 4, 3, 2, 2, 3, 4, 3],
-                [4, 3, 2, 1, 1, 2, 3, 4]
-                ]
-
-knightScores = [[4, 3, 2, 1, 1, 2, 3, 4],
-                [1, 2, 2, 2, 2, 2, 2, 1],
-                [1, 2, 3, 3, 3, 3, 2, 1],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [1, 2, 3, 3, 3, 3, 2, 1],
-                [1, 2, 2, 2, 2, 2, 2, 1],
-                [1, 1, 1, 1, 1, 1, 1, 1],
-                ]
-
-queenScores = [[1, 1, 1, 3, 1, 1, 1, 1],
-               [1, 2, 3, 3, 3, 1, 1, 1],
-               [1, 4, 3, 3, 3, 4, 2, 1],
-               [1, 2, 3, 3, 3, 2, 2, 1],
-               [1, 2, 3, 3, 3, 2, 2, 1],
-               [1, 4, 3, 3, 3, 4, 2, 1],
-               [1, 1, 2, 3, 3, 1, 1, 1],
-               [1, 1, 1, 3, 1, 1, 1, 1],
-               ]
-
-rookScores = [[4, 3, 4, 4, 4, 4, 3, 4],
-              [4, 4, 4, 4, 4, 4, 4, 4],
-              [1, 1, 2, 3, 3, 2, 1, 1],
-              [1, 2, 3, 4, 4, 2, 2, 1],
-              [1, 2, 3, 4, 4, 2, 2, 1],
-              [1, 1, 2, 3, 3, 2, 1, 1],
-              [4, 4, 4, 4, 4, 4, 4, 4],
-              [4, 3, 4, 4, 4, 4, 3, 4],
-              ]
-
-whitePawnScores = [[8, 8, 8, 8, 8, 8, 8, 8],
-                   [8, 8, 8, 8, 8, 8, 8, 8],
-                   [5, 6, 6, 7, 7, 6, 6, 5],
-                   [2, 3, 3, 5, 5, 3, 3, 2],
-                   [1, 2, 3, 4, 4, 2, 2, 1],
-                   [1, 1, 2, 3, 3, 2, 1, 1],
-                   [1, 1, 1, 0, 0, 1, 1, 1],
-                   [0, 0, 0, 0, 0, 0, 0, 0],
-                   ]
-
-blackPawnScores = [[0, 0, 0, 0, 0, 0, 0, 0],
-                   [1, 1, 1, 0, 0, 1, 1, 1],
-                   [1, 1, 2, 3, 3, 2, 1, 1],
-                   [1, 2, 3, 4, 4, 2, 2, 1],
-                   [2, 3, 3, 5, 5, 3, 3, 2],
-                   [5, 6, 6, 7, 7, 6, 6, 5],
-                   [8, 8, 8, 8, 8, 8, 8, 8],
-                   [8, 8, 8, 8, 8, 8, 8, 8],
-                   ]
-
-piecePositionScores = {'N': knightScores, 'Q':queenScores, 'B':bishopScores, 'R':rookScores, 'bp':blackPawnScores, 'wp':whitePawnScores}
-
-CHECKMATE = 1000
+
+CHECKMATE = 1000  # the search scores a mate found ply plies from the root CHECKMATE - ply
 STALEMATE = 0
-DEPTH = 2
+MAX_PLY = 256  # deeper than any line of the search, quiescence included
+MATE_BOUND = CHECKMATE - MAX_PLY  # scores at least this far from 0 are mates
+DEPTH = 2  # fixed depth of findMoveMinMax / findMoveNegaMax
+MAX_DEPTH = 32  # iterative deepening in Search stops here at the latest
+TIME_LIMIT = 3.0  # seconds per move, 0 or None for no limit
+NODE_LIMIT = 0  # nodes per move, 0 or None for no limit
+HASH_SIZE_MB = 16
+SEARCH_WORKERS = 1  # processes searching root moves in parallel, 1 searches in the calling process
+PARALLEL_MIN_DEPTH = 5  # shallower iterations cost less than the pool, the calling process searches them
+MOVE_ORDERING = True  # hash move, MVV-LVA captures, killers and history (False searches in generation order)
+
+# piece values for ordering captures, the king is the most expensive attacker
+orderingValue = {'p': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 20}
+HASH_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000
+KILLER_SCORES = (90000, 89000)
+HISTORY_LIMIT = 80000  # quiet moves never outrank killers
+DELTA_MARGIN = 2  # positional slack when pruning captures in the quiescence search
+SELECTIVE_SEARCH = True  # null move pruning and late move reductions (False searches every move to full depth)
+NULL_MOVE_REDUCTION = 2  # the null move is searched this much shallower than a real move
+NULL_MOVE_MIN_DEPTH = 3
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3  # moves searched at full depth before quiet ones get reduced
+LMR_REDUCTION = 1
+# scores are multiples of a tenth of a pawn, so nothing lies strictly inside a window this narrow
+NULL_WINDOW = 0.05
+ASPIRATION_WINDOW = 0.5  # first window of an iteration, previous score +- this many pawns
+ASPIRATION_MIN_DEPTH = 3  # shallower iterations are cheap and their scores jump, they use the full window
+BITBASE_WIN = CHECKMATE / 2  # won ending from the bitbases: below any mate found, above any material
+
+# a search without a statsCallback reports its SearchStats here
+logger = logging.getLogger(__name__)
+
+# table of the engine session (UCI, the SearchWorker process): passed to every search on purpose,
+# so it stays warm between moves
+transpositionTable = TranspositionTable(HASH_SIZE_MB)
+# the same for the session's parallel searches, in shared memory for the pool workers (see sessionTable)
+sharedTranspositionTable = None
+
+# Polyglot book played from before searching, None without one (see setBook)
+openingBook = None
+# win/draw/loss tables of the small endings the search probes, None without (see setBitbases)
+endgameBitbases = None
+
+# search a parallel search worker runs root moves with and its position (set by initSearchWorker)
+workerSearch = None
+workerGameState = None
+
+
+'''
+Resize (and clear) the session tables the UI and UCI searches are given
+'''
+
+
+def setHashSize(sizeMB):
+    transpositionTable.resize(sizeMB)
+    if sharedTranspositionTable is not None:
+        sharedTranspositionTable.resize(sizeMB)
+
+
+'''
+Forget everything the searches stored (new game)
+'''
+
+
+def clearHash():
+    transpositionTable.clear()
+    if sharedTranspositionTable is not None:
+        sharedTranspositionTable.clear()
+
+
+'''
+The session table for a search with this many workers: transpositionTable, or the shared memory
+one for a parallel search (made the same size on first use)
+'''
+
+
+def sessionTable(workers):
+    global sharedTranspositionTable
+    if workers <= 1:
+        return transpositionTable
+    if sharedTranspositionTable is None:
+        sharedTranspositionTable = SharedTranspositionTable(transpositionTable.sizeMB)
+    return sharedTranspositionTable
+
+
+'''
+Open the Polyglot book at path for the searches that aren't given one, None closes it
+'''
+
+
+def setBook(path):
+    global openingBook
+    book = OpeningBook(path) if path else None  # a book that fails to open keeps the old one
+    if openingBook is not None:
+        openingBook.close()
+    openingBook = book
+
+
+'''
+Load the bitbases of a directory (made by Bitbases.py) for the searches that aren't given any,
+None unloads them
+'''
+
+
+def setBitbases(directory):
+    global endgameBitbases
+    tables = Bitbases(directory) if directory else None
+    if endgameBitbases is not None:
+        endgameBitbases.close()
+    endgameBitbases = tables
 
 
 '''
@@ -121,101 +176,765 @@ def findBestMoveMinMaxNoRecursion(gs, validMoves):
     return bestPlayerMove
 
 
-'''
-Helper method to make first recursive call
-'''
+class SearchStats():
+    '''
+    What a search did: node counts, cutoffs, transposition table use and timing. A Search hands
+    one to its statsCallback after every finished iteration and once more at the end (final).
+    The cutoff rates are over the main search nodes that searched moves, quiescence excluded.
+    The table probes and hits are this search's own, even when it shares its table
+    '''
 
+    # counts that add up when the stats of parallel workers are merged
+    COUNTERS = ('nodes', 'qnodes', 'interiorNodes', 'betaCutoffs', 'firstMoveCutoffs', 'nullMoveCutoffs',
+                'lmrReSearches', 'pvsReSearches', 'aspirationReSearches', 'ttProbes', 'ttHits', 'bitbaseHits')
 
-def findBestMove(gs, validMoves, returnQueue):
-    global nextMove, counter
-    nextMove = None
-    random.shuffle(validMoves)
-    counter = 0
-    # findMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove)
-    # findMoveNegaMax(gs, validMoves, DEPTH, 1 if gs.whiteToMove else -1)
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -
-                             CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    print(counter)
-    returnQueue.put(nextMove)
-
-
-def findMoveMinMax(gs, validMoves, depth, whiteToMove):
-    global nextMove
-    if depth == 0:
-        # return scoreMaterial(gs.board)
-        return scoreBoard(gs)
-
-    if whiteToMove:
+    def __init__(self):
+        self.nodes = 0  # main search and quiescence nodes
+        self.qnodes = 0
+        self.interiorNodes = 0  # main search nodes that searched moves
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0  # beta cutoffs by the first move searched
+        self.nullMoveCutoffs = 0
+        self.lmrReSearches = 0  # reduced moves that beat alpha and were searched again at full depth
+        self.pvsReSearches = 0  # null window searches that failed high and needed the full window
+        self.aspirationReSearches = 0  # root searches repeated with a wider window
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.bitbaseHits = 0  # nodes answered by the bitbases
+        self.depth = 0  # last finished iteration
+        self.seldepth = 0  # deepest ply reached, quiescence included
+        self.time = 0.0
+        self.iterationTimes = []  # seconds each finished iteration took
+        self.bestMove = None  # move code
+        self.score = 0
+        self.pv = ()  # principal variation, move codes
+        self.final = False
+
+    '''
+    Add (sign 1) or take away (sign -1) the counters of other
+    '''
+
+    def add(self, other, sign=1):
+        for name in SearchStats.COUNTERS:
+            setattr(self, name, getattr(self, name) + sign*getattr(other, name))
+        self.seldepth = max(self.seldepth, other.seldepth)
+
+    def nps(self):
+        return self.nodes / self.time if self.time else 0.0
+
+    def betaCutoffRate(self):
+        return self.betaCutoffs / self.interiorNodes if self.interiorNodes else 0.0
+
+    def firstMoveCutoffRate(self):
+        return self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs else 0.0
+
+    def ttHitRate(self):
+        return self.ttHits / self.ttProbes if self.ttProbes else 0.0
+
+    def __str__(self):
+        return 'depth %d seldepth %d score %s nodes %d qnodes %d nps %d cutoffs %.1f%% first %.1f%% ' \
+            'null cutoffs %d re-searches lmr %d pvs %d aspiration %d tt probes %d hits %.1f%% bitbase hits %d ' \
+            'time %.2fs' % (
+                self.depth, self.seldepth, self.score, self.nodes, self.qnodes, self.nps(),
+                100*self.betaCutoffRate(), 100*self.firstMoveCutoffRate(), self.nullMoveCutoffs,
+                self.lmrReSearches, self.pvsReSearches, self.aspirationReSearches, self.ttProbes,
+                100*self.ttHitRate(), self.bitbaseHits, self.time)
+
+
+class Search():
+    '''
+    One search with everything it changes while running: limits, node count, killer and history
+    tables, move buffers, statistics and the result. Two Search objects never share state unless
+    they are given the same transposition table, without one a search makes its own, so searches
+    can run side by side in threads or be driven from another program. A parallel search (more
+    than one worker) needs a SharedTranspositionTable, its pool workers read and write it too
+    '''
+
+    def __init__(self, timeLimit=TIME_LIMIT, nodeLimit=NODE_LIMIT, maxDepth=MAX_DEPTH, workers=SEARCH_WORKERS,
+                 table=None, moveOrdering=None, selective=None, book=None, bitbases=None, stopEvent=None,
+                 statsCallback=None):
+        self.timeLimit = timeLimit
+        self.nodeLimit = nodeLimit
+        self.maxDepth = maxDepth
+        self.workers = workers
+        if table is None:
+            table = SharedTranspositionTable(HASH_SIZE_MB) if workers > 1 else TranspositionTable(HASH_SIZE_MB)
+        elif workers > 1 and not isinstance(table, SharedTranspositionTable):
+            raise ValueError('a search with %d workers needs a SharedTranspositionTable' % workers)
+        self.table = table
+        self.book = book if book is not None else openingBook
+        self.bitbases = bitbases if bitbases is not None else endgameBitbases
+        self.moveOrdering = MOVE_ORDERING if moveOrdering is None else moveOrdering
+        self.selective = SELECTIVE_SEARCH if selective is None else selective
+        self.stopEvent = stopEvent  # anything with is_set() (multiprocessing.Event...), stops the search once set
+        self.statsCallback = statsCallback  # gets the SearchStats, they go to the logger without one
+        self.deadline = None
+        self.aborted = False
+        self.nextMove = None  # best root move (code) of the running iteration
+        self.resetStats()
+        # two quiet moves (codes) per ply that caused a beta cutoff, and cutoff counts per side, start and end sq
+        self.killerMoves = [[None, None] for i in range(MAX_DEPTH+1)]
+        self.historyTable = {}
+        # one reusable move list per ply, so nodes don't build a fresh list every time
+        self.moveBuffers = []
+        # principal variation from every ply of the current path, a node builds its own from its child's
+        self.pvTable = [() for i in range(max(maxDepth, MAX_DEPTH)+2)]
+        # result of the last run: best move code, its score and the depth of the last finished iteration
+        self.bestMove = None
+        self.score = 0
+        self.depth = 0
+        self.pv = ()  # expected line of play, move codes starting with bestMove
+        self.stats = SearchStats()  # of the last run
+
+    '''
+    Reset the counters and tables for a new search, the deadline starts now
+    '''
+
+    def start(self):
+        self.aborted = False
+        self.nextMove = None
+        self.deadline = time.time() + self.timeLimit if self.timeLimit else None
+        self.table.newSearch()
+        self.resetStats()
+        self.clearOrderingTables()
+
+    '''
+    Search gs (validMoves defaults to all legal moves) and return the best Move, None without moves
+    A position in the opening book is answered with a book move right away
+    '''
+
+    def run(self, gs, validMoves=None):
+        if self.book is not None:
+            bookMove = self.book.chooseMove(gs)
+            if bookMove is not None:
+                self.resetStats()
+                self.bestMove, self.score, self.depth, self.pv = bookMove.code, 0, 0, (bookMove.code,)
+                self.stats = self.makeStats(0)
+                self.stats.final = True
+                return bookMove
+        if validMoves is None:
+            validMoves = gs.getValidMoveCodes()
+        # the search works on move codes, validMoves may be Move objects from the UI
+        validMoves = [move if type(move) is int else move.code for move in validMoves]
+        random.shuffle(validMoves)  # variety between equally ordered moves
+        self.bestMove = None
+        self.score = 0
+        self.depth = 0
+        self.pv = ()
+        self.iterativeDeepening(gs, validMoves)
+        if self.bestMove is None and validMoves:  # limit hit before any root move finished
+            self.bestMove = validMoves[0]
+        return Move.fromCode(self.bestMove, gs.board) if self.bestMove is not None else None
+
+    '''
+    Search depth 1, 2, 3... until a limit is hit. With more than one worker the iterations from
+    PARALLEL_MIN_DEPTH on split the root moves across a process pool (see searchRootParallel),
+    the cheaper ones before are searched here and leave the ordering tables and the shared
+    transposition table filled for the workers
+    '''
+
+    def iterativeDeepening(self, gs, validMoves):
+        self.start()
+        startTime = time.time()
+        iterationStart = startTime
+        bestMove = None
+        score = 0
+        pool = None
+        try:
+            for depth in range(1, self.maxDepth+1):
+                self.nextMove = None
+                if self.moveOrdering:  # previous iteration's best move is searched first
+                    self.orderMoves(gs, validMoves, bestMove, 0)
+                elif bestMove is not None:
+                    validMoves.remove(bestMove)
+                    validMoves.insert(0, bestMove)
+                if self.workers > 1 and depth >= PARALLEL_MIN_DEPTH and len(validMoves) > 1:
+                    if pool is None:
+                        pool = self.startPool(gs)
+                    depthBestMove, depthScore, depthPv = self.searchRootParallel(pool, gs, validMoves, depth)
+                    if depthBestMove is None:  # not even the first move finished, keep the previous result
+                        break
+                    # the first move was searched to the end, so even a cut short iteration is usable
+                    bestMove, score = depthBestMove, depthScore
+                    self.pv = self.completePv(gs, depthPv, depth)
+                else:
+                    score = self.searchRoot(gs, validMoves, depth, score)
+                    if self.aborted:  # unfinished iteration, keep the previous result
+                        if bestMove is None:  # stopped during the first iteration, take its best move so far
+                            bestMove = self.nextMove
+                            self.bestMove = bestMove
+                        break
+                    if self.nextMove is not None:  # None when every move gets mated, keep the last one then
+                        bestMove = self.nextMove
+                        self.pv = self.completePv(gs, self.pvTable[0], depth)
+                self.bestMove, self.score, self.depth = bestMove, score, depth
+                now = time.time()
+                self.iterationTimes.append(now - iterationStart)
+                iterationStart = now
+                self.reportStats(gs, startTime)
+                if self.aborted or len(validMoves) <= 1 or abs(score) >= MATE_BOUND:
+                    break  # out of time, only move or forced mate, deeper won't change it
+        finally:
+            if pool is not None:
+                pool.terminate()
+        self.reportStats(gs, startTime, final=True)
+
+    '''
+    One iteration searched here: aspiration window around the previous score, widened on the side
+    the score fell out of and searched again. Returns the score, the best move is in nextMove
+    '''
+
+    def searchRoot(self, gs, validMoves, depth, score):
+        turnMultiplier = 1 if gs.whiteToMove else -1
+        delta = ASPIRATION_WINDOW
+        if depth >= ASPIRATION_MIN_DEPTH and abs(score) < MATE_BOUND:
+            alpha, beta = max(score - delta, -CHECKMATE), min(score + delta, CHECKMATE)
+        else:
+            alpha, beta = -CHECKMATE, CHECKMATE
+        while True:
+            # self.findMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove)
+            # self.findMoveNegaMax(gs, validMoves, DEPTH, 1 if gs.whiteToMove else -1)
+            score = self.findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier)
+            if self.aborted:
+                return score
+            if score <= alpha and alpha > -CHECKMATE:
+                alpha = max(score - delta, -CHECKMATE)
+            elif score >= beta and beta < CHECKMATE:
+                beta = min(score + delta, CHECKMATE)
+            else:
+                return score
+            delta *= 2
+            self.aspirationReSearches += 1
+
+    '''
+    Pool of the parallel iterations: the position is sent once to every worker, with the shared
+    table, the deadline, an even share of the nodes left and the killers and history so far
+    '''
+
+    def startPool(self, gs):
+        workerNodeLimit = max((self.nodeLimit - self.nodes) // self.workers, 1) if self.nodeLimit else 0
+        return multiprocessing.Pool(self.workers, initializer=initSearchWorker,
+                                    initargs=(gs, self.table, self.deadline, workerNodeLimit, self.stopEvent,
+                                              self.moveOrdering, self.selective,
+                                              self.bitbases.directory if self.bitbases is not None else None,
+                                              (self.killerMoves, self.historyTable)))
+
+    '''
+    One iteration split across the pool: the first (best ordered) move gets the full window, the
+    others are handed out with a null window at its score, they only have to prove they are worse,
+    which is cheap (late quiet moves start reduced, as in findMoveNegaMaxAlphaBeta). The few that
+    fail high are searched again one by one with the full window above the best score.
+    Returns (best move, score, principal variation), the move is None when even the first move
+    didn't finish. aborted is set when the iteration was cut short
+    '''
+
+    def searchRootParallel(self, pool, gs, validMoves, depth):
+        move, score, pv, stats, aborted = pool.apply(searchRootMove,
+                                                     ((validMoves[0], depth, -CHECKMATE, CHECKMATE, False),))
+        self.workerStats.add(stats)
+        if aborted:
+            self.aborted = True
+            return None, 0, ()
+        bestMove, bestScore, bestPv = move, score, pv
+        reduceLateMoves = self.selective and depth >= LMR_MIN_DEPTH and not gs.inCheck()
+        tasks = [(validMoves[i], depth, score, score + NULL_WINDOW,
+                  reduceLateMoves and i >= LMR_MIN_MOVES and isQuiet(gs, validMoves[i]))
+                 for i in range(1, len(validMoves))]
+        failedHigh = []
+        for move, score, pv, stats, moveAborted in pool.imap_unordered(searchRootMove, tasks):
+            self.workerStats.add(stats)
+            aborted = aborted or moveAborted
+            if not moveAborted and score > bestScore:  # only a lower bound, needs the full window
+                failedHigh.append((score, move))
+        failedHigh.sort(reverse=True)
+        for bound, move in failedHigh:
+            if aborted:
+                break
+            move, score, pv, stats, aborted = pool.apply(searchRootMove, ((move, depth, bestScore, CHECKMATE, False),))
+            self.workerStats.add(stats)
+            if aborted:
+                break
+            self.pvsReSearches += 1
+            if score > bestScore:
+                bestMove, bestScore, bestPv = move, score, pv
+        self.aborted = aborted
+        return bestMove, bestScore, bestPv
+
+    def resetStats(self):
+        self.nodes = 0
+        self.qnodes = 0
+        self.interiorNodes = 0
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.nullMoveCutoffs = 0
+        self.lmrReSearches = 0
+        self.pvsReSearches = 0
+        self.aspirationReSearches = 0
+        self.bitbaseHits = 0
+        self.seldepth = 0
+        self.iterationTimes = []
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.workerStats = SearchStats()  # counts the pool workers of a parallel search sent back
+
+    '''
+    SearchStats of the search so far, elapsed is the time it has been running
+    '''
+
+    def makeStats(self, elapsed):
+        stats = SearchStats()
+        stats.nodes = self.nodes
+        stats.qnodes = self.qnodes
+        stats.interiorNodes = self.interiorNodes
+        stats.betaCutoffs = self.betaCutoffs
+        stats.firstMoveCutoffs = self.firstMoveCutoffs
+        stats.nullMoveCutoffs = self.nullMoveCutoffs
+        stats.lmrReSearches = self.lmrReSearches
+        stats.pvsReSearches = self.pvsReSearches
+        stats.aspirationReSearches = self.aspirationReSearches
+        stats.bitbaseHits = self.bitbaseHits
+        stats.ttProbes = self.ttProbes
+        stats.ttHits = self.ttHits
+        stats.seldepth = self.seldepth
+        stats.add(self.workerStats)
+        stats.depth = self.depth
+        stats.time = elapsed
+        stats.iterationTimes = list(self.iterationTimes)
+        stats.bestMove = self.bestMove
+        stats.score = self.score
+        stats.pv = self.pv
+        return stats
+
+    def reportStats(self, gs, startTime, final=False):
+        self.stats = self.makeStats(time.time() - startTime)
+        self.stats.final = final
+        if self.statsCallback is not None:
+            self.statsCallback(self.stats)
+        elif logger.isEnabledFor(logging.INFO):
+            logger.info('%s%s pv %s', 'final ' if final else '', self.stats, ' '.join(pvNotation(gs, self.pv)))
+
+    '''
+    Nodes answered by the transposition table don't pass their line up, so a PV can stop early:
+    continue it with the hash moves after it, up to length moves
+    '''
+
+    def completePv(self, gs, pv, length):
+        pv = list(pv)
+        for move in pv:
+            gs.makeMove(move)
+        while len(pv) < length:
+            entry = self.table.probe(gs.zobristKey)
+            if entry is None or entry[4] is None or entry[4] not in gs.getValidMoveCodes():
+                break
+            pv.append(entry[4])
+            gs.makeMove(entry[4])
+        for move in pv:
+            gs.undoMove()
+        return tuple(pv)
+
+    '''
+    The reply this search expects after move (a Move or code): the next move of the principal
+    variation, or the hash move of the position after it when move isn't where the PV starts.
+    None if it isn't known or legal
+    '''
+
+    def predictReply(self, gs, move):
+        if type(move) is not int:
+            move = move.code
+        if len(self.pv) > 1 and self.pv[0] == move:
+            return self.pv[1]
+        gs.makeMove(move)
+        entry = self.table.probe(gs.zobristKey)
+        reply = None
+        if entry is not None and entry[4] in gs.getValidMoveCodes():
+            reply = entry[4]
+        gs.undoMove()
+        return reply
+
+    '''
+    Called every 256 nodes, flags the search to stop once the time or node budget is used up
+    or the stop event is set
+    '''
+
+    def checkSearchLimits(self):
+        if self.nodeLimit and self.nodes >= self.nodeLimit:
+            self.aborted = True
+        elif self.deadline is not None and time.time() >= self.deadline:
+            self.aborted = True
+        elif self.stopEvent is not None and self.stopEvent.is_set():
+            self.aborted = True
+
+    def findMoveMinMax(self, gs, validMoves, depth, whiteToMove):
+        if depth == 0:
+            # return scoreMaterial(gs.board)
+            return scoreBoard(gs)
+
+        if whiteToMove:
+            maxScore = -CHECKMATE
+            for move in validMoves:
+                gs.makeMove(move)
+                nextMoves = gs.getValidMoves()
+                score = self.findMoveMinMax(gs, nextMoves, depth-1, False)
+                if score > maxScore:
+                    maxScore = score
+                    if depth == DEPTH:
+                        self.nextMove = move
+                gs.undoMove()
+            return maxScore
+
+        else:
+            minScore = CHECKMATE
+            for move in validMoves:
+                gs.makeMove(move)
+                nextMoves = gs.getValidMoves()
+                score = self.findMoveMinMax(gs, nextMoves, depth-1, True)
+                if score < minScore:
+                    minScore = score
+                    if depth == DEPTH:
+                        self.nextMove = move
+                gs.undoMove()
+            return minScore
+
+    def findMoveNegaMax(self, gs, validMoves, depth, turnMultiplier):
+        self.nodes += 1
+        if depth == 0:
+            return turnMultiplier * scoreBoard(gs)
         maxScore = -CHECKMATE
         for move in validMoves:
             gs.makeMove(move)
             nextMoves = gs.getValidMoves()
-            score = findMoveMinMax(gs, nextMoves, depth-1, False)
+            score = -self.findMoveNegaMax(gs, nextMoves, depth-1, -turnMultiplier)
             if score > maxScore:
                 maxScore = score
                 if depth == DEPTH:
-                    nextMove = move
+                    self.nextMove = move
             gs.undoMove()
         return maxScore
 
-    else:
-        minScore = CHECKMATE
-        for move in validMoves:
+    '''
+    validMoves (move codes) can be None, moves are then only generated when the transposition table can't answer
+    ply is the distance from the root, allowNull is False right after a null move (no two passes in a row)
+    '''
+
+    def findMoveNegaMaxAlphaBeta(self, gs, validMoves, depth, alpha, beta, turnMultiplier, ply=0, allowNull=True):
+        pvTable = self.pvTable
+        pvTable[ply] = ()  # stays empty unless a move lands inside the window
+        self.nodes += 1
+        if self.nodes % 256 == 0:
+            self.checkSearchLimits()
+        if self.aborted:
+            return 0
+
+        # a small enough ending has an exact result in the bitbases. Inside the search it's taken where
+        # the ending starts (right after a capture or pawn move) and at the horizon, in between the
+        # search goes on so it can find the mate, which the tables don't know the distance of
+        if ply != 0 and self.bitbases is not None and gs.pieceCount <= self.bitbases.maxPieces and \
+                (depth <= 0 or gs.halfmoveClock == 0):
+            result = self.bitbases.probe(gs)
+            if result is not None and not (result == LOSS and gs.inCheck() and
+                                           len(gs.getValidMoveCodes(self.getMoveBuffer(ply))) == 0):
+                self.bitbaseHits += 1
+                if ply > self.seldepth:
+                    self.seldepth = ply
+                return bitbaseScore(gs, result, turnMultiplier)
+
+        if depth <= 0:
+            self.nodes -= 1  # the quiescence search counts this node itself
+            return self.quiescenceSearch(gs, alpha, beta, turnMultiplier, ply)
+
+        alphaOriginal = alpha
+        key = gs.zobristKey
+        entry = self.table.probe(key)
+        self.ttProbes += 1
+        if entry is not None:
+            self.ttHits += 1
+        if entry is not None and entry[1] >= depth and ply != 0:  # root still has to pick nextMove
+            entryBound, entryScore = entry[2], scoreFromTable(entry[3], ply)
+            if entryBound == EXACT:
+                return entryScore
+            elif entryBound == LOWERBOUND:
+                alpha = max(alpha, entryScore)
+            elif entryBound == UPPERBOUND:
+                beta = min(beta, entryScore)
+            if alpha >= beta:
+                return entryScore
+
+        inCheck = gs.inCheck()
+        # null move pruning: if the opponent moving twice in a row still can't get below beta,
+        # a real move won't either. Not in check (passing would be illegal) or with only pawns left (zugzwang)
+        if self.selective and allowNull and ply != 0 and not inCheck and depth >= NULL_MOVE_MIN_DEPTH and \
+                beta < MATE_BOUND and turnMultiplier * scorePosition(gs) >= beta and gs.hasNonPawnMaterial():
+            gs.makeNullMove()
+            score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth-1-NULL_MOVE_REDUCTION, -beta, -beta+NULL_WINDOW,
+                                                   -turnMultiplier, ply+1, False)
+            gs.undoNullMove()
+            if self.aborted:
+                return 0
+            if score >= beta:
+                self.nullMoveCutoffs += 1
+                return beta  # a mate found after passing isn't a proven mate
+
+        if validMoves is None:
+            validMoves = gs.getValidMoveCodes(self.getMoveBuffer(ply))
+            if len(validMoves) == 0:  # checkmate or stalemate
+                return mateScore(gs, ply)
+            if self.moveOrdering:
+                self.orderMoves(gs, validMoves, entry[4] if entry is not None else None, ply)
+        self.interiorNodes += 1
+        # principal variation search: after the first move the others only have to be proven no
+        # better than alpha with a null window, the full window is needed when one beats it.
+        # Late move reductions: quiet moves far down the ordered list rarely matter, their null
+        # window search starts shallower and is only repeated at full depth if they beat alpha
+        reduceLateMoves = self.selective and depth >= LMR_MIN_DEPTH and not inCheck
+        maxScore = -CHECKMATE
+        bestMove = None
+        for i in range(len(validMoves)):
+            move = validMoves[i]
+            reduced = reduceLateMoves and i >= LMR_MIN_MOVES and isQuiet(gs, move)
             gs.makeMove(move)
-            nextMoves = gs.getValidMoves()
-            score = findMoveMinMax(gs, nextMoves, depth-1, True)
-            if score < minScore:
-                minScore = score
-                if depth == DEPTH:
-                    nextMove = move
+            if i == 0:
+                score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth-1, -beta, -alpha, -turnMultiplier, ply+1)
+            else:
+                if reduced and not gs.inCheck():  # checking moves are searched to full depth
+                    score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth-1-LMR_REDUCTION, -alpha-NULL_WINDOW,
+                                                           -alpha, -turnMultiplier, ply+1)
+                    if score > alpha and not self.aborted:
+                        self.lmrReSearches += 1
+                        score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth-1, -alpha-NULL_WINDOW, -alpha,
+                                                               -turnMultiplier, ply+1)
+                else:
+                    score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth-1, -alpha-NULL_WINDOW, -alpha,
+                                                           -turnMultiplier, ply+1)
+                if alpha < score < beta and not self.aborted:  # can only happen in a window wider than null
+                    self.pvsReSearches += 1
+                    score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth-1, -beta, -alpha, -turnMultiplier, ply+1)
             gs.undoMove()
-        return minScore
+            if self.aborted:  # score is meaningless, unwind without storing anything
+                return 0
+            if score > maxScore:
+                maxScore = score
+                bestMove = move
+                if score > alpha:
+                    pvTable[ply] = (move,) + pvTable[ply+1]
+                if ply == 0:
+                    self.nextMove = move
+                    if logger.isEnabledFor(logging.DEBUG):  # no Move object unless it gets logged
+                        logger.debug('%s %s', Move.fromCode(move, gs.board), score)
+            if maxScore > alpha:  # pruning happens
+                alpha = maxScore
+            if alpha >= beta:
+                self.betaCutoffs += 1
+                if i == 0:
+                    self.firstMoveCutoffs += 1
+                if isQuiet(gs, move):  # quiet move refuted the opponent, remember it
+                    self.storeKiller(ply, move)
+                    historyKey = historyIndex(gs, move)
+                    self.historyTable[historyKey] = self.historyTable.get(historyKey, 0) + depth*depth
+                break
 
+        if maxScore <= alphaOriginal:
+            boundType = UPPERBOUND
+        elif maxScore >= beta:
+            boundType = LOWERBOUND
+        else:
+            boundType = EXACT
+        self.table.store(key, depth, boundType, scoreToTable(maxScore, ply), bestMove)
+        return maxScore
 
-def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
-    global nextMove, counter
-    counter += 1
-    if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
-    maxScore = -CHECKMATE
-    for move in validMoves:
-        gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        score = -findMoveNegaMax(gs, nextMoves, depth-1, -turnMultiplier)
-        if score > maxScore:
-            maxScore = score
-            if depth == DEPTH:
-                nextMove = move
-        gs.undoMove()
-    return maxScore
+    '''
+    Quiescence search: at the horizon keep playing captures until the position is quiet, so a
+    capture sequence is never cut off halfway. The side to move may stand pat on the static score
+    '''
+
+    def quiescenceSearch(self, gs, alpha, beta, turnMultiplier, ply):
+        self.nodes += 1
+        self.qnodes += 1
+        if ply > self.seldepth:
+            self.seldepth = ply
+        if self.nodes % 256 == 0:
+            self.checkSearchLimits()
+        if self.aborted:
+            return 0
+
+        if gs.inCheck():  # no standing pat in check, every evasion has to be looked at
+            moves = gs.getValidMoveCodes(self.getMoveBuffer(ply))
+            if len(moves) == 0:
+                return mateScore(gs, ply)
+            standPat = None
+            maxScore = -CHECKMATE
+        else:
+            standPat = turnMultiplier * scorePosition(gs)
+            if standPat >= beta:
+                return standPat
+            bestGain = pieceScore['Q']
+            if pawnOnSeventh(gs):  # a capture can promote on top of it
+                bestGain += pieceScore['Q'] - pieceScore['p']
+            if standPat + bestGain + DELTA_MARGIN < alpha:
+                return standPat  # even the best capture can't reach alpha
+            alpha = max(alpha, standPat)
+            maxScore = standPat
+            moves = gs.getValidCaptureCodes(self.getMoveBuffer(ply))
+
+        if self.moveOrdering:
+            self.orderMoves(gs, moves, None, None)
+        board = gs.board
+        for move in moves:
+            if standPat is not None:  # delta pruning: skip captures that can't bring the score near alpha
+                endSq = (move >> 6) & 63
+                victim = board[endSq >> 3][endSq & 7]
+                kind = move & MOVE_KIND_MASK
+                gain = pieceScore[victim[1]] if victim != '--' else 0
+                if kind == MOVE_ENPASSANT:
+                    gain = pieceScore['p']
+                elif kind == MOVE_PROMOTION:
+                    gain += pieceScore[PROMOTION_PIECES[(move >> 12) & 3]] - pieceScore['p']
+                if standPat + gain + DELTA_MARGIN <= alpha:
+                    continue
+            gs.makeMove(move)
+            score = -self.quiescenceSearch(gs, -beta, -alpha, -turnMultiplier, ply+1)
+            gs.undoMove()
+            if self.aborted:
+                return 0
+            if score > maxScore:
+                maxScore = score
+            if maxScore > alpha:
+                alpha = maxScore
+            if alpha >= beta:
+                break
+        return maxScore
+
+    '''
+    Sort moves best first: hash move, captures by most valuable victim / least valuable attacker
+    (promotions with them), the two killers of this ply, then quiet moves by history
+    '''
 
+    def orderMoves(self, gs, moves, hashMove, ply):
+        killers = self.killerMoves[ply] if ply is not None and ply < len(self.killerMoves) else (None, None)
+        historyTable = self.historyTable
+        board = gs.board
+        side = 1 << 12 if gs.whiteToMove else 0
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove, counter
-    counter += 1
+        def orderingScore(move):
+            if move == hashMove:
+                return HASH_MOVE_SCORE
+            endSq = (move >> 6) & 63
+            victim = board[endSq >> 3][endSq & 7]
+            kind = move & MOVE_KIND_MASK
+            if victim != '--' or kind == MOVE_ENPASSANT or kind == MOVE_PROMOTION:
+                startSq = move & 63
+                score = CAPTURE_SCORE - orderingValue[board[startSq >> 3][startSq & 7][1]]
+                if victim != '--':
+                    score += 100*orderingValue[victim[1]]
+                elif kind == MOVE_ENPASSANT:
+                    score += 100*orderingValue['p']
+                if kind == MOVE_PROMOTION:
+                    score += 100*orderingValue[PROMOTION_PIECES[(move >> 12) & 3]]
+                return score
+            if move == killers[0]:
+                return KILLER_SCORES[0]
+            if move == killers[1]:
+                return KILLER_SCORES[1]
+            return min(historyTable.get((move & 0xFFF) | side, 0), HISTORY_LIMIT)
 
-    if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
+        moves.sort(key=orderingScore, reverse=True)
 
-    # move ordering - implement later
-    maxScore = -CHECKMATE
-    for move in validMoves:
+    def storeKiller(self, ply, move):
+        killers = self.killerMoves
+        if ply < len(killers) and killers[ply][0] != move:
+            killers[ply][1] = killers[ply][0]
+            killers[ply][0] = move
+
+    def clearOrderingTables(self):
+        self.killerMoves = [[None, None] for i in range(MAX_DEPTH+1)]
+        self.historyTable = {}
+
+    def getMoveBuffer(self, ply):
+        while len(self.moveBuffers) <= ply:
+            self.moveBuffers.append([])
+        return self.moveBuffers[ply]
+
+
+def initSearchWorker(gs, table, deadline, nodeLimit, stopEvent, moveOrdering=None, selective=None, bitbaseDir=None,
+                     orderingTables=None):
+    global workerSearch, workerGameState
+    workerGameState = gs
+    # not started: the master started the table's search, and the deadline is the master's
+    workerSearch = Search(0, nodeLimit, table=table, moveOrdering=moveOrdering, selective=selective,
+                          bitbases=Bitbases(bitbaseDir) if bitbaseDir else None, stopEvent=stopEvent)
+    workerSearch.deadline = deadline
+    if orderingTables is not None:
+        workerSearch.killerMoves, workerSearch.historyTable = orderingTables
+
+
+'''
+Runs in a pool worker: score of one root move searched to depth within (alpha, beta), a reduced
+move is searched LMR_REDUCTION shallower first and only to depth if it beats alpha
+returns (move, score, principal variation starting with move, SearchStats of this move, aborted)
+'''
+
+
+def searchRootMove(task):
+    move, depth, alpha, beta, reduced = task
+    search = workerSearch
+    gs = workerGameState
+    statsBefore = search.makeStats(0)
+    turnMultiplier = 1 if gs.whiteToMove else -1
+    gs.makeMove(move)
+    if reduced and not gs.inCheck():  # checking moves are searched to full depth
+        score = -search.findMoveNegaMaxAlphaBeta(gs, None, depth-1-LMR_REDUCTION, -beta, -alpha, -turnMultiplier, 1)
+        if score > alpha and not search.aborted:
+            search.lmrReSearches += 1
+            score = -search.findMoveNegaMaxAlphaBeta(gs, None, depth-1, -beta, -alpha, -turnMultiplier, 1)
+    else:
+        score = -search.findMoveNegaMaxAlphaBeta(gs, None, depth-1, -beta, -alpha, -turnMultiplier, 1)
+    gs.undoMove()
+    stats = search.makeStats(0)
+    stats.add(statsBefore, -1)
+    return move, score, (move,) + search.pvTable[1], stats, search.aborted
+
+
+'''
+The moves of a principal variation (codes) as notation, played out on gs and taken back
+coordinates gives them the way UCI writes them (e2e4, a7a8q)
+'''
+
+
+def pvNotation(gs, pv, coordinates=False):
+    notation = []
+    for move in pv:
+        move = Move.fromCode(move, gs.board)
+        notation.append(move.getChessNotation() if coordinates else str(move))
         gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        score = - \
-            findMoveNegaMaxAlphaBeta(
-                gs, nextMoves, depth-1, -beta, -alpha, -turnMultiplier)
-        if score > maxScore:
-            maxScore = score
-            if depth == DEPTH:
-                nextMove = move
-                print(move, score)
+    for move in pv:
         gs.undoMove()
-        if maxScore > alpha:  # pruning happens
-            alpha = maxScore
-        if alpha >= beta:
-            break
-    return maxScore
+    return notation
+
+
+'''
+Quiet moves are the ones that don't capture or promote, only they go into killers and history
+'''
+
+
+def isQuiet(gs, move):
+    endSq = (move >> 6) & 63
+    kind = move & MOVE_KIND_MASK
+    return gs.board[endSq >> 3][endSq & 7] == '--' and kind != MOVE_ENPASSANT and kind != MOVE_PROMOTION
+
+
+'''
+Whether the side to move has a pawn one step from promoting
+'''
+
+
+def pawnOnSeventh(gs):
+    if gs.whiteToMove:
+        return 'wp' in gs.board[1]
+    return 'bp' in gs.board[6]
+
+
+# history is kept per side to move, start and end sq
+def historyIndex(gs, move):
+    return (move & 0xFFF) | (1 << 12 if gs.whiteToMove else 0)
 
 
 '''
@@ -231,27 +950,84 @@ def scoreBoard(gs):
             return CHECKMATE  # white wins
     elif gs.stalemate:
         return STALEMATE
+    return scorePosition(gs)
 
-    score = 0
-    for row in range(len(gs.board)):
-        for col in range(len(gs.board[row])):
-            square = gs.board[row][col]
-            if square != '--':
-                # score it positionally
-                piecePositionScore = 0
-                if square[1] != 'K':
-                    if square[1]=='p':  #for pawns
-                        piecePositionScore = piecePositionScores[square][row][col]
-                    else:   #for other pieces
-                        piecePositionScore = piecePositionScores[square[1]][row][col]
-
-                if square[0] == 'w':
-                    score += pieceScore[square[1]]+piecePositionScore*.2
-                elif square[0] == 'b':
-                    score -= pieceScore[square[1]]+piecePositionScore*.2
+
+'''
+Score for the side to move of a position without legal moves ply plies from the root: mated the
+sooner the worse, so the search prefers the shortest mate and the mate count follows from the score
+'''
+
+
+def mateScore(gs, ply):
+    return ply - CHECKMATE if gs.checkmate else STALEMATE
+
+
+'''
+Mate scores in the transposition table count from the stored position, not from the root, so
+an entry is right wherever the position turns up again
+'''
+
+
+def scoreToTable(score, ply):
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
     return score
 
 
+def scoreFromTable(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+'''
+Plies to the mate of a mate score from the root (negative when the side to move gets mated),
+None for any other score
+'''
+
+
+def matePlies(score):
+    if score >= MATE_BOUND:
+        return CHECKMATE - score
+    if score <= -MATE_BOUND:
+        return -(CHECKMATE + score)
+    return None
+
+
+'''
+Score for the side to move of a position the bitbases call a WIN, DRAW or LOSS. The tables don't
+say how far the mate is, so a win also counts material and how close the losing king is to the
+edge and to the winning king, the search then makes progress towards the mate
+'''
+
+
+def bitbaseScore(gs, result, turnMultiplier):
+    if result != WIN and result != LOSS:
+        return STALEMATE
+    winnerKing, loserKing = gs.whiteKingLocation, gs.blackKingLocation
+    if (result == WIN) != gs.whiteToMove:
+        winnerKing, loserKing = loserKing, winnerKing
+    edge = max(3 - loserKing[0], loserKing[0] - 4) + max(3 - loserKing[1], loserKing[1] - 4)
+    distance = abs(winnerKing[0] - loserKing[0]) + abs(winnerKing[1] - loserKing[1])
+    progress = BITBASE_WIN + (edge + 14 - distance) / 10
+    return (progress if result == WIN else -progress) + turnMultiplier * scorePosition(gs)
+
+
+'''
+Material and piece square score, without looking for checkmate or stalemate
+GameState keeps it up to date in makeMove/undoMove, so this is O(1)
+'''
+
+
+def scorePosition(gs):
+    return gs.boardScore
+
+
 '''
 Score the board based on material
 '''
@@ -0,0 +1,145 @@
+"""
+Fixed size transposition table for the search, indexed by GameState.zobristKey
+"""
+
+import ctypes
+import struct
+from multiprocessing import RawArray
+
+# bound types of a stored score
+EXACT = 0
+LOWERBOUND = 1  # search failed high, real score >= stored score
+UPPERBOUND = 2  # search failed low, real score <= stored score
+
+# memory of one filled slot on 64 bit CPython: the entry tuple plus its key, score and move ints
+# plus the list pointer, used to turn a size in MB into a number of slots
+ENTRY_BYTES = 184
+# a slot of the shared table: check word, data word, score bits
+SHARED_SLOT = struct.Struct('<QQQ')
+SCORE_BITS = struct.Struct('<Q')
+SCORE = struct.Struct('<d')
+
+
+class TranspositionTable():
+    '''
+    Every bucket has two slots: the first keeps the deepest result (or anything from an older
+    search), the second is always replaced, so shallow entries can't push out expensive ones
+    '''
+
+    def __init__(self, sizeMB=16):
+        self.resize(sizeMB)
+
+    def resize(self, sizeMB):
+        buckets = 1
+        while buckets*2 * 2*ENTRY_BYTES <= sizeMB*1024*1024:
+            buckets *= 2
+        self.sizeMB = sizeMB
+        self.mask = buckets-1
+        self.clear()
+
+    def clear(self):
+        self.table = [None] * (2*(self.mask+1))
+        self.age = 0
+
+    '''
+    Called once per search: older entries become preferred victims for replacement. Probe and hit
+    counts are kept by the searches, several can share one table
+    '''
+
+    def newSearch(self):
+        self.age += 1
+
+    '''
+    Returns (key, depth, boundType, score, move, age) for the position or None, move is a move code
+    '''
+
+    def probe(self, key):
+        i = (key & self.mask) << 1
+        entry = self.table[i]
+        if entry is None or entry[0] != key:
+            entry = self.table[i+1]
+            if entry is None or entry[0] != key:
+                return None
+        return entry
+
+    def store(self, key, depth, boundType, score, move):
+        i = (key & self.mask) << 1
+        entry = (key, depth, boundType, score, move, self.age)
+        deepest = self.table[i]
+        if deepest is None or deepest[0] == key or depth >= deepest[1] or deepest[5] != self.age:
+            self.table[i] = entry
+        else:
+            self.table[i+1] = entry
+
+    '''
+    Per mille of slots filled by the current search, from a sample of the first 1000 (UCI hashfull)
+    '''
+
+    def hashFull(self):
+        sample = self.table[:1000]
+        return 1000 * sum(1 for entry in sample if entry is not None and entry[5] == self.age) // len(sample)
+
+
+class SharedTranspositionTable(TranspositionTable):
+    '''
+    The same table in shared memory, for the processes of a parallel search. It is handed to a pool
+    through the initializer arguments and every worker then reads and writes the one copy.
+    A slot is three words: the key xor the other two, a data word (filled flag, bound, depth, age
+    and move) and the score as a double. A slot two processes wrote at the same time fails the key
+    check and counts as empty
+    '''
+
+    def resize(self, sizeMB):
+        buckets = 1
+        while buckets*2 * 2*SHARED_SLOT.size <= sizeMB*1024*1024:
+            buckets *= 2
+        self.sizeMB = sizeMB
+        self.mask = buckets-1
+        self.slots = RawArray(ctypes.c_ubyte, 2*buckets*SHARED_SLOT.size)  # zeroed, every slot empty
+        self.age = 0
+
+    def clear(self):
+        ctypes.memset(self.slots, 0, ctypes.sizeof(self.slots))
+        self.age = 0
+
+    def __getstate__(self):
+        return self.sizeMB, self.mask, self.slots, self.age
+
+    def __setstate__(self, state):
+        self.sizeMB, self.mask, self.slots, self.age = state
+
+    '''
+    The entry of slot i as probe returns it, None when it is empty or doesn't hold key (any key if None)
+    '''
+
+    def readSlot(self, i, key=None):
+        check, data, scoreBits = SHARED_SLOT.unpack_from(self.slots, i*SHARED_SLOT.size)
+        if not data & 1 or (key is not None and check ^ data ^ scoreBits != key):
+            return None
+        move = (data >> 19) & 0x1FFFF
+        score = SCORE.unpack(SCORE_BITS.pack(scoreBits))[0]
+        return check ^ data ^ scoreBits, (data >> 3) & 0xFF, (data >> 1) & 3, score, move-1 if move else None, \
+            (data >> 11) & 0xFF
+
+    def probe(self, key):
+        i = (key & self.mask) << 1
+        entry = self.readSlot(i, key)
+        if entry is None:
+            entry = self.readSlot(i+1, key)
+        return entry
+
+    def store(self, key, depth, boundType, score, move):
+        i = (key & self.mask) << 1
+        age = self.age & 0xFF
+        check, data, scoreBits = SHARED_SLOT.unpack_from(self.slots, i*SHARED_SLOT.size)
+        # the first slot keeps the deepest entry, as in TranspositionTable.store
+        if data & 1 and check ^ data ^ scoreBits != key and depth < (data >> 3) & 0xFF and (data >> 11) & 0xFF == age:
+            i += 1
+        data = 1 | boundType << 1 | min(max(depth, 0), 0xFF) << 3 | age << 11 | \
+            (move+1 if move is not None else 0) << 19
+        scoreBits = SCORE_BITS.unpack(SCORE.pack(score))[0]
+        SHARED_SLOT.pack_into(self.slots, i*SHARED_SLOT.size, key ^ data ^ scoreBits, data, scoreBits)
+
+    def hashFull(self):
+        sample = [self.readSlot(i) for i in range(min(1000, 2*(self.mask+1)))]
+        return 1000 * sum(1 for entry in sample if entry is not None and entry[5] == self.age & 0xFF) // len(sample)
@@ -0,0 +1,289 @@
+"""
+Headless UCI engine for GUIs and tournament managers (cutechess-cli, fastchess, Arena...),
+no pygame or display needed. Run from this directory:
+python -m UCI
+Supports uci, isready, setoption (Hash, Threads, Ponder, BookFile, BitbasePath), ucinewgame,
+position startpos|fen ... moves ..., go (depth, movetime, wtime/btime/winc/binc/movestogo, nodes,
+infinite, ponder), ponderhit, stop and quit
+"""
+
+import multiprocessing
+import sys
+import threading
+import ChessEngine, SmartMoveFinder
+
+ENGINE_NAME = 'ChessEngine'
+ENGINE_AUTHOR = 'adee-dev'
+MAX_HASH_MB = 1024
+MAX_THREADS = 64
+MOVES_TO_GO = 30  # moves the remaining clock is shared over when the GUI doesn't say
+MOVE_OVERHEAD = 0.05  # seconds kept back per move for the GUI and process latency
+
+
+'''
+The legal move written as coordinates (e2e4, e7e8q) in gs, None if there isn't one
+'''
+
+
+def findMove(gs, notation):
+    for move in gs.getValidMoves():
+        if move.getChessNotation() == notation:
+            return move
+    return None
+
+
+'''
+Seconds to spend on this move from the clock fields of a go command (milliseconds)
+'''
+
+
+def timeForMove(timeLeft, increment, movesToGo):
+    budget = timeLeft / (movesToGo or MOVES_TO_GO) + increment * 0.8
+    budget = min(budget, timeLeft * 0.5)  # never bet the game on one move
+    return max((budget / 1000) - MOVE_OVERHEAD, 0.01)
+
+
+class UCIEngine():
+    '''
+    One engine session: the current position, the options and the search running in a thread,
+    so stop and isready are answered while it thinks. Every output line goes through send.
+    An infinite or ponder search holds its bestmove until released: by stop, or for a ponder
+    search by ponderhit, which also starts the time the go command's clock gave this move
+    '''
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.gs = ChessEngine.GameState()
+        self.workers = 1
+        self.searchThread = None
+        self.search = None  # the running or last search
+        self.released = threading.Event()  # the search thread may send bestmove
+        self.pondering = False
+        self.ponderTimeLimit = 0  # seconds the search gets from the ponder hit on, 0 for no limit
+        self.ponderInfinite = False  # go ponder infinite: still only stop ends it after the hit
+        self.ponderTimer = None  # stops the search once the time after the ponder hit is used up
+        # a process Event, the pool workers of a parallel search have to see it too
+        self.stopEvent = multiprocessing.Event()
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    '''
+    Handle one line from the GUI, returns False after quit
+    '''
+
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send('id name ' + ENGINE_NAME)
+            self.send('id author ' + ENGINE_AUTHOR)
+            self.send('option name Hash type spin default %d min 1 max %d' % (SmartMoveFinder.HASH_SIZE_MB, MAX_HASH_MB))
+            self.send('option name Threads type spin default 1 min 1 max %d' % MAX_THREADS)
+            self.send('option name Ponder type check default false')
+            self.send('option name BookFile type string default <empty>')
+            self.send('option name BitbasePath type string default <empty>')
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'setoption':
+            self.setOption(args)
+        elif command == 'ucinewgame':
+            self.stopSearch()
+            SmartMoveFinder.clearHash()
+            self.gs = ChessEngine.GameState()
+        elif command == 'position':
+            self.stopSearch()
+            self.setPosition(args)
+        elif command == 'go':
+            self.stopSearch()
+            self.go(args)
+        elif command == 'ponderhit':
+            self.ponderHit()
+        elif command == 'stop':
+            self.stopSearch()
+        elif command == 'quit':
+            self.stopSearch()
+            return False
+        return True
+
+    '''
+    setoption name <name> value <value>, names are case insensitive
+    '''
+
+    def setOption(self, args):
+        if 'name' not in args:
+            return
+        valueAt = args.index('value') if 'value' in args else len(args)
+        name = ' '.join(args[args.index('name')+1:valueAt]).lower()
+        value = ' '.join(args[valueAt+1:])
+        try:
+            if name == 'hash':
+                self.stopSearch()
+                SmartMoveFinder.setHashSize(min(max(int(value), 1), MAX_HASH_MB))
+            elif name == 'threads':
+                self.workers = min(max(int(value), 1), MAX_THREADS)
+            elif name == 'ponder':
+                pass  # the GUI asks for pondering with go ponder, nothing to set up
+            elif name == 'bookfile':
+                self.stopSearch()
+                SmartMoveFinder.setBook(value if value and value != '<empty>' else None)
+            elif name == 'bitbasepath':
+                self.stopSearch()
+                SmartMoveFinder.setBitbases(value if value and value != '<empty>' else None)
+            else:
+                self.send('info string unknown option ' + name)
+        except ValueError:
+            self.send('info string bad value %s for option %s' % (value, name))
+        except OSError as e:
+            self.send('info string cannot open %s: %s' % (value, e.strerror))
+
+    '''
+    position startpos|fen <fen> [moves <move> ...]
+    '''
+
+    def setPosition(self, args):
+        if not args:
+            return
+        movesAt = args.index('moves') if 'moves' in args else len(args)
+        if args[0] == 'startpos':
+            fen = ChessEngine.START_FEN
+        elif args[0] == 'fen':
+            fen = ' '.join(args[1:movesAt])
+        else:
+            return
+        try:
+            gs = ChessEngine.GameState.fromFen(fen)
+        except ValueError:
+            self.send('info string bad fen ' + fen)
+            return
+        for notation in args[movesAt+1:]:
+            move = findMove(gs, notation)
+            if move is None:
+                self.send('info string illegal move ' + notation)
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    def go(self, args):
+        options = {}
+        i = 0
+        while i < len(args):
+            if args[i] in ('infinite', 'ponder'):
+                options[args[i]] = True
+                i += 1
+            elif i+1 < len(args):
+                try:
+                    options[args[i]] = int(args[i+1])
+                except ValueError:
+                    pass
+                i += 2
+            else:
+                i += 1
+        timeLimit = 0
+        if 'movetime' in options:
+            timeLimit = max(options['movetime'] / 1000 - MOVE_OVERHEAD, 0.01)
+        elif not options.get('infinite'):
+            clock, increment = ('wtime', 'winc') if self.gs.whiteToMove else ('btime', 'binc')
+            if clock in options:
+                timeLimit = timeForMove(options[clock], options.get(increment, 0), options.get('movestogo'))
+        # a ponder search runs on the opponent's time, the limit only applies from the ponder hit on
+        self.pondering = options.get('ponder', False)
+        self.ponderTimeLimit = timeLimit
+        self.ponderInfinite = options.get('infinite', False)
+        search = SmartMoveFinder.Search(0 if self.pondering else timeLimit, options.get('nodes', 0),
+                                        min(options.get('depth', SmartMoveFinder.MAX_DEPTH), SmartMoveFinder.MAX_DEPTH),
+                                        self.workers, table=SmartMoveFinder.sessionTable(self.workers),
+                                        stopEvent=self.stopEvent, statsCallback=self.sendInfo)
+        self.search = search
+        self.stopEvent.clear()
+        if self.pondering or options.get('infinite'):
+            self.released.clear()
+        else:
+            self.released.set()
+        self.searchThread = threading.Thread(target=self.runSearch, args=(search,), daemon=True)
+        self.searchThread.start()
+
+    '''
+    Runs in the search thread and answers with bestmove. An infinite or ponder search that ends on
+    its own (mate found, depth limit) only answers once it is released
+    '''
+
+    def runSearch(self, search):
+        gs = self.gs
+        bestMove = search.run(gs)
+        self.released.wait()
+        if bestMove is None:
+            self.send('bestmove 0000')
+            return
+        reply = search.predictReply(gs, bestMove)
+        if reply is not None:
+            pv = SmartMoveFinder.pvNotation(gs, (bestMove.code, reply), coordinates=True)
+            self.send('bestmove %s ponder %s' % tuple(pv))
+        else:
+            self.send('bestmove ' + bestMove.getChessNotation())
+
+    '''
+    The opponent played the move pondered on: the search goes on as a normal one, stopped by the
+    time the go ponder command's clock gave it from now on
+    '''
+
+    def ponderHit(self):
+        if self.searchThread is None or not self.pondering:
+            return
+        self.pondering = False
+        if self.ponderInfinite:
+            return
+        if self.ponderTimeLimit:
+            self.ponderTimer = threading.Timer(self.ponderTimeLimit, self.stopEvent.set)
+            self.ponderTimer.daemon = True
+            self.ponderTimer.start()
+        self.released.set()
+
+    def stopSearch(self):
+        if self.ponderTimer is not None:  # must not stop a later search
+            self.ponderTimer.cancel()
+            self.ponderTimer = None
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.released.set()
+            self.searchThread.join()
+            self.searchThread = None
+        self.pondering = False
+
+    '''
+    statsCallback of the search: one info line per finished iteration
+    '''
+
+    def sendInfo(self, stats):
+        if stats.final:
+            return
+        plies = SmartMoveFinder.matePlies(stats.score)
+        if plies is not None:  # in moves, the side to move mates on an odd ply
+            score = 'mate %d' % ((plies + 1) // 2 if plies > 0 else plies // 2)
+        else:
+            score = 'cp %d' % round(100 * stats.score)
+        self.send('info depth %d seldepth %d score %s nodes %d nps %d time %d hashfull %d tbhits %d pv %s' % (
+            stats.depth, stats.seldepth, score, stats.nodes, stats.nps(), 1000 * stats.time,
+            self.search.table.hashFull(), stats.bitbaseHits,
+            ' '.join(SmartMoveFinder.pvNotation(self.gs, stats.pv, coordinates=True))))
+
+
+def main():
+    # the pool of a parallel search is started from the search thread while this one waits in a stdin
+    # read, a forked worker would inherit the stdin lock held and hang, so workers start fresh
+    multiprocessing.set_start_method('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                                     else 'spawn')
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+
+
+if __name__ == '__main__':
+    main()
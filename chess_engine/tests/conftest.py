@@ -0,0 +1,9 @@
+import os
+import sys
+
+# the engine modules import each other by name, as when run from the Chess directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Chess'))
+
+
+def pytest_addoption(parser):
+    parser.addoption('--slow', action='store_true', help='also run the tests that take minutes, like generating bitbases')
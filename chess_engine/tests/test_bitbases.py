@@ -0,0 +1,98 @@
+"""
+Endgame bitbases: the position indexing, probes of a table written by the tests and, with the
+generated KQvK and KPvK tables, a few known results. Generating them takes minutes, so those
+tests use the tables in Chess/bitbases when they are there and otherwise only run with --slow
+"""
+
+import os
+import pytest
+import ChessEngine, Bitbases
+from Bitbases import WIN, DRAW, LOSS
+
+# results for the side to move
+BITBASE_RESULTS = [
+    ('4k3/8/4K3/4P3/8/8/8/8 w - - 0 1', WIN),  # king in front of the pawn on the 6th rank
+    ('4k3/8/4K3/4P3/8/8/8/8 b - - 0 1', LOSS),
+    ('4k3/8/4P3/4K3/8/8/8/8 w - - 0 1', DRAW),
+    ('k7/8/8/P7/8/8/8/K7 w - - 0 1', DRAW),  # rook pawn, the defending king is in the corner
+    ('4k3/4P3/4K3/8/8/8/8/8 b - - 0 1', DRAW),  # stalemate
+    ('4K3/8/4k3/4p3/8/8/8/8 b - - 0 1', WIN),
+    ('8/8/8/8/4k3/8/4p3/4K3 w - - 0 1', DRAW),  # the pawn is lost
+    ('7k/8/8/8/8/8/8/KQ6 w - - 0 1', WIN),
+    ('7k/8/8/8/8/8/8/KQ6 b - - 0 1', LOSS),
+    ('k7/1Q6/1K6/8/8/8/8/8 b - - 0 1', LOSS),  # mate
+    ('k7/2Q5/1K6/8/8/8/8/8 b - - 0 1', DRAW),  # stalemate
+    ('8/8/8/8/8/8/6kQ/K7 b - - 0 1', DRAW),  # the queen hangs
+    ('k7/8/8/8/8/8/8/K6q w - - 0 1', LOSS),
+]
+
+
+@pytest.mark.parametrize('white, black, name', [
+    ('KQ', 'K', ('KQvK', False)),
+    ('K', 'KQ', ('KQvK', True)),
+    ('KP', 'KR', ('KRvKP', True)),
+    ('KPR', 'K', ('KRPvK', False)),
+])
+def testEndingName(white, black, name):
+    assert Bitbases.endingName(white, black) == name
+
+
+@pytest.mark.parametrize('name', ['KvK', 'KQQQQvK', 'KPvKP', 'QKvK', 'KvKQ'])
+def testBadEnding(name):
+    with pytest.raises(ValueError):
+        Bitbases.Ending(name)
+
+
+def testSubEndings():
+    assert sorted(Bitbases.Ending('KPvK').subEndings()) == ['KBvK', 'KNvK', 'KQvK', 'KRvK']
+
+
+@pytest.mark.parametrize('squares, whiteToMove', [([0, 63, 27], True), ([3, 5, 62], False), ([33, 40, 9, 17], True)])
+def testPositionIndex(squares, whiteToMove):
+    assert Bitbases.positionSquares(Bitbases.positionIndex(squares, whiteToMove), len(squares)) == \
+        (squares, whiteToMove)
+
+
+# a KQvK table that is a draw everywhere except the position of squares
+def tableWithWin(squares, whiteToMove):
+    ending = Bitbases.Ending('KQvK')
+    data = bytearray(Bitbases.HEADER.pack(Bitbases.MAGIC, ending.size) + bytes((ending.size+3) // 4))
+    index = Bitbases.positionIndex(squares, whiteToMove)
+    data[Bitbases.HEADER.size + (index >> 2)] |= WIN << ((index & 3)*2)
+    return bytes(data)
+
+
+def testProbeWrittenTable():
+    tables = Bitbases.Bitbases()
+    tables.addTable('KQvK', tableWithWin([56, 7, 57], True))  # Ka1, Kh8, Qb1
+    assert tables.probe(ChessEngine.GameState.fromFen('7k/8/8/8/8/8/8/KQ6 w - - 0 1')) == WIN
+    assert tables.probe(ChessEngine.GameState.fromFen('7k/8/8/8/8/8/8/QK6 w - - 0 1')) == DRAW
+    # the same position with the colors swapped and the board flipped
+    assert tables.probe(ChessEngine.GameState.fromFen('kq6/8/8/8/8/8/8/7K b - - 0 1')) == WIN
+    # the white king on the h file is mirrored to the a file
+    assert tables.probe(ChessEngine.GameState.fromFen('k7/8/8/8/8/8/8/6QK w - - 0 1')) == WIN
+    assert tables.probe(ChessEngine.GameState.fromFen('7k/8/8/8/8/8/8/KR6 w - - 0 1')) is None  # no table
+    assert tables.probe(ChessEngine.GameState.fromFen('7k/8/8/8/8/8/8/K7 w - - 0 1')) == DRAW
+
+
+def testAddTableChecksSize():
+    with pytest.raises(ValueError):
+        Bitbases.Bitbases().addTable('KQvK', tableWithWin([56, 7, 57], True)[:-1])
+
+
+@pytest.fixture(scope='module')
+def bitbases(request, tmp_path_factory):
+    directory = Bitbases.BITBASE_DIR
+    if not all(os.path.exists(os.path.join(directory, name + Bitbases.FILE_SUFFIX)) for name in ('KQvK', 'KPvK')):
+        if not request.config.getoption('slow'):
+            pytest.skip('no KQvK and KPvK bitbases in %s, --slow generates them' % directory)
+        directory = str(tmp_path_factory.mktemp('bitbases'))  # KPvK needs every 3 piece ending, a few minutes
+        Bitbases.generate(['KQvK', 'KPvK'], directory, os.cpu_count() or 1)
+    tables = Bitbases.Bitbases(directory)
+    yield tables
+    tables.close()
+
+
+@pytest.mark.parametrize('fen, result', BITBASE_RESULTS)
+def testBitbaseProbe(bitbases, fen, result):
+    assert bitbases.probe(ChessEngine.GameState.fromFen(fen)) == result
@@ -0,0 +1,83 @@
+"""
+Match: SAN of the recorded moves, engine settings, and the Elo and SPRT arithmetic
+"""
+
+import math
+import pytest
+import ChessEngine, Match, UCI
+
+# (FEN, move in coordinates, SAN)
+SAN_MOVES = [
+    (ChessEngine.START_FEN, 'g1f3', 'Nf3'),
+    ('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1', 'e1g1', 'O-O'),
+    ('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1', 'e1c1', 'O-O-O'),
+    ('rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 2', 'e4d5', 'exd5'),
+    ('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1', 'e5d6', 'exd6'),  # en passant
+    ('8/4P2k/8/8/8/8/8/4K3 w - - 0 1', 'e7e8q', 'e8=Q'),
+    ('8/4P3/8/8/8/8/k7/4K3 w - - 0 1', 'e7e8n', 'e8=N'),
+    ('4k3/8/8/8/8/5N2/8/1N2K3 w - - 0 1', 'b1d2', 'Nbd2'),  # the other knight is on another file
+    ('4k3/8/8/8/R7/8/8/R3K3 w - - 0 1', 'a1a3', 'R1a3'),  # and on another rank
+    ('4k3/8/8/8/8/8/8/Q3K2Q w - - 0 1', 'a1a8', 'Qaa8+'),
+    ('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1', 'a1a8', 'Ra8#'),
+]
+
+
+# a MatchStats of engine1 with wins, draws and losses, half of the games with white
+def matchStats(wins, draws, losses, elo0=None, elo1=None):
+    stats = Match.MatchStats(elo0, elo1)
+    for i in range(wins):
+        stats.add({'result': '1-0' if i % 2 else '0-1', 'engine1White': i % 2 == 1})
+    for i in range(draws):
+        stats.add({'result': '1/2-1/2', 'engine1White': i % 2 == 1})
+    for i in range(losses):
+        stats.add({'result': '0-1' if i % 2 else '1-0', 'engine1White': i % 2 == 1})
+    return stats
+
+
+@pytest.mark.parametrize('fen, notation, san', SAN_MOVES)
+def testSanNotation(fen, notation, san):
+    gs = ChessEngine.GameState.fromFen(fen)
+    assert Match.sanNotation(gs, UCI.findMove(gs, notation).code) == san
+    assert gs.toFen() == fen  # the move is taken back
+
+
+def testParseEngine():
+    engine = Match.parseEngine('name=fast time=0.5 selective=0 LMR_MIN_MOVES=99 KILLER_SCORES=(5,4)',
+                               {'name': 'engine1', 'nodes': 0})
+    assert (engine['name'], engine['time'], engine['nodes'], engine['selective']) == ('fast', 0.5, 0, False)
+    assert engine['constants'] == {'LMR_MIN_MOVES': 99, 'KILLER_SCORES': (5, 4)}
+
+
+# limits and the table size come from the settings, constants of them would be ignored
+@pytest.mark.parametrize('text', ['TIME_LIMIT=1', 'NODE_LIMIT=100', 'HASH_SIZE_MB=64', 'NO_SUCH_CONSTANT=1',
+                                  'speed=1', 'time'])
+def testParseEngineRejects(text):
+    with pytest.raises(ValueError):
+        Match.parseEngine(text, {})
+
+
+def testEloConversion():
+    assert Match.eloScore(0) == 0.5
+    assert Match.eloScore(400) == pytest.approx(10/11)
+    assert Match.scoreElo(0.75) == pytest.approx(400 * math.log10(3))
+    assert Match.scoreElo(Match.eloScore(-123.4)) == pytest.approx(-123.4)
+
+
+def testMatchStats():
+    stats = matchStats(30, 40, 30)
+    assert (stats.games(), stats.wins, stats.draws, stats.losses, stats.score()) == (100, 30, 40, 30, 0.5)
+    assert stats.elo() == pytest.approx(0)
+    assert stats.variance() == pytest.approx(0.15)
+    margin = 1.96 * math.sqrt(0.15 / 100)
+    assert stats.eloError() == pytest.approx(Match.scoreElo(0.5 + margin))
+    assert stats.llr() == 0 and stats.sprtResult() is None  # no SPRT
+    assert matchStats(5, 0, 0).eloError() == float('inf')
+
+
+def testSprt():
+    stats = matchStats(120, 20, 60, 0, 10)  # score 0.65, variance 0.2025
+    score1 = Match.eloScore(10)
+    assert stats.llr() == pytest.approx(200 * (score1 - 0.5) * (1.3 - 0.5 - score1) / (2 * 0.2025))
+    assert stats.sprtResult() is None  # 2.03, H1 needs log(0.95/0.05) = 2.94
+    assert matchStats(240, 40, 120, 0, 10).sprtResult() == 'H1'
+    assert matchStats(120, 40, 240, 0, 10).sprtResult() == 'H0'
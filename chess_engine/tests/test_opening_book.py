@@ -0,0 +1,71 @@
+"""
+Polyglot opening book: the keys published with the book format, and lookups in a small book
+written by the tests
+"""
+
+import pytest
+import ChessEngine, OpeningBook
+
+START_FEN = ChessEngine.START_FEN
+CASTLING_FEN = 'r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1'
+
+# positions of the Polyglot specification with their keys
+POLYGLOT_KEYS = [
+    ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', 0x463B96181691FC9C),
+    ('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1', 0x823C9B50FD114196),
+    ('rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 2', 0x0756B94461C50FB0),
+    ('rnbqkbnr/ppp1pppp/8/3pP3/8/8/PPPP1PPP/RNBQKBNR b KQkq - 0 2', 0x662FAFB965DB29D4),
+    ('rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3', 0x22A48B5A8E47FF78),
+    ('rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPPKPPP/RNBQ1BNR b kq - 0 3', 0x652A607CA3F242C1),
+    ('rnbq1bnr/ppp1pkpp/8/3pPp2/8/8/PPPPKPPP/RNBQ1BNR w - - 0 4', 0x00FDD303C946BDD9),
+    ('rnbqkbnr/p1pppppp/8/8/PpP4P/8/1P1PPPP1/RNBQKBNR b KQkq c3 0 3', 0x3C8123EA7B067637),
+    ('rnbqkbnr/p1pppppp/8/8/P6P/R1p5/1P1PPPP1/1NBQKBNR b Kkq - 0 4', 0x5C3F9B829B279560),
+]
+
+
+# a move in coordinates (e2e4) the way a book writes it
+def bookMove(notation):
+    fromFile, fromRank, toFile, toRank = (('abcdefgh' if i % 2 == 0 else '12345678').index(notation[i])
+                                          for i in range(4))
+    return toFile | toRank << 3 | fromFile << 6 | fromRank << 9
+
+
+@pytest.fixture
+def book(tmp_path):
+    entries = [
+        (START_FEN, 'e2e4', 10),
+        (START_FEN, 'd2d4', 5),
+        (START_FEN, 'e2e5', 7),  # illegal, left out
+        (START_FEN, 'g1f3', 0),  # never played
+        (CASTLING_FEN, 'e1h1', 1),  # castling as the king taking its own rook
+    ]
+    data = sorted((OpeningBook.polyglotKey(ChessEngine.GameState.fromFen(fen)), bookMove(move), weight)
+                  for fen, move, weight in entries)
+    path = tmp_path / 'book.bin'
+    path.write_bytes(b''.join(OpeningBook.ENTRY.pack(key, move, weight, 0) for key, move, weight in data))
+    book = OpeningBook.OpeningBook(str(path))
+    yield book
+    book.close()
+
+
+@pytest.mark.parametrize('fen, key', POLYGLOT_KEYS)
+def testPolyglotKey(fen, key):
+    assert OpeningBook.polyglotKey(ChessEngine.GameState.fromFen(fen)) == key
+
+
+def testBookMoves(book):
+    moves = book.getMoves(ChessEngine.GameState())
+    assert [(move.getChessNotation(), weight) for move, weight in moves] == [('e2e4', 10), ('d2d4', 5), ('g1f3', 0)]
+    assert book.chooseMove(ChessEngine.GameState()).getChessNotation() in ('e2e4', 'd2d4')
+
+
+def testBookCastling(book):
+    moves = book.getMoves(ChessEngine.GameState.fromFen(CASTLING_FEN))
+    assert [move.getChessNotation() for move, weight in moves] == ['e1g1']
+    assert moves[0][0].isCastleMove
+
+
+def testPositionNotInBook(book):
+    gs = ChessEngine.GameState.fromFen(POLYGLOT_KEYS[1][0])
+    assert book.getMoves(gs) == []
+    assert book.chooseMove(gs) is None
@@ -0,0 +1,56 @@
+"""
+Profiler: the timing wrappers count every call, keep the call stacks apart and go away again
+"""
+
+import io
+import pytest
+import ChessEngine, Bitboards, Perft, Profiler, SmartMoveFinder
+
+
+@pytest.fixture
+def profiler():
+    profiler = Profiler.Profiler()
+    profiler.enable()
+    yield profiler
+    profiler.disable()  # also when a test failed, the wrappers must not leak into other tests
+
+
+@pytest.mark.parametrize('gameClass', [ChessEngine.GameState, Bitboards.BitboardGameState])
+def testCallCounts(profiler, gameClass):
+    gs = gameClass()  # after enable, see Profiler
+    assert Perft.perft(gs, 2) == 400
+    label = gameClass.__name__ + '.generateValidMoves'
+    assert profiler.calls[label] == 21  # the root and its 20 children
+    assert profiler.calls['GameState.getCastleMoves'] == 21
+    assert profiler.stackTime[(label,)] > 0
+    assert (label, 'GameState.getCastleMoves') in profiler.stackTime
+
+
+def testDisableRestores():
+    originals = {name: ChessEngine.GameState.__dict__[name] for name in Profiler.HOT_METHODS
+                 if name in ChessEngine.GameState.__dict__}
+    scoreBoard = SmartMoveFinder.scoreBoard
+    profiler = Profiler.Profiler()
+    profiler.enable()
+    assert SmartMoveFinder.scoreBoard is not scoreBoard
+    profiler.disable()
+    assert SmartMoveFinder.scoreBoard is scoreBoard
+    assert all(ChessEngine.GameState.__dict__[name] is function for name, function in originals.items())
+    SmartMoveFinder.scoreBoard(ChessEngine.GameState())
+    assert profiler.calls['scoreBoard'] == 0
+
+
+def testReportAndCollapsedStacks(profiler, tmp_path):
+    SmartMoveFinder.scoreBoard(ChessEngine.GameState())
+    profiler.disable()
+    output = io.StringIO()
+    profiler.report(output)
+    lines = output.getvalue().splitlines()
+    assert lines[0].split() == ['function', 'calls', 'total', 's', '%', 'us/call']
+    assert lines[1].split()[:2] == ['scoreBoard', '1']
+    path = tmp_path / 'profile.folded'
+    profiler.writeCollapsed(str(path))
+    stacks = dict(line.rsplit(' ', 1) for line in path.read_text().splitlines())
+    # scoreBoard calls scorePosition, its time is split between the two stacks
+    timed = {'scoreBoard', 'scoreBoard;scorePosition'}
+    assert timed <= set(stacks) <= timed | {'other'}
@@ -0,0 +1,44 @@
+"""
+Known results the engine has to reproduce: perft counts and FEN round trips. Run from chess_engine:
+python -m pytest tests
+"""
+
+import pytest
+import ChessEngine, Bitboards, Perft
+
+BACKENDS = [ChessEngine.GameState, Bitboards.BitboardGameState]
+
+# positions with en passant squares and partial castling rights
+ROUND_TRIP_FENS = [
+    'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1',
+    'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3',
+    'rnbqkbnr/p1pppppp/8/8/PpP4P/8/1P1PPPP1/RNBQKBNR b KQkq c3 0 3',
+    'rnbqkbnr/p1pppppp/8/8/P6P/R1p5/1P1PPPP1/1NBQKBNR b Kkq - 0 4',
+]
+
+@pytest.mark.parametrize('gameClass', BACKENDS)
+@pytest.mark.parametrize('name, fen, counts', Perft.PERFT_POSITIONS)
+def testPerft(gameClass, name, fen, counts):
+    assert Perft.perft(gameClass.fromFen(fen), 3) == counts[2]
+
+
+@pytest.mark.parametrize('gameClass', BACKENDS)
+@pytest.mark.parametrize('fen', [fen for name, fen, counts in Perft.PERFT_POSITIONS] +
+                         ROUND_TRIP_FENS)
+def testFenRoundTrip(gameClass, fen):
+    gs = gameClass.fromFen(fen)
+    assert gs.toFen() == fen
+    assert gs.zobristKey == gs.computeZobristKey()
+
+
+@pytest.mark.parametrize('fen', [
+    'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e3 0 1',  # wrong rank for the side to move
+    'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq d3 0 1',  # no pawn in front
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR b KQkq e3 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - x 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBN w KQkq - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQ1BNR w KQkq - 0 1',
+])
+def testBadFen(fen):
+    with pytest.raises(ValueError):
+        ChessEngine.GameState.fromFen(fen)
@@ -0,0 +1,102 @@
+"""
+Search: move codes, forced mates, what a search leaves in its transposition table and the
+statistics it reports
+"""
+
+import pytest
+import ChessEngine, Bitboards, Perft, SmartMoveFinder
+from ChessEngine import Move
+from SmartMoveFinder import CHECKMATE, SearchStats
+from TranspositionTable import TranspositionTable
+
+BACKENDS = [ChessEngine.GameState, Bitboards.BitboardGameState]
+
+# positions with a forced mate for the side to move and the plies to mate
+FORCED_MATES = [
+    ('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1', 1),  # back rank
+    ('3r2k1/8/8/8/8/8/5PPP/6K1 b - - 0 1', 1),
+    ('r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4', 1),  # scholar's mate
+    ('7k/8/8/8/8/8/R7/1R4K1 w - - 0 1', 3),  # rook roller, either rook goes to the 7th rank
+]
+
+
+def quietSearch(maxDepth, table=None):
+    return SmartMoveFinder.Search(0, 0, maxDepth, 1, table=table, statsCallback=lambda stats: None)
+
+
+@pytest.mark.parametrize('gameClass', BACKENDS)
+@pytest.mark.parametrize('name, fen, counts', Perft.PERFT_POSITIONS)
+def testMoveCodeRoundTrip(gameClass, name, fen, counts):
+    gs = gameClass.fromFen(fen)
+    codes = gs.getValidMoveCodes()
+    assert len(set(codes)) == len(codes) == counts[0]
+    for code in codes:
+        move = Move.fromCode(code, gs.board)
+        assert move.code == code
+        # the UI builds its moves from the clicked squares
+        assert Move((move.startRow, move.startCol), (move.endRow, move.endCol), gs.board, move.isEnpassantMove,
+                    move.isCastleMove, move.promotionPiece or 'Q').code == code
+
+
+@pytest.mark.parametrize('fen, plies', FORCED_MATES)
+def testForcedMate(fen, plies):
+    gs = ChessEngine.GameState.fromFen(fen)
+    search = quietSearch(5)
+    move = search.run(gs)
+    assert search.score == CHECKMATE - plies  # for the side to move
+    assert SmartMoveFinder.matePlies(search.score) == plies
+    assert len(search.pv) == plies and search.pv[0] == move.code
+    for code in search.pv:
+        gs.makeMove(code)
+    assert gs.inCheck() and not gs.getValidMoveCodes()
+
+
+def testTableKeepsResult():
+    gs = ChessEngine.GameState.fromFen(Perft.PERFT_POSITIONS[1][1])
+    table = TranspositionTable(1)
+    first = quietSearch(3, table)
+    first.run(gs)
+    entry = table.probe(gs.zobristKey)
+    assert entry is not None and entry[1] == first.depth and entry[4] == first.bestMove
+    # a second search in the same table starts from what the first one left
+    second = quietSearch(3, table)
+    second.run(gs)
+    assert second.stats.ttHits > 0
+    assert second.stats.nodes < first.stats.nodes
+
+
+def testSearchWithoutTableKeepsItsOwn():
+    gs = ChessEngine.GameState.fromFen(Perft.PERFT_POSITIONS[1][1])
+    search = quietSearch(2)
+    search.run(gs)
+    assert search.table is not SmartMoveFinder.transpositionTable
+    assert SmartMoveFinder.transpositionTable.probe(gs.zobristKey) is None
+
+
+def testStatsPerIteration():
+    gs = ChessEngine.GameState.fromFen(Perft.PERFT_POSITIONS[1][1])
+    reported = []
+    search = SmartMoveFinder.Search(0, 0, 3, 1, statsCallback=reported.append)
+    move = search.run(gs)
+    assert [stats.depth for stats in reported] == [1, 2, 3, 3]
+    assert [stats.final for stats in reported] == [False, False, False, True]
+    final = reported[-1]
+    assert final is search.stats
+    assert final.bestMove == move.code == final.pv[0]
+    assert len(final.iterationTimes) == 3
+    assert 0 < final.qnodes < final.nodes
+    assert 0 < final.ttHits <= final.ttProbes
+    assert 0 < final.firstMoveCutoffs <= final.betaCutoffs <= final.interiorNodes
+    # counters only grow from one iteration to the next
+    for name in SearchStats.COUNTERS:
+        assert [getattr(stats, name) for stats in reported] == sorted(getattr(stats, name) for stats in reported)
+
+
+def testStatsAdd():
+    total, part = SearchStats(), SearchStats()
+    part.nodes, part.ttProbes, part.seldepth = 10, 4, 7
+    total.add(part)
+    total.add(part)
+    assert (total.nodes, total.ttProbes, total.seldepth) == (20, 8, 7)
+    total.add(part, -1)
+    assert (total.nodes, total.ttProbes) == (10, 4)
@@ -0,0 +1,86 @@
+"""
+UCI: the position and go commands and the info lines a search sends
+"""
+
+import io
+import pytest
+import ChessEngine, UCI
+
+
+@pytest.fixture
+def engine():
+    engine = UCI.UCIEngine(io.StringIO())
+    yield engine
+    engine.handle('quit')
+
+
+# lines the engine sent since the last call
+def sent(engine):
+    lines = engine.output.getvalue().splitlines()
+    engine.output.seek(0)
+    engine.output.truncate()
+    return lines
+
+
+# run go and wait for its bestmove, the search has to end on its own
+def goAndWait(engine, args):
+    engine.handle('go ' + args)
+    engine.searchThread.join()
+    return sent(engine)
+
+
+def testHandshake(engine):
+    engine.handle('uci')
+    engine.handle('isready')
+    lines = sent(engine)
+    assert lines[0].startswith('id name ')
+    assert lines[-2:] == ['uciok', 'readyok']
+
+
+def testPosition(engine):
+    engine.handle('position startpos moves e2e4 e7e5 g1f3')
+    assert engine.gs.toFen() == 'rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2'
+    engine.handle('position fen 4k3/8/8/8/8/8/4P3/4K3 w - - 0 1 moves e2e4')
+    assert engine.gs.toFen() == '4k3/8/8/8/4P3/8/8/4K3 b - e3 0 1'
+    assert sent(engine) == []
+
+
+def testBadPosition(engine):
+    engine.handle('position startpos moves e2e4')
+    engine.handle('position fen 4k3/8/8/8/8/8/8/8 w - - 0 1')  # no white king
+    assert sent(engine) == ['info string bad fen 4k3/8/8/8/8/8/8/8 w - - 0 1']
+    assert engine.gs.toFen() == 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1'
+    engine.handle('position startpos moves e2e4 e7e4 d7d5')
+    assert sent(engine) == ['info string illegal move e7e4']
+    assert engine.gs.toFen() == 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1'
+
+
+def testGoLimits(engine):
+    engine.handle('position startpos moves e2e4')
+    lines = goAndWait(engine, 'wtime 60000 btime 30000 winc 1000 binc 500 movestogo 20 nodes 5000 depth 2')
+    search = engine.search
+    assert search.timeLimit == UCI.timeForMove(30000, 500, 20)  # black's clock
+    assert (search.nodeLimit, search.maxDepth) == (5000, 2)
+    assert [line.split()[2] for line in lines if line.startswith('info')] == ['1', '2']
+    assert lines[-1].startswith('bestmove ')
+    goAndWait(engine, 'movetime 1000 depth 1')
+    assert engine.search.timeLimit == pytest.approx(1 - UCI.MOVE_OVERHEAD)
+
+
+def testTimeForMove():
+    assert UCI.timeForMove(30000, 0, 30) == pytest.approx(1 - UCI.MOVE_OVERHEAD)
+    assert UCI.timeForMove(30000, 1000, None) == pytest.approx(1.8 - UCI.MOVE_OVERHEAD)
+    assert UCI.timeForMove(1000, 0, 1) == pytest.approx(0.5 - UCI.MOVE_OVERHEAD)  # at most half the clock
+    assert UCI.timeForMove(0, 0, None) == 0.01
+
+
+@pytest.mark.parametrize('fen, mate, bestmove', [
+    ('7k/8/8/8/8/8/R7/1R4K1 w - - 0 1', 'mate 2', None),  # either rook goes to the 7th rank
+    ('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1', 'mate 1', 'bestmove a1a8'),
+    ('k7/8/1K6/2p5/8/8/8/7R b - - 0 1', 'mate -1', None),  # Rh8 mates after either move
+])
+def testMateScore(engine, fen, mate, bestmove):
+    engine.handle('position fen ' + fen)
+    lines = goAndWait(engine, 'depth 4')
+    assert ' score %s ' % mate in lines[-2]
+    assert bestmove is None or lines[-1] == bestmove